@@ -0,0 +1,306 @@
+"""
+Server-side aggregation over the dynamic tables.
+
+Every grouped or measured TableField is joined once onto `records` through an
+aliased `record_values` row, so a whole report compiles into a single
+GROUP BY statement that runs in the database.
+
+Table analytics (per-field summaries for the charts) are computed the same
+way and cached per table data version in the shared cache, see table_analytics.
+"""
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import Integer, and_, cast, func
+from sqlalchemy.orm import aliased
+
+from app import db
+from cache import cache
+from models import Record, RecordValue, TableField, TablePermission
+from helpers import get_permitted_records_query, get_change_cursor
+
+AGGREGATE_FUNCTIONS = {
+    'count': func.count,
+    'sum': func.sum,
+    'avg': func.avg,
+    'min': func.min,
+    'max': func.max
+}
+
+# strftime-style patterns used to bucket date fields, per database dialect
+DATE_BUCKET_FORMATS = {
+    'sqlite': {'day': '%Y-%m-%d', 'week': '%Y-W%W', 'month': '%Y-%m', 'year': '%Y'},
+    'postgresql': {'day': 'YYYY-MM-DD', 'week': 'IYYY-"W"IW', 'month': 'YYYY-MM', 'year': 'YYYY'},
+    'mysql': {'day': '%Y-%m-%d', 'week': '%x-W%v', 'month': '%Y-%m', 'year': '%Y'}
+}
+
+class AggregationError(ValueError):
+    """Raised when a report specification does not match the table definition"""
+
+def value_column(alias, field):
+    """Return the typed record_values column holding the data of a field"""
+    if field.field_type == 'number':
+        return alias.number_value
+    if field.field_type == 'date':
+        return alias.date_value
+    return alias.text_value
+
+def date_bucket(column, bucket):
+    """Truncate a date column to a day, week, month or year label in SQL"""
+    dialect = db.session.get_bind().dialect.name
+    formats = DATE_BUCKET_FORMATS.get(dialect, DATE_BUCKET_FORMATS['postgresql'])
+
+    if bucket not in formats:
+        raise AggregationError(f'Regroupement de date inconnu: {bucket}')
+
+    if dialect == 'sqlite':
+        return func.strftime(formats[bucket], column)
+    if dialect == 'mysql':
+        return func.date_format(column, formats[bucket])
+    return func.to_char(column, formats[bucket])
+
+def parse_group_by(spec):
+    """Split a "field" or "field:bucket" group-by specification"""
+    name, _, bucket = spec.partition(':')
+    return name, bucket or None
+
+def parse_metric(spec):
+    """Split a "count" or "function:field" metric specification"""
+    function, _, name = spec.partition(':')
+    return function, name or None
+
+def metric_key(function, field_name):
+    return f'{function}_{field_name}' if field_name else function
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+def aggregate_table(table, group_by=(), metrics=('count',), user=None, limit=None):
+    """
+    Run a group-by aggregation over the records of a table
+
+    Args:
+        table (Table): Table to aggregate
+        group_by (list): Field names to group by, with an optional date bucket
+            for date fields (e.g. "date_paiement:month")
+        metrics (list): "count" or "function:field" (e.g. "sum:montant")
+        user (User, optional): User whose permissions scope the records
+        limit (int, optional): Maximum number of groups to return
+
+    Returns:
+        dict: Rows keyed by group and metric names, plus chart labels and datasets
+    """
+    fields = {field.name: field for field in TableField.query.filter_by(table_id=table.id).all()}
+    joined = {}
+
+    def join_for(name):
+        if name not in fields:
+            raise AggregationError(f'Champ inconnu: {name}')
+        if name not in joined:
+            joined[name] = aliased(RecordValue, name=f'rv_{len(joined)}')
+        return joined[name]
+
+    group_columns = []
+    group_keys = []
+    for spec in group_by:
+        name, bucket = parse_group_by(spec)
+        alias = join_for(name)
+        column = value_column(alias, fields[name])
+        if bucket:
+            if fields[name].field_type != 'date':
+                raise AggregationError(f'Le champ "{name}" n\'est pas une date.')
+            column = date_bucket(column, bucket)
+        group_columns.append(column.label(f'g{len(group_columns)}'))
+        group_keys.append(name)
+
+    metric_columns = []
+    metric_keys = []
+    for spec in metrics:
+        function, name = parse_metric(spec)
+        if function not in AGGREGATE_FUNCTIONS:
+            raise AggregationError(f'Fonction d\'agrégation inconnue: {function}')
+        if name is None:
+            if function != 'count':
+                raise AggregationError(f'La fonction "{function}" nécessite un champ.')
+            column = func.count(Record.id)
+        else:
+            alias = join_for(name)
+            field = fields[name]
+            if function in ('sum', 'avg') and field.field_type != 'number':
+                raise AggregationError(f'Le champ "{name}" n\'est pas numérique.')
+            column = AGGREGATE_FUNCTIONS[function](value_column(alias, field))
+        metric_columns.append(column.label(f'm{len(metric_columns)}'))
+        metric_keys.append(metric_key(function, name))
+
+    if not metric_columns:
+        raise AggregationError('Au moins une mesure est requise.')
+
+    query = db.session.query(*group_columns, *metric_columns).select_from(Record)
+    for name, alias in joined.items():
+        query = query.outerjoin(alias, and_(alias.record_id == Record.id, alias.field_id == fields[name].id))
+    query = get_permitted_records_query(table.id, user, query=query)
+
+    if group_columns:
+        query = query.group_by(*group_columns).order_by(*group_columns)
+    if limit:
+        query = query.limit(limit)
+
+    rows = []
+    labels = []
+    for result in query.all():
+        groups = [_json_value(value) for value in result[:len(group_columns)]]
+        values = [_json_value(value) for value in result[len(group_columns):]]
+        row = dict(zip(group_keys, groups))
+        row.update(zip(metric_keys, values))
+        rows.append(row)
+        labels.append(' / '.join('-' if value is None else str(value) for value in groups) or table.display_name)
+
+    return {
+        'table': table.name,
+        'group_by': list(group_by),
+        'metrics': metric_keys,
+        'rows': rows,
+        'labels': labels,
+        'datasets': [
+            {'label': key, 'data': [row[key] for row in rows]}
+            for key in metric_keys
+        ]
+    }
+
+# Number of histogram buckets for number fields
+HISTOGRAM_BUCKETS = 10
+
+# Largest date range, in days, charted per day, week and month (beyond: per year)
+DATE_BUCKET_SPANS = [(31, 'day'), (183, 'week'), (5 * 366, 'month')]
+
+# Seconds analytics are cached; the key changes with the records anyway
+ANALYTICS_CACHE_TTL = 3600
+
+def _floor(expression):
+    """Round a non-negative expression down to an integer in SQL"""
+    if db.session.get_bind().dialect.name == 'sqlite':
+        # CAST truncates on SQLite, which has no FLOOR before 3.35
+        return cast(expression, Integer)
+    return func.floor(expression)
+
+def permission_scope(table_id, user):
+    """Return a hashable description of the records a user can see, shared by users with the same scope"""
+    if user.is_editor():
+        return 'all'
+    permissions = TablePermission.query.filter_by(user_id=user.id, table_id=table_id).all()
+    if any(p.all_access for p in permissions):
+        return 'all'
+    return tuple(sorted((p.field_id, p.match_value) for p in permissions if p.field_id and p.match_value))
+
+def _field_values(field, records):
+    """Query the non-empty values of a field, restricted to the permitted records when given"""
+    column = value_column(RecordValue, field)
+    query = db.session.query(column).filter(RecordValue.field_id == field.id, column.isnot(None))
+    if records is not None:
+        query = query.filter(RecordValue.record_id.in_(records))
+    return query, column
+
+def _dropdown_summary(field, records):
+    query, column = _field_values(field, records)
+    counts = dict(query.with_entities(column, func.count()).group_by(column).all())
+    # Options without records are charted too, in the order of the field definition
+    values = {option: counts.pop(option, 0) for option in field.get_options()}
+    values.update(sorted(counts.items()))
+    return {'values': [{'name': name, 'value': count} for name, count in values.items()]}
+
+def _number_summary(field, records):
+    query, column = _field_values(field, records)
+    count, minimum, maximum, mean = query.with_entities(
+        func.count(column), func.min(column), func.max(column), func.avg(column)
+    ).one()
+    summary = {'count': count, 'min': minimum, 'max': maximum, 'mean': _json_value(mean), 'buckets': []}
+    if not count:
+        return summary
+
+    buckets = HISTOGRAM_BUCKETS if maximum > minimum else 1
+    width = (maximum - minimum) / buckets or 1
+    counts = [0] * buckets
+    index = _floor((column - minimum) / width)
+    for bucket, bucket_count in query.with_entities(index, func.count()).group_by(index).all():
+        # The maximum falls on the upper edge of the last bucket
+        counts[min(int(bucket), buckets - 1)] += bucket_count
+
+    summary['buckets'] = [
+        {'from': round(minimum + i * width, 6), 'to': round(minimum + (i + 1) * width, 6) if buckets > 1 else maximum, 'value': counts[i]}
+        for i in range(buckets)
+    ]
+    return summary
+
+def _date_summary(field, records):
+    query, column = _field_values(field, records)
+    count, first, last = query.with_entities(func.count(column), func.min(column), func.max(column)).one()
+    summary = {'count': count, 'min': _json_value(first), 'max': _json_value(last), 'bucket': None, 'values': []}
+    if not count:
+        return summary
+
+    span = (last - first).days
+    bucket = next((name for limit, name in DATE_BUCKET_SPANS if span <= limit), 'year')
+    label = date_bucket(column, bucket)
+    summary['bucket'] = bucket
+    summary['values'] = [
+        {'name': name, 'value': bucket_count}
+        for name, bucket_count in query.with_entities(label, func.count()).group_by(label).order_by(label).all()
+    ]
+    return summary
+
+FIELD_SUMMARIES = {
+    'dropdown': _dropdown_summary,
+    'number': _number_summary,
+    'date': _date_summary
+}
+
+def compute_table_analytics(table, fields, user):
+    """Compute the record count and the summary of every dropdown, number and date field in SQL"""
+    total, last_created = get_permitted_records_query(
+        table.id, user, query=db.session.query(func.count(Record.id), func.max(Record.created_at)).select_from(Record)
+    ).one()
+
+    scoped = permission_scope(table.id, user) != 'all'
+    records = get_permitted_records_query(table.id, user).with_entities(Record.id) if scoped else None
+
+    return {
+        'table_id': table.id,
+        'records': total,
+        'last_created_at': _json_value(last_created),
+        'fields': [
+            {
+                'name': field.name,
+                'display_name': field.display_name,
+                'field_type': field.field_type,
+                **FIELD_SUMMARIES[field.field_type](field, records)
+            }
+            for field in fields if field.field_type in FIELD_SUMMARIES
+        ]
+    }
+
+def table_analytics(table, user):
+    """
+    Return the per-field summaries of a table, cached until its records change
+
+    The cache is keyed by the change feed position of the table, so any insert,
+    update or delete recomputes it, and by the permission scope and field
+    definitions, so users only share results computed over the same records.
+    The results are shared by the worker processes through the cache.
+
+    Args:
+        table (Table): Table to summarize
+        user (User): User whose permissions scope the records
+
+    Returns:
+        dict: Record count, last creation date and per-field summaries
+    """
+    fields = TableField.query.filter_by(table_id=table.id).order_by(TableField.order).all()
+    signature = tuple((field.id, field.name, field.field_type, field.options) for field in fields)
+    key = (table.id, permission_scope(table.id, user), signature, get_change_cursor(table.id))
+    return cache.get_or_set(
+        'analytics', key, lambda: compute_table_analytics(table, fields, user), ttl=ANALYTICS_CACHE_TTL
+    )
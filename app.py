@@ -4,16 +4,15 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from sqlalchemy.orm import DeclarativeBase
-
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+from engine_profiles import engine_options, apply_engine_profile, archive_url
+from routing import RoutingSession, REPLICA_BIND, ARCHIVE_BIND, replica_url
 
 # Define SQLAlchemy base class
 class Base(DeclarativeBase):
     pass
 
 # Initialize extensions
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={"class_": RoutingSession})
 login_manager = LoginManager()
 
 # Create the app
@@ -23,9 +22,102 @@ app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
 # Configure the database
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///scout_manager.db")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
+# Pool and connection settings depend on the backend, see engine_profiles.py
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
+
+# Optional read replica for the read-only views, see routing.py
+app.config["READ_YOUR_WRITES_SECONDS"] = int(os.environ.get("READ_YOUR_WRITES_SECONDS", 10))
+_replica_url = replica_url(app.config["SQLALCHEMY_DATABASE_URI"], os.environ.get("DATABASE_REPLICA_URL"))
+app.config["SQLALCHEMY_BINDS"] = {}
+if _replica_url:
+    app.config["SQLALCHEMY_BINDS"][REPLICA_BIND] = {"url": _replica_url, **engine_options(_replica_url)}
+
+# Database of the archived records, see archive.py
+_archive_url = archive_url(app.config["SQLALCHEMY_DATABASE_URI"], os.environ.get("ARCHIVE_DATABASE_URL"))
+app.config["SQLALCHEMY_BINDS"][ARCHIVE_BIND] = {"url": _archive_url, **engine_options(_archive_url)}
+
+# Logging level applied by the entry points (main.py, run_local.py)
+app.config["LOG_LEVEL"] = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+# Seconds between two runs of `flask precompute-reports --loop`, see reports.py
+app.config["REPORT_SCHEDULER_INTERVAL"] = int(os.environ.get("REPORT_SCHEDULER_INTERVAL", 900))
+
+# Changes newer than this are held back from the change feed, so that a transaction still
+# committing with a lower sequence number is not skipped (SQLite serializes writers)
+app.config["CHANGE_FEED_SETTLE_SECONDS"] = float(os.environ.get(
+    "CHANGE_FEED_SETTLE_SECONDS",
+    0 if app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite") else 2
+))
+
+# Hours during which a retried record creation returns the original result, see idempotency.py
+app.config["IDEMPOTENCY_KEY_TTL_HOURS"] = float(os.environ.get("IDEMPOTENCY_KEY_TTL_HOURS", 24))
+
+# Request instrumentation: query counts, timings and per-endpoint query budgets
+app.config["SERVER_TIMING_HEADER"] = os.environ.get("SERVER_TIMING_HEADER") == "1"
+app.config["TRACK_MEMORY"] = os.environ.get("TRACK_MEMORY") == "1"
+# Every endpoint has a budget: tests fail when a change adds queries to a route (see
+# tests/test_query_budgets.py), production logs a warning. Record writes run one
+# insert per value, so their budgets allow tables of about 20 fields. None: no
+# budget, for routes whose queries grow with the records they delete or create.
+app.config["QUERY_BUDGET_DEFAULT"] = int(os.environ.get("QUERY_BUDGET_DEFAULT", 10))
+app.config["QUERY_BUDGETS"] = {
+    "static": 0,
+    "index": 1,
+    "login": 3,
+    "register": 3,
+    "logout": 1,
+    "settings": 1,
+    "change_password": 3,
+    "dashboard": 30,
+    "tables": 3,
+    "export_table_pdf": 6,
+    "table_records": 5,
+    "table_rows": 8,
+    "table_changes": 5,
+    "aggregate_table_records": 6,
+    "table_analytics_data": 10,
+    "print_record": 6,
+    "view_record": 6,
+    "add_record": 2,
+    "add_table_record": 30,
+    "api_create_record": 30,
+    "api_create_records": None,
+    "edit_record": 30,
+    "delete_record": 12,
+    "manage_users": 2,
+    "add_user": 4,
+    "edit_user": 4,
+    "delete_user": 6,
+    "manage_tables": 2,
+    "add_table": 4,
+    "edit_table": 4,
+    "delete_table": None,
+    "manage_fields": 3,
+    "add_field": 6,
+    "edit_field": 10,
+    "delete_field": None,
+    "reorder_fields": 3,
+    "request_metrics": 1,
+    "tenants_overview": 1,
+    "aggregate_tenant_records": 1,
+    "manage_print_templates": 2,
+    "print_generic_text": 2,
+    "get_active_template": 2,
+    "print_asset": 0,
+    "update_print_template": 4,
+    "reports": 4,
+    "view_report": 6,
+    "manage_reports": 6,
+    "update_report_template": 6,
+    "delete_report_template": 4,
+    "manage_table_permissions": 6,
+    "delete_table_permission": 3,
+    "bulk_grant_permissions": 6,
+    "manage_generic_text": 3,
+    "get_generic_text_content": 2,
+    "export_table": 5,
+    "table_archive": 5,
+    "export_table_archive": 4,
 }
 
 # Initialize extensions with app
@@ -35,24 +127,71 @@ login_manager.login_view = 'login'
 login_manager.login_message = 'Veuillez vous connecter pour accéder à cette page.'
 login_manager.login_message_category = 'warning'
 
-# Create tables
+from instrumentation import init_instrumentation, watch_pool
+init_instrumentation(app)
+
+# Optional batching of record submissions into shared transactions, see group_commit.py
+from group_commit import init_group_commit
+init_group_commit(app)
+
+# Pool of warm wkhtmltopdf renderers for ?format=pdf on the print pages, see pdf_renderer.py
+from pdf_renderer import init_pdf_renderer
+init_pdf_renderer(app)
+
+# Cache shared by the worker processes, see cache.py
+from cache import init_cache
+init_cache(app)
+
+# Logos and CSS of the print templates, stored and served locally, see print_assets.py
+from print_assets import init_print_assets
+init_print_assets(app)
+
+# Cached default print template and generic texts, see print_cache.py
+from print_cache import init_print_cache
+init_print_cache(app)
+
+# Online backups and restores, see backup.py
+from backup import init_backup
+init_backup(app)
+
+# Versioned schema migrations, see migrations/__init__.py
+from migrations import init_migrations
+init_migrations(app)
+
+# Scout groups with a database each, selected at login, see tenants.py
+from tenants import init_tenants
+init_tenants(app)
+
+# Engines are created by init_app; connections are only opened on first use
 with app.app_context():
-    # Import models to ensure they're registered with SQLAlchemy
-    from models import User, Table, TableField, Record, RecordValue
-    
-    db.create_all()
-    
-    # Check if default tables exist, if not create them
-    from helpers import initialize_default_tables
-    initialize_default_tables()
-    
-    # Check if super admin exists, if not create one
-    from helpers import create_default_admin
-    create_default_admin()
-
-# Import user loader
-from models import User
+    for bind_key, engine in db.engines.items():
+        apply_engine_profile(engine)
+        watch_pool(engine, bind_key or 'default')
+
+# Users are loaded from the identity stored in the session, see identity.py
+from identity import init_identity, load_session_user
+init_identity(app)
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return load_session_user(user_id)
+
+def configure_logging(level=None):
+    """Set up logging for an entry point; importing the app never changes logging"""
+    logging.basicConfig(level=level or app.config["LOG_LEVEL"])
+
+def create_app():
+    """
+    Return the application with its routes and CLI commands registered
+
+    Creating the app does not touch the database: run `flask bootstrap`
+    (or bootstrap.bootstrap_database) to create the schema and default data.
+    """
+    import routes  # noqa: F401
+    import reports  # noqa: F401
+    import bootstrap  # noqa: F401
+    import archive  # noqa: F401
+    import backup  # noqa: F401
+    import migrations  # noqa: F401
+    import tenants  # noqa: F401
+    return app
@@ -0,0 +1,190 @@
+"""
+Archiving of old records.
+
+Records not modified for Table.archive_after_days days (or the --days of the
+CLI) are moved out of `records` and `record_values`, so the working tables
+keep only the current seasons. Each record is copied with its values to
+`archived_records` on the archive bind, then deleted from the working tables
+with a delete entry in the change feed, so synced clients drop it too.
+
+Records are moved in batches, each copied and committed to the archive
+before it is deleted: an interrupted run loses nothing and the next run
+finishes it. Archived records are searched and exported from the archive
+pages of each table.
+
+    flask --app main archive-records [--table cotisation] [--days 730]
+
+Configuration:
+    ARCHIVE_DATABASE_URL: Database of the archive. By default, a SQLite
+        primary is archived to a <name>_archive.db file next to it, and other
+        databases keep the archive in their own archived_records table (see
+        engine_profiles.archive_url).
+"""
+import logging
+from datetime import datetime, timedelta
+
+import click
+from flask_login import current_user
+from sqlalchemy import delete, false, func, or_
+
+from app import app, db
+from models import ArchivedRecord, Record, RecordUniqueKey, RecordValue, Table, TableField, TablePermission
+from helpers import build_record_rows, log_record_change
+from group_commit import begin_write_transaction
+
+logger = logging.getLogger(__name__)
+
+# Records moved per transaction
+ARCHIVE_BATCH_SIZE = 500
+
+class ArchiveError(RuntimeError):
+    """Raised when records cannot be archived without losing data"""
+
+def archive_table_records(table, cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Move the records of a table not modified since cutoff to the archive
+
+    Args:
+        table (Table): Table to archive
+        cutoff (datetime): Records last modified before this date are moved
+        batch_size (int): Records moved per transaction
+
+    Returns:
+        int: Number of records archived
+
+    Raises:
+        ArchiveError: A record has the id of an archived record
+    """
+    fields = TableField.query.filter_by(table_id=table.id).order_by(TableField.order).all()
+    last_change = func.coalesce(Record.modified_at, Record.created_at)
+    archived = 0
+
+    while True:
+        records = Record.query.filter(
+            Record.table_id == table.id, last_change < cutoff
+        ).order_by(Record.id).limit(batch_size).all()
+        if not records:
+            return archived
+
+        ids = [record.id for record in records]
+        rows = {row['id']: row for row in build_record_rows([(record.id, record.created_at) for record in records], fields)}
+        snapshots = {
+            record_id: {field.name: row[field.name] for field in fields}
+            for record_id, row in rows.items()
+        }
+
+        # Copy first: records copied by an interrupted run are already there
+        already = {
+            row.id: row for row in db.session.query(ArchivedRecord.id, ArchivedRecord.table_id, ArchivedRecord.created_at)
+            .filter(ArchivedRecord.id.in_(ids))
+        }
+        # An id already archived for another record was reused by the database: deleting
+        # the live record would lose it, as the archive keeps the older one
+        reused = [
+            record.id for record in records
+            if record.id in already and (already[record.id].table_id, already[record.id].created_at) != (table.id, record.created_at)
+        ]
+        if reused:
+            db.session.rollback()
+            raise ArchiveError(
+                f'Les enregistrements {", ".join(map(str, reused))} de {table.name} réutilisent le numéro '
+                f'd\'un enregistrement archivé : archivage interrompu.'
+            )
+        for record in records:
+            if record.id in already:
+                continue
+            copy = ArchivedRecord(
+                id=record.id,
+                table_id=table.id,
+                created_by=record.created_by,
+                created_at=record.created_at,
+                modified_at=record.modified_at
+            )
+            copy.set_values(snapshots[record.id])
+            db.session.add(copy)
+        db.session.commit()
+
+        begin_write_transaction()
+        for record in records:
+            log_record_change(table.id, record.id, 'delete', snapshots[record.id])
+        db.session.execute(delete(RecordUniqueKey).where(RecordUniqueKey.record_id.in_(ids)))
+        db.session.execute(delete(RecordValue).where(RecordValue.record_id.in_(ids)))
+        db.session.execute(delete(Record).where(Record.id.in_(ids)))
+        db.session.commit()
+
+        archived += len(records)
+        logger.info('Archived %d records of %s', archived, table.name)
+
+def archive_records(table_name=None, days=None, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Archive the old records of every table with an archive delay, or of one table
+
+    Args:
+        table_name (str, optional): Only archive this table
+        days (int, optional): Archive records older than this, instead of Table.archive_after_days
+
+    Returns:
+        dict: Number of records archived by table name
+    """
+    query = Table.query.order_by(Table.id)
+    if table_name:
+        query = query.filter(Table.name == table_name)
+
+    result = {}
+    for table in query.all():
+        delay = days or table.archive_after_days
+        if not delay:
+            continue
+        cutoff = datetime.utcnow() - timedelta(days=delay)
+        result[table.name] = archive_table_records(table, cutoff, batch_size)
+    return result
+
+def archived_records_query(table_id, search=None, user=None):
+    """
+    Build a query over the archived records of a table that the user is allowed to see
+
+    Read-only users see the archived records matching their TablePermission
+    rows, as in get_permitted_records_query.
+
+    Args:
+        table_id (int): ID of the table
+        search (str, optional): Text the values must contain, case insensitive
+        user (User, optional): User to scope for, defaults to current_user
+
+    Returns:
+        Query: ArchivedRecord query, newest first
+    """
+    user = user or current_user
+    query = ArchivedRecord.query.filter(ArchivedRecord.table_id == table_id)
+
+    if not user.is_editor():
+        permissions = TablePermission.query.filter_by(user_id=user.id, table_id=table_id).all()
+        if not any(p.all_access for p in permissions):
+            field_ids = {p.field_id for p in permissions if p.field_id and p.match_value}
+            names = dict(db.session.query(TableField.id, TableField.name).filter(TableField.id.in_(field_ids)).all()) if field_ids else {}
+            # Values are stored with json.dumps: a "name": "value" pair only matches that field
+            conditions = [
+                ArchivedRecord.values.contains(ArchivedRecord.encode_pair(names[p.field_id], p.match_value), autoescape=True)
+                for p in permissions if p.field_id in names and p.match_value
+            ]
+            query = query.filter(or_(*conditions)) if conditions else query.filter(false())
+
+    if search:
+        query = query.filter(ArchivedRecord.search_text.contains(search.strip().lower(), autoescape=True))
+
+    return query.order_by(ArchivedRecord.created_at.desc(), ArchivedRecord.id.desc())
+
+@app.cli.command('archive-records')
+@click.option('--table', 'table_name', help='Only archive this table (technical name).')
+@click.option('--days', type=int, help='Archive records not modified for this many days, for every table.')
+@click.option('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE, show_default=True, help='Records moved per transaction.')
+def archive_records_command(table_name, days, batch_size):
+    """Move old records to the archive."""
+    try:
+        result = archive_records(table_name, days, batch_size)
+    except ArchiveError as e:
+        raise click.ClickException(str(e))
+    if not result:
+        print('Aucune table à archiver : définissez "Archiver après (jours)" sur les tables, ou utilisez --days.')
+    for name, count in result.items():
+        print(f'{name}: {count} enregistrement(s) archivé(s)')
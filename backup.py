@@ -0,0 +1,412 @@
+"""
+Online backup and restore of the databases.
+
+    flask --app main backup [--output /srv/backups]
+    flask --app main restore instance/backups/scouts-20250301-020000.db.gz [--table records ...]
+
+Backups are taken while the application runs. A SQLite database is copied
+with SQLite's backup API, BACKUP_PAGES_PER_STEP pages at a time, inside one
+read transaction: the copy is the database as it was when the backup
+started, and in WAL mode the workers keep committing while it runs. Other
+databases are dumped table by table in one REPEATABLE READ transaction, as
+gzipped JSON lines. Either way the backup is streamed to a .gz file, so
+memory use does not depend on the size of the database.
+
+Each database gets its own file: scouts-<date>.db.gz (.jsonl.gz for a dump)
+for the application data, and scouts-archive-<date>.db.gz for the archived
+records when they are kept in a separate database (see archive.py). The
+files of a scout group carry its name (scouts@<group>-<date>.db.gz): back
+groups up with `flask tenants run backup`, see tenants.py.
+
+A restore replaces the whole database, or only the given tables. Tables not
+restored keep their rows: restore tables that refer to each other together
+(e.g. records, record_values and record_unique_keys). After a restore the
+caches and the signed-in users are reloaded, and the schema is brought up
+to date when the backup is older than the application.
+
+Configuration:
+    BACKUP_FOLDER: Folder of the backups (default: backups in the instance
+        folder)
+    BACKUP_PAGES_PER_STEP: SQLite pages copied per step (default 256, 1 MB
+        with 4 KB pages)
+    BACKUP_STEP_PAUSE: Seconds between two steps, leaving the disk to the
+        workers (default 0.005)
+    BACKUP_KEEP: Backups kept per database, older ones are deleted after a
+        backup (default 0: keep them all)
+"""
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import date, datetime
+
+import click
+from flask import current_app
+from sqlalchemy import Date, DateTime, create_engine, delete, false, func, inspect, select
+
+from app import app, db
+from engine_profiles import is_memory_database
+from routing import current_tenant
+from tenants import current_engine
+
+logger = logging.getLogger(__name__)
+
+BACKUP_FORMAT = 'scouts-backup'
+# Databases backed up, by bind key, with the name of their backup files
+BACKUP_NAMES = {None: 'scouts', 'archive': 'scouts-archive'}
+BACKUP_FILENAME = re.compile(r'^(?P<name>.+)-\d{8}-\d{6}\.(?P<kind>db|jsonl)\.gz$')
+
+# Rows read and inserted at a time
+BACKUP_BATCH_SIZE = 1000
+
+# Cache namespaces filled from the database, reloaded after a restore
+RESTORED_CACHE_NAMESPACES = ('dashboard', 'analytics', 'print_settings', 'generic_texts', 'report_templates')
+
+class BackupError(Exception):
+    """Raised when a backup cannot be taken or restored; the message is shown to the user"""
+
+def _backup_name(bind_key):
+    """Return the name of the backup files of a bind, in the current group"""
+    tenant = current_tenant()
+    return f'{BACKUP_NAMES[bind_key]}@{tenant}' if tenant else BACKUP_NAMES[bind_key]
+
+def _databases():
+    """
+    Return the databases to back up, as (name, engine, tables)
+
+    A bind kept in the same database as another one is backed up with it.
+    """
+    databases = {}
+    for bind_key in BACKUP_NAMES:
+        name = _backup_name(bind_key)
+        engine = current_engine(bind_key)
+        metadata = db.metadatas.get(bind_key)
+        tables = list(metadata.sorted_tables) if metadata is not None else []
+        url = engine.url.render_as_string(hide_password=False)
+        if url in databases:
+            databases[url][2].extend(tables)
+        else:
+            databases[url] = (name, engine, tables)
+    return list(databases.values())
+
+def _write_gzip(path, write):
+    """Write a .gz file through a temporary file, so a backup is never left half written"""
+    temporary = f'{path}.{os.getpid()}.tmp'
+    try:
+        with gzip.open(temporary, 'wb', compresslevel=6) as f:
+            write(f)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+def _snapshot_sqlite(engine, path):
+    """Copy a live SQLite database to path, one step of pages at a time"""
+    pages = current_app.config['BACKUP_PAGES_PER_STEP']
+    pause = current_app.config['BACKUP_STEP_PAUSE']
+    connection = engine.raw_connection()
+    try:
+        source = connection.driver_connection
+        target = sqlite3.connect(path)
+        try:
+            # Every step copies the snapshot of this read transaction: in WAL mode it
+            # does not block the writers, and their commits do not restart the copy
+            source.execute('BEGIN')
+            source.execute('SELECT count(*) FROM sqlite_master').fetchone()
+            source.backup(target, pages=pages, progress=lambda status, remaining, total: time.sleep(pause))
+            source.rollback()
+
+            result = target.execute('PRAGMA quick_check').fetchone()[0]
+            if result != 'ok':
+                raise BackupError(f'La copie de la base est invalide : {result}')
+        finally:
+            target.close()
+    finally:
+        connection.close()
+
+def _backup_sqlite(engine, path):
+    folder = os.path.dirname(path)
+    handle, snapshot = tempfile.mkstemp(suffix='.db', dir=folder)
+    os.close(handle)
+    try:
+        _snapshot_sqlite(engine, snapshot)
+
+        def write(output):
+            with open(snapshot, 'rb') as f:
+                shutil.copyfileobj(f, output, 1024 * 1024)
+        _write_gzip(path, write)
+    finally:
+        os.remove(snapshot)
+
+def _encode(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Cannot back up a {type(value).__name__}')
+
+def _dump_database(engine, name, tables, path):
+    """Stream the rows of the tables to gzipped JSON lines, from one consistent snapshot"""
+    def write(output):
+        with engine.connect() as connection:
+            connection.execution_options(isolation_level='REPEATABLE READ')
+            with connection.begin():
+                header = {
+                    'format': BACKUP_FORMAT,
+                    'name': name,
+                    'created_at': datetime.utcnow().isoformat(),
+                    'tables': [table.name for table in tables]
+                }
+                output.write((json.dumps(header) + '\n').encode('utf-8'))
+                for table in tables:
+                    columns = [column.name for column in table.columns]
+                    output.write((json.dumps({'table': table.name, 'columns': columns}) + '\n').encode('utf-8'))
+                    result = connection.execution_options(yield_per=BACKUP_BATCH_SIZE).execute(select(table))
+                    for row in result:
+                        output.write((json.dumps(list(row), default=_encode) + '\n').encode('utf-8'))
+    _write_gzip(path, write)
+
+def _prune_backups(folder, name, keep):
+    """Delete the oldest backups of a database, keeping the last ones"""
+    backups = sorted(
+        filename for filename in os.listdir(folder)
+        if (match := BACKUP_FILENAME.match(filename)) and match.group('name') == name
+    )
+    for filename in backups[:-keep]:
+        os.remove(os.path.join(folder, filename))
+        logger.info('Deleted old backup %s', filename)
+
+def backup_database(folder=None):
+    """
+    Back up every database of the application
+
+    Args:
+        folder (str, optional): Folder of the backups, defaults to BACKUP_FOLDER
+
+    Returns:
+        list: Paths of the backup files written
+
+    Raises:
+        BackupError: A database cannot be backed up
+    """
+    folder = folder or current_app.config['BACKUP_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    keep = current_app.config['BACKUP_KEEP']
+
+    paths = []
+    for name, engine, tables in _databases():
+        started = time.perf_counter()
+        if engine.dialect.name == 'sqlite':
+            if is_memory_database(engine.url):
+                raise BackupError('Une base de données en mémoire ne peut pas être sauvegardée.')
+            path = os.path.join(folder, f'{name}-{stamp}.db.gz')
+            _backup_sqlite(engine, path)
+        else:
+            path = os.path.join(folder, f'{name}-{stamp}.jsonl.gz')
+            _dump_database(engine, name, tables, path)
+        logger.info('Backed up %s to %s in %.1f s', name, path, time.perf_counter() - started)
+        paths.append(path)
+        if keep:
+            _prune_backups(folder, name, keep)
+    return paths
+
+def _decoder(column):
+    if isinstance(column.type, DateTime):
+        return lambda value: datetime.fromisoformat(value) if value is not None else None
+    if isinstance(column.type, Date):
+        return lambda value: date.fromisoformat(value) if value is not None else None
+    return None
+
+def _read_dump(path, tables_by_name):
+    """Yield (table name, column names, row) from a JSON lines dump"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        f.readline()
+        columns = decoders = None
+        for line in f:
+            item = json.loads(line)
+            if isinstance(item, dict):
+                name = item['table']
+                table = tables_by_name.get(name)
+                columns = item['columns']
+                decoders = [
+                    _decoder(table.c[column]) if table is not None and column in table.c else None
+                    for column in columns
+                ]
+                continue
+            yield name, columns, [decode(value) if decode else value for decode, value in zip(decoders, item)]
+
+def _read_snapshot(engine, tables, present):
+    """Yield (table name, column names, row) from a SQLite backup, for the columns it has"""
+    inspector = inspect(engine)
+    with engine.connect() as connection:
+        for table in tables:
+            if table.name not in present:
+                continue
+            names = {column['name'] for column in inspector.get_columns(table.name)}
+            columns = [column for column in table.columns if column.name in names]
+            result = connection.execution_options(yield_per=BACKUP_BATCH_SIZE).execute(select(*columns))
+            column_names = [column.name for column in columns]
+            for row in result:
+                yield table.name, column_names, row
+
+def _load_rows(engine, tables, rows):
+    """Replace the rows of tables by rows, in one transaction"""
+    selected = {table.name for table in tables}
+    tables_by_name = {table.name: table for table in tables}
+    with engine.begin() as connection:
+        # Rows that refer to others first
+        for table in reversed(tables):
+            connection.execute(delete(table))
+
+        batch, batch_table = [], None
+        for name, columns, row in rows:
+            if name not in selected:
+                continue
+            if batch and name != batch_table:
+                connection.execute(tables_by_name[batch_table].insert(), batch)
+                batch = []
+            table = tables_by_name[name]
+            batch_table = name
+            batch.append({column: value for column, value in zip(columns, row) if column in table.c})
+            if len(batch) >= BACKUP_BATCH_SIZE:
+                connection.execute(table.insert(), batch)
+                batch = []
+        if batch:
+            connection.execute(tables_by_name[batch_table].insert(), batch)
+
+        if engine.dialect.name == 'postgresql':
+            # Explicit ids do not advance the sequences
+            for table in tables:
+                column = table.autoincrement_column
+                if column is not None:
+                    connection.execute(select(func.setval(
+                        func.pg_get_serial_sequence(table.name, column.name),
+                        func.coalesce(select(func.max(column)).scalar_subquery(), 0) + 1,
+                        false()
+                    )))
+
+def _check_tables(backup_tables, database_tables, tables, path):
+    """Check that a backup belongs to the database, and has the tables to restore"""
+    names = {table.name for table in database_tables}
+    known = {table.name for _, _, all_tables in _databases() for table in all_tables}
+    foreign = (set(backup_tables) & known) - names
+    if foreign or not set(backup_tables) & names:
+        raise BackupError(f'{os.path.basename(path)} n\'est pas une sauvegarde de cette base de données.')
+
+    missing = [name for name in tables or [] if name not in names or name not in backup_tables]
+    if missing:
+        raise BackupError(f'Table(s) absente(s) de la base ou de la sauvegarde : {", ".join(missing)}')
+
+def _refresh_after_restore(name):
+    from cache import cache
+    from identity import touch_identity_epoch
+
+    if name == _backup_name(None):
+        # Bring a backup older than the application up to date; the other groups are left alone
+        from bootstrap import bootstrap_current_database
+        bootstrap_current_database()
+    for namespace in RESTORED_CACHE_NAMESPACES:
+        cache.invalidate(namespace)
+    touch_identity_epoch()
+
+def restore_backup(path, tables=None):
+    """
+    Restore a backup written by backup_database, into the database it was taken from
+
+    Args:
+        path (str): Backup file; its name tells the database it belongs to
+        tables (list, optional): Only restore these tables, the others keep their rows
+
+    Returns:
+        list: Names of the tables restored
+
+    Raises:
+        BackupError: The file is not a backup of this application, or lacks a table
+    """
+    match = BACKUP_FILENAME.match(os.path.basename(path))
+    databases = {name: (engine, database_tables) for name, engine, database_tables in _databases()}
+    if match is None or match.group('name') not in databases:
+        raise BackupError(f'{os.path.basename(path)} n\'est pas un fichier de sauvegarde connu.')
+    name = match.group('name')
+    engine, database_tables = databases[name]
+    restored = [table for table in database_tables if tables is None or table.name in tables]
+
+    if match.group('kind') == 'jsonl':
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+        if header.get('format') != BACKUP_FORMAT:
+            raise BackupError(f'{os.path.basename(path)} n\'est pas un fichier de sauvegarde connu.')
+        _check_tables(header['tables'], database_tables, tables, path)
+        _load_rows(engine, restored, _read_dump(path, {table.name: table for table in database_tables}))
+    else:
+        folder = current_app.config['BACKUP_FOLDER']
+        os.makedirs(folder, exist_ok=True)
+        handle, snapshot = tempfile.mkstemp(suffix='.db', dir=folder)
+        try:
+            with os.fdopen(handle, 'wb') as output, gzip.open(path, 'rb') as f:
+                shutil.copyfileobj(f, output, 1024 * 1024)
+
+            snapshot_engine = create_engine(f'sqlite:///{snapshot}')
+            try:
+                present = set(inspect(snapshot_engine).get_table_names())
+                _check_tables(present, database_tables, tables, path)
+                if tables is None and engine.dialect.name == 'sqlite':
+                    # The whole file at once, with the tables the application does not declare
+                    connection = engine.raw_connection()
+                    try:
+                        source = sqlite3.connect(snapshot)
+                        try:
+                            source.backup(connection.driver_connection)
+                        finally:
+                            source.close()
+                    finally:
+                        connection.close()
+                    engine.dispose()
+                else:
+                    _load_rows(engine, restored, _read_snapshot(snapshot_engine, restored, present))
+            finally:
+                snapshot_engine.dispose()
+        finally:
+            os.remove(snapshot)
+
+    logger.info('Restored %d tables of %s from %s', len(restored), name, path)
+    _refresh_after_restore(name)
+    return [table.name for table in restored]
+
+def init_backup(app):
+    """Read the backup settings"""
+    app.config.setdefault('BACKUP_FOLDER', os.environ.get('BACKUP_FOLDER', os.path.join(app.instance_path, 'backups')))
+    app.config.setdefault('BACKUP_PAGES_PER_STEP', int(os.environ.get('BACKUP_PAGES_PER_STEP', 256)))
+    app.config.setdefault('BACKUP_STEP_PAUSE', float(os.environ.get('BACKUP_STEP_PAUSE', 0.005)))
+    app.config.setdefault('BACKUP_KEEP', int(os.environ.get('BACKUP_KEEP', 0)))
+
+@app.cli.command('backup')
+@click.option('--output', 'folder', type=click.Path(file_okay=False), help='Folder of the backups (default: BACKUP_FOLDER).')
+def backup_command(folder):
+    """Back up the databases while the application runs."""
+    try:
+        paths = backup_database(folder)
+    except BackupError as e:
+        raise click.ClickException(str(e))
+    for path in paths:
+        print(f'Sauvegarde écrite : {path}')
+
+@app.cli.command('restore')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--table', 'tables', multiple=True, help='Only restore this table; repeat the option for several tables.')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def restore_command(path, tables, yes):
+    """Restore a backup, entirely or only some tables."""
+    target = f'les tables {", ".join(tables)}' if tables else 'toute la base de données'
+    if not yes:
+        click.confirm(f'Remplacer {target} par le contenu de {os.path.basename(path)} ?', abort=True)
+    try:
+        restored = restore_backup(path, list(tables) or None)
+    except BackupError as e:
+        raise click.ClickException(str(e))
+    print(f'{len(restored)} table(s) restaurée(s) depuis {os.path.basename(path)}.')
@@ -0,0 +1,22 @@
+"""
+Reproducible performance measurements for the Scout Management application.
+
+    benchmarks.generate  Populate the configured database with synthetic tables,
+                         records, users and table permissions
+    benchmarks.run       Time the main routes through the Flask test client
+                         and write the results to a JSON file
+    benchmarks.loadtest  Replay concurrent user sessions against the app
+                         running under gunicorn with several workers
+    benchmarks.startup   Measure the import and bootstrap time of a worker
+    benchmarks.migrate   Apply the schema migrations to a downgraded copy of
+                         the database while records are added
+
+Both commands use the database from DATABASE_URL, so point it at a scratch
+database before generating data.
+"""
+
+BENCH_PASSWORD = 'bench-password'
+ADMIN_USERNAME = 'bench_admin'
+EDITOR_USERNAME = 'bench_editor'
+READONLY_USERNAME = 'bench_readonly_{}'
+TABLE_PREFIX = 'bench_'
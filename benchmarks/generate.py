@@ -0,0 +1,187 @@
+"""
+Synthetic data generator.
+
+Creates N tables with M fields each and K records per table, plus an editor
+and read-only users with a mix of TablePermission rows (full access, a single
+dropdown value, several values, or nothing at all).
+
+Usage:
+    DATABASE_URL=sqlite:////tmp/bench.db python -m benchmarks.generate --tables 4 --fields 8 --records 50000
+"""
+import argparse
+import random
+import string
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from app import app, db
+from bootstrap import bootstrap_database
+from models import User, Table, TableField, Record, RecordValue, TablePermission, ROLE_ADMIN, ROLE_EDITOR, ROLE_READONLY
+from benchmarks import BENCH_PASSWORD, ADMIN_USERNAME, EDITOR_USERNAME, READONLY_USERNAME, TABLE_PREFIX
+
+FIELD_TYPES = ['text', 'number', 'date', 'dropdown']
+
+FIRST_NAMES = ['Adam', 'Yasmine', 'Omar', 'Salma', 'Youssef', 'Imane', 'Mehdi', 'Nour', 'Ilyas', 'Sara',
+               'Hamza', 'Aya', 'Amine', 'Hiba', 'Rayan', 'Lina', 'Anas', 'Malak', 'Zakaria', 'Douae']
+LAST_NAMES = ['Alaoui', 'Bennani', 'Idrissi', 'Tazi', 'Fassi', 'Berrada', 'Chraibi', 'Naciri', 'Lahlou', 'Kettani']
+
+def weighted_options(rng, count):
+    """Return dropdown options with Zipf-like weights, as real choices are rarely uniform"""
+    options = [f'Option {i + 1}' for i in range(count)]
+    weights = [1.0 / (i + 1) for i in range(count)]
+    rng.shuffle(weights)
+    return options, weights
+
+def random_text(rng):
+    if rng.random() < 0.7:
+        return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 40)))
+
+def random_amount(rng):
+    # Most payments are small, a few are large
+    return round(rng.lognormvariate(4, 0.6), 2)
+
+def random_date(rng, today):
+    # Activity is concentrated in the scout season (September to June)
+    while True:
+        day = today - timedelta(days=rng.randint(0, 3 * 365))
+        if day.month not in (7, 8) or rng.random() < 0.2:
+            return day
+
+def get_or_create_user(username, role):
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        user = User(username=username, email=f'{username}@example.com', role=role)
+        user.set_password(BENCH_PASSWORD)
+        db.session.add(user)
+    return user
+
+def create_users(readonly_users):
+    get_or_create_user(ADMIN_USERNAME, ROLE_ADMIN)
+    editor = get_or_create_user(EDITOR_USERNAME, ROLE_EDITOR)
+    users = [get_or_create_user(READONLY_USERNAME.format(i), ROLE_READONLY) for i in range(readonly_users)]
+
+    db.session.commit()
+    return editor, users
+
+def create_table(index, field_count, rng):
+    table = Table(name=f'{TABLE_PREFIX}{index}', display_name=f'Benchmark {index}', description='Données synthétiques')
+    db.session.add(table)
+    db.session.flush()
+
+    fields = []
+    weights = {}
+    for i in range(field_count):
+        field_type = FIELD_TYPES[i % len(FIELD_TYPES)]
+        field = TableField(
+            table_id=table.id,
+            name=f'{field_type}_{i}',
+            display_name=f'{field_type.capitalize()} {i}',
+            field_type=field_type,
+            required=i < 2,
+            order=i + 1
+        )
+        if field_type == 'dropdown':
+            options, option_weights = weighted_options(rng, rng.randint(3, 10))
+            field.set_options(options)
+            weights[field.name] = option_weights
+        db.session.add(field)
+        fields.append(field)
+
+    db.session.flush()
+    return table, fields, weights
+
+def create_records(table, fields, weights, count, created_by, rng, batch_size=5000):
+    """Bulk insert records and their values with Core executemany statements"""
+    # Plain tuples, so the loop does not touch ORM instances expired by each commit
+    columns = [
+        (field.id, field.field_type, field.required, field.get_options(), weights.get(field.name))
+        for field in fields
+    ]
+    next_record_id = (db.session.query(func.max(Record.id)).scalar() or 0) + 1
+    now = datetime.utcnow()
+    today = now.date()
+
+    for start in range(0, count, batch_size):
+        records = []
+        values = []
+        for record_id in range(next_record_id + start, next_record_id + min(start + batch_size, count)):
+            created_at = now - timedelta(minutes=rng.randint(0, 2 * 365 * 24 * 60))
+            records.append({
+                'id': record_id,
+                'table_id': table.id,
+                'created_by': created_by,
+                'created_at': created_at,
+                'modified_at': created_at
+            })
+            for field_id, field_type, required, options, option_weights in columns:
+                if not required and rng.random() < 0.05:
+                    continue
+                value = {'record_id': record_id, 'field_id': field_id,
+                         'text_value': None, 'number_value': None, 'date_value': None}
+                if field_type == 'text':
+                    value['text_value'] = random_text(rng)
+                elif field_type == 'number':
+                    value['number_value'] = random_amount(rng)
+                elif field_type == 'date':
+                    value['date_value'] = random_date(rng, today)
+                else:
+                    value['text_value'] = rng.choices(options, option_weights)[0]
+                values.append(value)
+
+        db.session.execute(Record.__table__.insert(), records)
+        if values:
+            db.session.execute(RecordValue.__table__.insert(), values)
+        db.session.commit()
+
+def create_permissions(users, tables, rng):
+    """Give read-only users a realistic mix of permission shapes"""
+    for i, user in enumerate(users):
+        TablePermission.query.filter_by(user_id=user.id).delete()
+        for table, fields in tables:
+            dropdowns = [field for field in fields if field.field_type == 'dropdown']
+            shape = i % 4
+            if shape == 0:
+                db.session.add(TablePermission(user_id=user.id, table_id=table.id, all_access=True))
+            elif shape in (1, 2) and dropdowns:
+                field = rng.choice(dropdowns)
+                for option in rng.sample(field.get_options(), 1 if shape == 1 else min(3, len(field.get_options()))):
+                    db.session.add(TablePermission(
+                        user_id=user.id, table_id=table.id, field_id=field.id, match_value=option, all_access=False
+                    ))
+            # shape 3: no permission at all
+    db.session.commit()
+
+def generate(tables, fields, records, readonly_users, seed):
+    rng = random.Random(seed)
+    editor, users = create_users(readonly_users)
+
+    created = []
+    existing = Table.query.filter(Table.name.like(f'{TABLE_PREFIX}%')).count()
+    for index in range(existing, existing + tables):
+        table, table_fields, weights = create_table(index, fields, rng)
+        started = time.perf_counter()
+        create_records(table, table_fields, weights, records, editor.id, rng)
+        print(f'{table.name}: {records} enregistrements en {time.perf_counter() - started:.1f}s')
+        created.append((table, table_fields))
+
+    create_permissions(users, created, rng)
+    return created
+
+def main():
+    parser = argparse.ArgumentParser(description='Populate the database with synthetic benchmark data.')
+    parser.add_argument('--tables', type=int, default=4, help='Number of tables to create')
+    parser.add_argument('--fields', type=int, default=8, help='Number of fields per table')
+    parser.add_argument('--records', type=int, default=10000, help='Number of records per table')
+    parser.add_argument('--readonly-users', type=int, default=8, help='Number of read-only users')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed, for reproducible datasets')
+    args = parser.parse_args()
+
+    with app.app_context():
+        bootstrap_database()
+        generate(args.tables, args.fields, args.records, args.readonly_users, args.seed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,405 @@
+"""
+Multi-worker load test.
+
+Starts the application under gunicorn with several workers, logs in simulated
+admins, editors and read-only users, and replays a weighted mix of browsing,
+record creation and edition, exports and prints for a fixed duration. The
+report gives throughput, p50/p95/p99 latency per action and the error and
+lock-timeout rates, so contention between workers can be reproduced locally.
+
+Usage:
+    DATABASE_URL=sqlite:////tmp/bench.db python -m benchmarks.loadtest --workers 4 --editors 8 --duration 60
+    python -m benchmarks.loadtest --url http://127.0.0.1:5000 --profile write
+
+Run benchmarks.generate on the same database first.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import datetime
+
+from benchmarks import BENCH_PASSWORD, ADMIN_USERNAME, EDITOR_USERNAME, READONLY_USERNAME, TABLE_PREFIX
+
+# Relative weights of the actions each role performs, per profile
+PROFILES = {
+    'read': {
+        'admin': {'browse': 6, 'view': 3, 'print': 1},
+        'editor': {'browse': 6, 'view': 3, 'print': 1},
+        'readonly': {'browse': 6, 'view': 3, 'print': 1}
+    },
+    'mixed': {
+        'admin': {'browse': 3, 'view': 2, 'edit': 3, 'print': 1, 'export': 1},
+        'editor': {'browse': 4, 'view': 2, 'add': 3, 'print': 1, 'print_table': 1},
+        'readonly': {'browse': 5, 'view': 3, 'print': 1, 'export': 1}
+    },
+    'write': {
+        'admin': {'browse': 1, 'edit': 8, 'view': 1},
+        'editor': {'browse': 1, 'add': 8, 'view': 1},
+        'readonly': {'browse': 6, 'view': 4}
+    }
+}
+
+# Messages logged by the workers when a database lock could not be acquired in time
+LOCK_PATTERNS = re.compile(
+    r'database is locked|database table is locked|lock timeout|Lock wait timeout|'
+    r'deadlock detected|could not obtain lock|canceling statement due to lock timeout',
+    re.IGNORECASE
+)
+
+CSRF_PATTERN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+VERSION_PATTERN = re.compile(r'name="version" value="(\d+)"')
+
+class NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Report redirects as responses, so each action is timed on its own"""
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+class EditConflict(Exception):
+    """The record was changed by another user between loading and submitting the form"""
+
+class SimulatedUser(threading.Thread):
+    def __init__(self, base_url, role, username, weights, tables, stop_at, results, think_time, seed, timeout):
+        super().__init__(name=f'{role}-{username}', daemon=True)
+        self.base_url = base_url.rstrip('/')
+        self.role = role
+        self.username = username
+        self.weights = weights
+        self.tables = tables
+        self.stop_at = stop_at
+        self.results = results
+        self.think_time = think_time
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.seen_records = {table['id']: [] for table in tables}
+        self.location = None
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            NoRedirectHandler()
+        )
+
+    def request(self, path, data=None):
+        """Return (status, body); HTTP errors are returned, network errors raised"""
+        encoded = urllib.parse.urlencode(data, doseq=True).encode() if data is not None else None
+        try:
+            with self.opener.open(self.base_url + path, data=encoded, timeout=self.timeout) as response:
+                self.location = response.headers.get('Location')
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            self.location = e.headers.get('Location')
+            return e.code, e.read()
+
+    def login(self):
+        status, body = self.request('/login')
+        match = CSRF_PATTERN.search(body.decode('utf-8', 'replace'))
+        form = {'username': self.username, 'password': BENCH_PASSWORD}
+        if match:
+            form['csrf_token'] = match.group(1)
+        status, _ = self.request('/login', form)
+        if status != 302:
+            raise RuntimeError(f'Login failed for {self.username} (HTTP {status})')
+
+    def field_values(self, table):
+        values = {}
+        for field in table['fields']:
+            key = f'field_{field["id"]}'
+            if field['type'] == 'number':
+                values[key] = str(round(self.rng.lognormvariate(4, 0.6), 2))
+            elif field['type'] == 'date':
+                values[key] = f'2025-{self.rng.randint(1, 12):02d}-{self.rng.randint(1, 28):02d}'
+            elif field['type'] == 'dropdown' and field['options']:
+                values[key] = self.rng.choice(field['options'])
+            else:
+                values[key] = f'Charge {self.rng.randint(0, 10 ** 6)}'
+        return values
+
+    def pick_record(self, table):
+        seen = self.seen_records[table['id']]
+        return self.rng.choice(seen) if seen else None
+
+    def browse(self, table):
+        offset = self.rng.randint(0, max(0, table['records'] - 50))
+        status, body = self.request(f'/api/tables/{table["id"]}/rows?offset={offset}&limit=50')
+        if status == 200:
+            rows = json.loads(body).get('rows', [])
+            self.seen_records[table['id']] = [row['id'] for row in rows] or self.seen_records[table['id']]
+        return status
+
+    def run_action(self, action, table):
+        table_id = table['id']
+        if action == 'browse':
+            return self.browse(table)
+        if action == 'add':
+            # Submitted with an idempotency key, as the add form does
+            return self.request(f'/tables/{table_id}/add', {**self.field_values(table), 'idempotency_key': uuid.uuid4().hex})[0]
+        if action == 'export':
+            fields = [str(field['id']) for field in table['fields']]
+            return self.request(f'/tables/{table_id}/export', {'fields': fields})[0]
+        if action == 'print_table':
+            return self.request(f'/tables/{table_id}/records/pdf')[0]
+
+        record_id = self.pick_record(table)
+        if record_id is None:
+            return self.browse(table)
+        if action == 'view':
+            return self.request(f'/tables/{table_id}/records/{record_id}')[0]
+        if action == 'print':
+            return self.request(f'/tables/{table_id}/records/{record_id}/pdf')[0]
+        if action == 'edit':
+            return self.edit(table_id, record_id, table)
+        raise ValueError(f'Unknown action: {action}')
+
+    def edit(self, table_id, record_id, table):
+        """Load the edit form, then submit it with the version it was based on"""
+        url = f'/tables/{table_id}/records/{record_id}/edit'
+        status, body = self.request(url)
+        if status != 200:
+            return status
+
+        form = self.field_values(table)
+        match = VERSION_PATTERN.search(body.decode('utf-8', 'replace'))
+        if match:
+            form['version'] = match.group(1)
+        status, _ = self.request(url, form)
+        # A conflicting edit redirects back to the form instead of the list
+        if status == 302 and self.location and self.location.endswith('/edit'):
+            raise EditConflict()
+        return status
+
+    def run(self):
+        try:
+            self.login()
+        except (OSError, RuntimeError) as e:
+            self.results.add(self.role, 'login', None, 0.0, str(e))
+            return
+
+        actions = list(self.weights)
+        weights = [self.weights[action] for action in actions]
+        while time.monotonic() < self.stop_at:
+            action = self.rng.choices(actions, weights)[0]
+            table = self.rng.choice(self.tables)
+            started = time.perf_counter()
+            error = None
+            try:
+                status = self.run_action(action, table)
+            except EditConflict:
+                status, error = 302, 'conflict'
+            except (socket.timeout, TimeoutError):
+                status, error = None, 'timeout'
+            except OSError as e:
+                status, error = None, str(e)
+            self.results.add(self.role, action, status, time.perf_counter() - started, error)
+
+            if self.think_time:
+                time.sleep(self.rng.expovariate(1.0 / self.think_time))
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, role, action, status, duration, error=None):
+        with self.lock:
+            entry = self.samples.setdefault(f'{role}/{action}', {'latencies': [], 'statuses': {}, 'errors': {}})
+            entry['latencies'].append(duration * 1000)
+            entry['statuses'][str(status)] = entry['statuses'].get(str(status), 0) + 1
+            if error:
+                entry['errors'][error] = entry['errors'].get(error, 0) + 1
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def is_failure(status):
+    return status == 'None' or int(status) >= 500 or int(status) in (400, 403, 404)
+
+def summarize(samples, elapsed, lock_errors):
+    actions = {}
+    total = failures = 0
+    all_latencies = []
+    for key, entry in sorted(samples.items()):
+        latencies = entry['latencies']
+        failed = sum(count for status, count in entry['statuses'].items() if is_failure(status))
+        total += len(latencies)
+        failures += failed
+        all_latencies.extend(latencies)
+        actions[key] = {
+            'requests': len(latencies),
+            'throughput_rps': len(latencies) / elapsed,
+            'p50_ms': statistics.median(latencies),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'max_ms': max(latencies),
+            'error_rate': failed / len(latencies),
+            'statuses': entry['statuses'],
+            'errors': entry['errors']
+        }
+
+    return {
+        'requests': total,
+        'elapsed_s': elapsed,
+        'throughput_rps': total / elapsed if elapsed else 0.0,
+        'p50_ms': statistics.median(all_latencies) if all_latencies else None,
+        'p95_ms': percentile(all_latencies, 0.95) if all_latencies else None,
+        'p99_ms': percentile(all_latencies, 0.99) if all_latencies else None,
+        'error_rate': failures / total if total else 0.0,
+        'edit_conflicts': sum(entry['errors'].get('conflict', 0) for entry in samples.values()),
+        'lock_timeouts': lock_errors,
+        'lock_timeout_rate': lock_errors / total if total else 0.0,
+        'actions': actions
+    }
+
+def load_dataset():
+    """Read the benchmark tables and users from the database the server will use"""
+    from app import app, db
+    from models import User, Table, TableField, Record
+    from sqlalchemy import func
+
+    with app.app_context():
+        tables = []
+        for table in Table.query.filter(Table.name.like(f'{TABLE_PREFIX}%')).order_by(Table.id):
+            fields = TableField.query.filter_by(table_id=table.id).order_by(TableField.order).all()
+            tables.append({
+                'id': table.id,
+                'name': table.name,
+                'records': db.session.query(func.count(Record.id)).filter(Record.table_id == table.id).scalar(),
+                'fields': [
+                    {'id': field.id, 'type': field.field_type, 'options': field.get_options()}
+                    for field in fields
+                ]
+            })
+        readonly_users = User.query.filter(User.username.like(READONLY_USERNAME.format('%'))).count()
+        return tables, readonly_users, db.engine.dialect.name
+
+def start_server(workers, threads, port, log_path):
+    command = [
+        sys.executable, '-m', 'gunicorn',
+        '--workers', str(workers),
+        '--threads', str(threads),
+        '--bind', f'127.0.0.1:{port}',
+        '--timeout', '120',
+        '--config', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gunicorn.conf.py'),
+        'main:app'
+    ]
+    log = open(log_path, 'w')
+    process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, env=os.environ.copy())
+    return process, log
+
+def wait_until_ready(base_url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise SystemExit('Le serveur gunicorn s\'est arrêté au démarrage, voir le journal.')
+        try:
+            with urllib.request.urlopen(f'{base_url}/login', timeout=2):
+                return
+        except (OSError, urllib.error.URLError):
+            time.sleep(0.5)
+    raise SystemExit(f'Le serveur ne répond pas sur {base_url}')
+
+def count_lock_errors(log_path):
+    if not log_path or not os.path.exists(log_path):
+        return 0
+    with open(log_path, errors='replace') as log:
+        return sum(1 for line in log if LOCK_PATTERNS.search(line))
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay concurrent user sessions against the app under gunicorn.')
+    parser.add_argument('--url', default=None, help='Use an already running server instead of starting gunicorn')
+    parser.add_argument('--workers', type=int, default=4, help='Number of gunicorn workers')
+    parser.add_argument('--threads', type=int, default=1, help='Threads per gunicorn worker')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='mixed')
+    parser.add_argument('--admins', type=int, default=1, help='Simulated admins (edit records)')
+    parser.add_argument('--editors', type=int, default=4, help='Simulated editors (add records)')
+    parser.add_argument('--readonly', type=int, default=8, help='Simulated read-only users')
+    parser.add_argument('--duration', type=float, default=30, help='Test duration in seconds')
+    parser.add_argument('--ramp-up', type=float, default=2, help='Seconds over which the users log in')
+    parser.add_argument('--think-time', type=float, default=0.0, help='Mean pause between actions in seconds')
+    parser.add_argument('--timeout', type=float, default=60, help='Client timeout per request in seconds')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='loadtest_results.json')
+    parser.add_argument('--server-log', default=None, help='Server log file (default: a temporary file)')
+    args = parser.parse_args()
+
+    tables, readonly_available, dialect = load_dataset()
+    if not tables:
+        raise SystemExit('Aucune table de benchmark: lancez d\'abord python -m benchmarks.generate')
+    if args.readonly and not readonly_available:
+        raise SystemExit('Aucun utilisateur en lecture seule de benchmark.')
+
+    process = log = None
+    log_path = args.server_log
+    base_url = args.url
+    if base_url is None:
+        log_path = log_path or os.path.join(tempfile.gettempdir(), f'loadtest_server_{args.port}.log')
+        base_url = f'http://127.0.0.1:{args.port}'
+        process, log = start_server(args.workers, args.threads, args.port, log_path)
+
+    try:
+        wait_until_ready(base_url, process)
+
+        users = [('admin', ADMIN_USERNAME)] * args.admins + [('editor', EDITOR_USERNAME)] * args.editors
+        users += [('readonly', READONLY_USERNAME.format(i % readonly_available)) for i in range(args.readonly)]
+
+        results = Results()
+        started = time.monotonic()
+        stop_at = started + args.ramp_up + args.duration
+        threads = []
+        for i, (role, username) in enumerate(users):
+            thread = SimulatedUser(
+                base_url, role, username, PROFILES[args.profile][role], tables, stop_at,
+                results, args.think_time, args.seed + i, args.timeout
+            )
+            thread.start()
+            threads.append(thread)
+            time.sleep(args.ramp_up / max(1, len(users)))
+
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+            log.close()
+
+    summary = summarize(results.samples, elapsed, count_lock_errors(log_path))
+    report = {
+        'started_at': datetime.utcnow().isoformat(),
+        'database': dialect,
+        'server': {'url': base_url, 'workers': None if args.url else args.workers, 'threads': args.threads},
+        'profile': args.profile,
+        'users': {'admin': args.admins, 'editor': args.editors, 'readonly': args.readonly},
+        'think_time': args.think_time,
+        'summary': summary
+    }
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+
+    print(f'{"action":<24} {"req":>6} {"req/s":>7} {"p50":>8} {"p95":>8} {"p99":>8} {"erreurs":>8}')
+    for key, action in summary['actions'].items():
+        print(f'{key:<24} {action["requests"]:>6} {action["throughput_rps"]:>7.1f} {action["p50_ms"]:>8.0f} '
+              f'{action["p95_ms"]:>8.0f} {action["p99_ms"]:>8.0f} {action["error_rate"]:>8.1%}')
+    print(f'Total: {summary["requests"]} requêtes en {elapsed:.1f}s, {summary["throughput_rps"]:.1f} req/s, '
+          f'p95 {summary["p95_ms"] or 0:.0f} ms, erreurs {summary["error_rate"]:.1%}, '
+          f'conflits de modification {summary["edit_conflicts"]}, verrous expirés {summary["lock_timeouts"]}')
+    if log_path:
+        print(f'Journal du serveur: {log_path}')
+    print(f'Résultats écrits dans {args.output}')
+
+if __name__ == '__main__':
+    main()
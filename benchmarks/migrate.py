@@ -0,0 +1,185 @@
+"""
+Schema migration benchmark.
+
+Takes the database filled by benchmarks.generate back to the schema it had
+before the migrations (no record indexes, no tables.archive_after_days
+column, NULL all_access, unique fields without keys), then migrates it while a writer
+thread keeps adding records, and reports the time of every migration step
+and the latency of the writer's commits.
+
+With --interrupt, the migration first runs in a separate process killed
+after that many seconds, to check that the next run resumes from its
+checkpoint.
+
+Usage:
+    DATABASE_URL=sqlite:////tmp/bench.db python -m benchmarks.migrate --interrupt 2
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from sqlalchemy import delete, func, text, update
+
+from app import create_app, db
+from helpers import create_record
+from models import Table, TableField, RecordValue, RecordUniqueKey, SchemaMigration, User
+from migrations import migration_states, run_migrations
+from benchmarks import EDITOR_USERNAME, TABLE_PREFIX
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+app = create_app()
+
+INDEXES = ['ix_records_table_id', 'ix_record_values_record_field', 'ix_record_values_field_text']
+
+def downgrade():
+    """Return the benchmark database to its schema before the migrations"""
+    tables = Table.query.filter(Table.name.like(f'{TABLE_PREFIX}%')).all()
+    if not tables:
+        raise SystemExit('Lancez d\'abord benchmarks.generate sur cette base de données.')
+    unique_fields = [
+        TableField.query.filter_by(table_id=table.id, field_type='number').order_by(TableField.order).first().id
+        for table in tables
+    ]
+    db.session.remove()
+
+    with db.engine.begin() as connection:
+        for index_name in INDEXES:
+            connection.execute(text(f'DROP INDEX IF EXISTS {index_name}'))
+        connection.execute(text('ALTER TABLE tables DROP COLUMN archive_after_days'))
+        connection.execute(text('UPDATE table_permissions SET all_access = NULL'))
+        connection.execute(update(TableField.__table__).where(TableField.id.in_(unique_fields)).values(unique=True))
+        connection.execute(delete(RecordUniqueKey.__table__).where(RecordUniqueKey.field_id.in_(unique_fields)))
+        connection.execute(delete(SchemaMigration.__table__))
+    return tables[0].id
+
+def writer(table_id, interval, stop, latencies, errors):
+    """Add a record every interval seconds, as a user submitting forms, and time each commit"""
+    # Not seeded: values written by a previous run are still in the database
+    rng = random.Random()
+    with app.app_context():
+        editor = User.query.filter_by(username=EDITOR_USERNAME).first()
+        fields = TableField.query.filter_by(table_id=table_id).order_by(TableField.order).all()
+        while not stop.is_set():
+            form_data = {}
+            for field in fields:
+                if field.field_type == 'number':
+                    form_data[f'field_{field.id}'] = str(1_000_000 + len(latencies) + rng.random())
+                elif field.field_type == 'date':
+                    form_data[f'field_{field.id}'] = '2025-03-01'
+                elif field.field_type == 'dropdown':
+                    form_data[f'field_{field.id}'] = field.get_options()[0]
+                else:
+                    form_data[f'field_{field.id}'] = f'Migration {len(latencies)}'
+            started = time.perf_counter()
+            try:
+                create_record(table_id, fields, form_data, editor.id)
+                db.session.commit()
+                latencies.append((time.perf_counter() - started) * 1000)
+            except Exception as e:
+                db.session.rollback()
+                errors.append(str(e))
+            time.sleep(interval)
+
+class StepTimings(logging.Handler):
+    """Collect the "Migration 0001: expand done in 0.1 s" messages"""
+
+    def __init__(self):
+        super().__init__()
+        self.steps = []
+
+    def emit(self, record):
+        match = re.match(r'Migration (\d+): (\w+) done in ([\d.]+) s', record.getMessage())
+        if match:
+            self.steps.append({'version': match.group(1), 'step': match.group(2), 'seconds': float(match.group(3))})
+
+def interrupted_run(seconds):
+    """Start the migration in another process and kill it after seconds"""
+    process = subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'main', 'migrate'], cwd=ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(seconds)
+    process.kill()
+    process.wait()
+    return {
+        version: {'phase': state.phase, 'checkpoint': json.loads(state.checkpoint or '{}')}
+        for version, state in migration_states().items()
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the schema migrations on the benchmark database.')
+    parser.add_argument('--interval', type=float, default=0.02, help='Seconds between two records of the writer')
+    parser.add_argument('--interrupt', type=float, default=0, help='Kill a first run after this many seconds')
+    parser.add_argument('--output', default=None, help='Optional JSON file to write the results to')
+    args = parser.parse_args()
+
+    timings = StepTimings()
+    logging.getLogger('migrations').addHandler(timings)
+    logging.getLogger('migrations').setLevel(logging.INFO)
+
+    with app.app_context():
+        table_id = downgrade()
+        rows = db.session.query(func.count(RecordValue.id)).scalar()
+        db.session.remove()
+
+        latencies, errors = [], []
+        stop = threading.Event()
+        thread = threading.Thread(target=writer, args=(table_id, args.interval, stop, latencies, errors))
+        thread.start()
+        time.sleep(3)
+        idle = list(latencies)
+
+        states = interrupted_run(args.interrupt) if args.interrupt else None
+        started = time.perf_counter()
+        completed = run_migrations()
+        duration = time.perf_counter() - started
+
+        stop.set()
+        thread.join()
+
+    during = latencies[len(idle):]
+    results = {
+        'record_values': rows,
+        'interrupted_at': states,
+        'migrations': completed,
+        'migrate_seconds': round(duration, 2),
+        'steps': timings.steps,
+        'writer': {
+            'commits': len(during),
+            'errors': len(errors),
+            # The first commit warms the connection and the caches up
+            'idle_p50_ms': round(statistics.median(idle[1:]), 1) if len(idle) > 1 else None,
+            'p50_ms': round(statistics.median(during), 1) if during else None,
+            'p99_ms': round(sorted(during)[int(len(during) * 0.99)], 1) if during else None,
+            'max_ms': round(max(during), 1) if during else None
+        }
+    }
+
+    print(f'Valeurs d\'enregistrements: {rows}')
+    if states:
+        print(f'Interrompue après {args.interrupt:.0f} s:')
+        for version, state in states.items():
+            print(f'  {version} {state["phase"]:<10} {state["checkpoint"]}')
+    print(f'Migrations appliquées:     {", ".join(completed)} en {duration:.1f} s')
+    for step in timings.steps:
+        print(f'  {step["version"]} {step["step"]:<8} {step["seconds"]:7.1f} s')
+    writer_results = results['writer']
+    print(f'Écritures pendant la migration: {writer_results["commits"]} ({writer_results["errors"]} erreurs), '
+          f'p50 {writer_results["p50_ms"]} ms (au repos {writer_results["idle_p50_ms"]} ms), '
+          f'p99 {writer_results["p99_ms"]} ms, max {writer_results["max_ms"]} ms')
+    for error in sorted(set(errors)):
+        print(f'  Erreur: {error[:200]}')
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+End-to-end benchmark runner.
+
+Times the main routes through the Flask test client, for the benchmark
+editor and a read-only user, and writes the timings together with the query
+counts recorded by the instrumentation to a JSON file.
+
+Usage:
+    DATABASE_URL=sqlite:////tmp/bench.db python -m benchmarks.run --output bench_results.json
+    DATABASE_URL=sqlite:////tmp/bench.db python -m benchmarks.run --output after.json --compare bench_results.json
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+from sqlalchemy import func
+
+from app import create_app, db
+from models import User, Table, TableField, Record
+from instrumentation import get_endpoint_stats, reset_endpoint_stats
+from benchmarks import BENCH_PASSWORD, EDITOR_USERNAME, READONLY_USERNAME, TABLE_PREFIX
+
+app = create_app()
+
+def login(username):
+    client = app.test_client()
+    response = client.post('/login', data={'username': username, 'password': BENCH_PASSWORD})
+    if response.status_code != 302:
+        raise SystemExit(f'Impossible de se connecter en tant que {username}')
+    return client
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def scenarios(table, fields, record_id):
+    """Return (name, method, url, form data) for every benchmarked route"""
+    field_values = {}
+    for field in fields:
+        if field.field_type == 'number':
+            field_values[f'field_{field.id}'] = '42'
+        elif field.field_type == 'date':
+            field_values[f'field_{field.id}'] = '2025-01-01'
+        elif field.field_type == 'dropdown':
+            field_values[f'field_{field.id}'] = field.get_options()[0]
+        else:
+            field_values[f'field_{field.id}'] = 'Benchmark'
+
+    return [
+        ('dashboard', 'GET', '/dashboard', None),
+        ('table_records', 'GET', f'/tables/{table.id}/records', None),
+        ('table_records_full', 'GET', f'/tables/{table.id}/records?mode=full', None),
+        ('table_rows', 'GET', f'/api/tables/{table.id}/rows?limit=100', None),
+        ('view_record', 'GET', f'/tables/{table.id}/records/{record_id}', None),
+        ('export_table', 'POST', f'/tables/{table.id}/export', {'fields': [str(field.id) for field in fields]}),
+        ('export_table_pdf', 'GET', f'/tables/{table.id}/records/pdf', None),
+        ('add_table_record', 'POST', f'/tables/{table.id}/add', field_values)
+    ]
+
+def run_scenario(client, method, url, data, repeat):
+    timings = []
+    status = None
+    size = 0
+    reset_endpoint_stats()
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.open(url, method=method, data=data)
+        body = response.get_data()
+        response.close()
+        timings.append((time.perf_counter() - started) * 1000)
+        status = response.status_code
+        size = len(body)
+
+    stats = list(get_endpoint_stats().values())
+    return {
+        'status': status,
+        'bytes': size,
+        'min_ms': min(timings),
+        'median_ms': statistics.median(timings),
+        'p95_ms': percentile(timings, 0.95),
+        'max_ms': max(timings),
+        'queries': max((entry['max_queries'] for entry in stats), default=None),
+        'peak_memory_kb': max((entry['max_peak_memory_kb'] or 0 for entry in stats), default=None)
+    }
+
+def compare(results, previous_path):
+    """Print the median change of every scenario against a previous results file"""
+    with open(previous_path) as previous_file:
+        previous = json.load(previous_file)['results']
+
+    print(f'Comparaison avec {previous_path}:')
+    for key, result in results.items():
+        before = previous.get(key)
+        if not before:
+            continue
+        ratio = result['median_ms'] / before['median_ms'] if before['median_ms'] else float('inf')
+        print(f'{key:<30} {before["median_ms"]:8.1f} ms -> {result["median_ms"]:8.1f} ms  x{ratio:.2f}  '
+              f'({before["queries"]} -> {result["queries"]} requêtes)')
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the main routes through the Flask test client.')
+    parser.add_argument('--output', default='bench_results.json', help='JSON file to write the results to')
+    parser.add_argument('--repeat', type=int, default=5, help='Requests per route and user')
+    parser.add_argument('--readonly-user', type=int, default=1, help='Index of the benchmark read-only user')
+    parser.add_argument('--label', default=None, help='Free-form label stored with the results')
+    parser.add_argument('--compare', default=None, help='Previous results file to compare the medians against')
+    parser.add_argument('--only', nargs='*', default=None, help='Names of the scenarios to run (default: all)')
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['TRACK_MEMORY'] = True
+
+    with app.app_context():
+        table = Table.query.filter(Table.name.like(f'{TABLE_PREFIX}%')).order_by(Table.id).first()
+        if table is None:
+            raise SystemExit('Aucune table de benchmark: lancez d\'abord python -m benchmarks.generate')
+        fields = TableField.query.filter_by(table_id=table.id).order_by(TableField.order).all()
+        record_id = db.session.query(func.min(Record.id)).filter(Record.table_id == table.id).scalar()
+        dataset = {
+            'table': table.name,
+            'fields': len(fields),
+            'records': Record.query.filter_by(table_id=table.id).count(),
+            'total_records': Record.query.count(),
+            'users': User.query.count()
+        }
+        plan = scenarios(table, fields, record_id)
+        dialect = db.engine.dialect.name
+
+    results = {
+        'label': args.label,
+        'revision': git_revision(),
+        'started_at': datetime.utcnow().isoformat(),
+        'database': dialect,
+        'dataset': dataset,
+        'repeat': args.repeat,
+        'results': {}
+    }
+
+    users = {
+        'editor': EDITOR_USERNAME,
+        'readonly': READONLY_USERNAME.format(args.readonly_user)
+    }
+    for role, username in users.items():
+        client = login(username)
+        for name, method, url, data in plan:
+            if args.only and name not in args.only:
+                continue
+            result = run_scenario(client, method, url, data, args.repeat)
+            results['results'][f'{role}/{name}'] = result
+            print(f'{role:>8} {name:<20} {result["status"]} median {result["median_ms"]:8.1f} ms  '
+                  f'p95 {result["p95_ms"]:8.1f} ms  {result["queries"]} requêtes')
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    print(f'Résultats écrits dans {args.output}')
+
+    if args.compare:
+        compare(results['results'], args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Startup time measurement.
+
+Imports the application in fresh interpreters, as a gunicorn worker does on
+boot or reload, and reports the median import time, the time of an explicit
+database bootstrap and the slowest imported modules.
+
+Usage:
+    DATABASE_URL=sqlite:////tmp/bench.db python -m benchmarks.startup --repeat 10
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_APP = 'import main'
+BOOTSTRAP = (
+    'from main import app\n'
+    'from bootstrap import bootstrap_database\n'
+    'with app.app_context():\n'
+    '    bootstrap_database()\n'
+)
+
+def time_subprocess(code, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+def slowest_imports(code, count):
+    """Return the modules with the largest cumulative import time, from -X importtime"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)', line)
+        # Top-level modules and their direct imports
+        if match and len(match.group(3)) <= 5:
+            modules.append((int(match.group(2)) / 1000, match.group(4)))
+    return sorted(modules, reverse=True)[:count]
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the application startup time.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of fresh interpreters per measurement')
+    parser.add_argument('--output', default=None, help='Optional JSON file to write the results to')
+    args = parser.parse_args()
+
+    baseline = time_subprocess('pass', args.repeat)
+    app_import = time_subprocess(IMPORT_APP, args.repeat)
+    bootstrap = time_subprocess(BOOTSTRAP, args.repeat)
+
+    results = {
+        'interpreter_ms': statistics.median(baseline),
+        'import_app_ms': statistics.median(app_import),
+        'bootstrap_ms': statistics.median(bootstrap),
+        'slowest_imports': [
+            {'module': module, 'cumulative_ms': duration}
+            for duration, module in slowest_imports(IMPORT_APP, 10)
+        ]
+    }
+
+    print(f'Interpréteur seul:        {results["interpreter_ms"]:7.0f} ms')
+    print(f'Import de l\'application:  {results["import_app_ms"]:7.0f} ms')
+    print(f'Import + bootstrap:       {results["bootstrap_ms"]:7.0f} ms')
+    print('Imports les plus lents:')
+    for entry in results['slowest_imports']:
+        print(f'  {entry["module"]:<30} {entry["cumulative_ms"]:7.1f} ms')
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+if __name__ == '__main__':
+    main()
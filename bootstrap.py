@@ -0,0 +1,67 @@
+"""
+Database bootstrap for the Scout Management application.
+
+Creates the schema, applies the pending migrations (see migrations/), and
+creates the default tables, print template and texts, and the default admin,
+in the default database and then in the database of every scout group (see
+tenants.py).
+This used to run on every import of app.py; it now runs once, before the
+workers start:
+
+    flask --app main bootstrap
+"""
+import logging
+import time
+
+from app import app, db
+from routing import current_tenant
+
+logger = logging.getLogger(__name__)
+
+def bootstrap_database():
+    """
+    Create the schema and default data; safe to run on an existing database
+
+    From the default database, the groups are bootstrapped too; from a
+    group's (`flask tenants run bootstrap`), only that group is.
+    """
+    from tenants import tenant_context, tenant_names
+
+    bootstrap_current_database()
+    if current_tenant() is not None:
+        return
+
+    registry = app.extensions['tenants']
+    for tenant in tenant_names():
+        registry.create_database(tenant)
+        with tenant_context(tenant):
+            bootstrap_current_database()
+
+def bootstrap_current_database():
+    """Migrate the current database and create its default data, without touching the groups"""
+    # Import models to ensure they're registered with SQLAlchemy
+    import models  # noqa: F401
+    from helpers import initialize_default_tables, initialize_default_print_settings, create_default_admin
+    from migrations import migrate_database
+
+    started = time.perf_counter()
+
+    # Create the new tables, and bring an existing database up to date
+    migrate_database()
+
+    # Check if default tables exist, if not create them
+    initialize_default_tables()
+
+    # Default print template and generic texts, so the print pages only read
+    initialize_default_print_settings()
+
+    # Check if super admin exists, if not create one
+    create_default_admin()
+
+    logger.info('Database %s bootstrapped in %.0f ms', current_tenant() or 'default', (time.perf_counter() - started) * 1000)
+
+@app.cli.command('bootstrap')
+def bootstrap_command():
+    """Create the database schema, indexes and default data."""
+    bootstrap_database()
+    print('Base de données initialisée.')
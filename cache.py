@@ -0,0 +1,329 @@
+"""
+Two-tier cache shared by the worker processes.
+
+Values are kept in a small LRU in each process (local tier) and in a store
+shared by all the workers (shared tier): a SQLite file by default, or a Redis
+server. A value computed by one worker is then reused by the others, and
+invalidating a namespace applies to every worker at once.
+
+Keys belong to a namespace ("analytics", "print_settings", ...). Each
+namespace has a version, kept in the shared tier and included in the stored
+keys: invalidate() increments it, so every entry of the namespace is
+replaced, in the shared tier and in the local tier of every process. The
+version is read once per request and namespace. Each scout group (see
+tenants.py) has its own entries and versions: its ids are not the other
+groups' ids.
+
+Values must be picklable to reach the shared tier; values that are not (e.g.
+compiled templates) are cached with shared=False and only use the local
+tier. Cached values are shared between requests and must not be modified.
+
+Usage, from any view:
+
+    from cache import cache
+    stats = cache.get_or_set('dashboard', version, compute_stats, ttl=600)
+    cache.invalidate('dashboard')
+
+Configuration:
+    CACHE_BACKEND: Shared tier, "sqlite" (default), "redis", or "none" for
+        the local tier only
+    CACHE_URL: SQLite file of the shared tier (default: cache.sqlite in the
+        instance folder), or Redis URL (default redis://localhost:6379/0).
+        Values are pickled: the Redis server must only be used by the app.
+    CACHE_LOCAL_SIZE: Entries in the local tier of each process (default 1024)
+    CACHE_DEFAULT_TTL: Seconds an entry is kept without a TTL (default 300)
+"""
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, has_request_context
+from werkzeug.local import LocalProxy
+
+from routing import current_tenant
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two deletions of the expired entries of the SQLite tier, per process
+PURGE_INTERVAL = 300
+
+_MISSING = object()
+
+class LocalCache:
+    """LRU of one process; entries are (expiry, value)"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, expires):
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+class SQLiteBackend:
+    """Shared tier in a SQLite file, for the workers of one host"""
+
+    errors = (sqlite3.Error, OSError)
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._last_purge = 0
+
+    def _connection(self):
+        # One connection per thread, opened again after a fork
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS cache_entries '
+            '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)'
+        )
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS cache_versions '
+            '(namespace TEXT PRIMARY KEY, version INTEGER NOT NULL)'
+        )
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value FROM cache_entries WHERE key = ? AND expires > ?', (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, data, ttl):
+        connection = self._connection()
+        now = time.time()
+        connection.execute(
+            'INSERT OR REPLACE INTO cache_entries (key, value, expires) VALUES (?, ?, ?)', (key, data, now + ttl)
+        )
+        if now - self._last_purge > PURGE_INTERVAL:
+            self._last_purge = now
+            connection.execute('DELETE FROM cache_entries WHERE expires <= ?', (now,))
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+
+    def get_version(self, namespace):
+        row = self._connection().execute(
+            'SELECT version FROM cache_versions WHERE namespace = ?', (namespace,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def bump_version(self, namespace):
+        self._connection().execute(
+            'INSERT INTO cache_versions (namespace, version) VALUES (?, 1) '
+            'ON CONFLICT (namespace) DO UPDATE SET version = version + 1',
+            (namespace,)
+        )
+
+class RedisBackend:
+    """Shared tier in a Redis-compatible server, for workers on several hosts"""
+
+    def __init__(self, url, prefix='scouts:'):
+        import redis
+
+        self.errors = (redis.RedisError, OSError)
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url, socket_timeout=1)
+
+    def get(self, key):
+        return self._client.get(self.prefix + key)
+
+    def set(self, key, data, ttl):
+        self._client.set(self.prefix + key, data, ex=max(1, int(ttl)))
+
+    def delete(self, key):
+        self._client.delete(self.prefix + key)
+
+    def get_version(self, namespace):
+        return int(self._client.get(f'{self.prefix}version:{namespace}') or 0)
+
+    def bump_version(self, namespace):
+        self._client.incr(f'{self.prefix}version:{namespace}')
+
+class Cache:
+    """Local LRU in front of an optional shared backend, with namespaces, TTLs and statistics"""
+
+    def __init__(self, shared=None, local_size=1024, default_ttl=300):
+        self.shared = shared
+        self.local = LocalCache(local_size)
+        self.default_ttl = default_ttl
+        # Namespace versions when there is no shared tier
+        self._versions = {}
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, namespace, name):
+        with self._stats_lock:
+            stats = self._stats.setdefault(namespace, {
+                'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'sets': 0, 'invalidations': 0, 'errors': 0
+            })
+            stats[name] += 1
+
+    def _shared_call(self, namespace, method, *args):
+        """Call the shared tier; when it fails, the cache works as if it were empty"""
+        try:
+            return getattr(self.shared, method)(*args)
+        except self.shared.errors as e:
+            self._count(namespace, 'errors')
+            logger.warning('Shared cache %s failed: %s', method, e)
+            return None
+
+    @staticmethod
+    def _scoped(namespace):
+        """Return the namespace of the current group"""
+        tenant = current_tenant()
+        return f'{namespace}@{tenant}' if tenant else namespace
+
+    def _version(self, namespace):
+        scoped = self._scoped(namespace)
+        versions = g.setdefault('_cache_versions', {}) if has_request_context() else {}
+        if scoped not in versions:
+            if self.shared is None:
+                versions[scoped] = self._versions.get(scoped, 0)
+            else:
+                versions[scoped] = self._shared_call(namespace, 'get_version', scoped) or 0
+        return versions[scoped]
+
+    def _key(self, namespace, key):
+        if not isinstance(key, str):
+            key = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        return f'{self._scoped(namespace)}:{self._version(namespace)}:{key}'
+
+    def get(self, namespace, key, default=None, shared=True):
+        """Return a cached value, or default"""
+        full_key = self._key(namespace, key)
+        value = self.local.get(full_key)
+        if value is not _MISSING:
+            self._count(namespace, 'local_hits')
+            return value
+
+        if shared and self.shared is not None:
+            data = self._shared_call(namespace, 'get', full_key)
+            if data is not None:
+                expires, value = pickle.loads(data)
+                self.local.set(full_key, value, expires)
+                self._count(namespace, 'shared_hits')
+                return value
+
+        self._count(namespace, 'misses')
+        return default
+
+    def set(self, namespace, key, value, ttl=None, shared=True):
+        """Cache a value for ttl seconds (CACHE_DEFAULT_TTL by default)"""
+        ttl = self.default_ttl if ttl is None else ttl
+        full_key = self._key(namespace, key)
+        expires = time.time() + ttl
+        self.local.set(full_key, value, expires)
+        if shared and self.shared is not None:
+            self._shared_call(namespace, 'set', full_key, pickle.dumps((expires, value), pickle.HIGHEST_PROTOCOL), ttl)
+        self._count(namespace, 'sets')
+
+    def get_or_set(self, namespace, key, compute, ttl=None, shared=True):
+        """Return a cached value, computing and caching it on a miss"""
+        value = self.get(namespace, key, _MISSING, shared=shared)
+        if value is _MISSING:
+            value = compute()
+            self.set(namespace, key, value, ttl=ttl, shared=shared)
+        return value
+
+    def delete(self, namespace, key):
+        """
+        Drop one entry from the shared tier and this process
+
+        Other processes may keep their local copy until it expires: use
+        invalidate() when every worker must see the change at once.
+        """
+        full_key = self._key(namespace, key)
+        self.local.delete(full_key)
+        if self.shared is not None:
+            self._shared_call(namespace, 'delete', full_key)
+
+    def invalidate(self, namespace):
+        """Replace every entry of a namespace, in all the worker processes"""
+        scoped = self._scoped(namespace)
+        if self.shared is None:
+            self._versions[scoped] = self._versions.get(scoped, 0) + 1
+        else:
+            self._shared_call(namespace, 'bump_version', scoped)
+        if has_request_context():
+            g.setdefault('_cache_versions', {}).pop(scoped, None)
+        self._count(namespace, 'invalidations')
+
+    def get_stats(self):
+        """Return the hits, misses, sets, invalidations and errors of each namespace"""
+        with self._stats_lock:
+            namespaces = {namespace: dict(stats) for namespace, stats in self._stats.items()}
+        for stats in namespaces.values():
+            lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+            stats['hit_rate'] = round((stats['local_hits'] + stats['shared_hits']) / lookups, 3) if lookups else None
+        return {
+            'backend': type(self.shared).__name__ if self.shared is not None else None,
+            'local_entries': len(self.local),
+            'namespaces': namespaces
+        }
+
+def init_cache(app):
+    """Read the cache settings and create the cache of the app"""
+    app.config.setdefault('CACHE_BACKEND', os.environ.get('CACHE_BACKEND', 'sqlite'))
+    app.config.setdefault('CACHE_URL', os.environ.get('CACHE_URL'))
+    app.config.setdefault('CACHE_LOCAL_SIZE', int(os.environ.get('CACHE_LOCAL_SIZE', 1024)))
+    app.config.setdefault('CACHE_DEFAULT_TTL', float(os.environ.get('CACHE_DEFAULT_TTL', 300)))
+
+    backend = app.config['CACHE_BACKEND']
+    if backend == 'sqlite':
+        shared = SQLiteBackend(app.config['CACHE_URL'] or os.path.join(app.instance_path, 'cache.sqlite'))
+    elif backend == 'redis':
+        try:
+            shared = RedisBackend(app.config['CACHE_URL'] or 'redis://localhost:6379/0')
+        except ImportError:
+            logger.warning('CACHE_BACKEND=redis requires the redis package; using the local cache only')
+            shared = None
+    elif backend == 'none':
+        shared = None
+    else:
+        raise ValueError(f'Unknown CACHE_BACKEND: {backend}')
+
+    app.extensions['cache'] = Cache(
+        shared=shared,
+        local_size=app.config['CACHE_LOCAL_SIZE'],
+        default_ttl=app.config['CACHE_DEFAULT_TTL']
+    )
+
+# The cache of the current app
+cache = LocalProxy(lambda: current_app.extensions['cache'])
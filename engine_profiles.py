@@ -0,0 +1,168 @@
+"""
+Engine tuning profiles selected from the database URL.
+
+SQLite:
+    Connections are configured with per-connection pragmas. WAL lets readers
+    run while a worker writes, and busy_timeout makes a blocked writer wait
+    for the lock instead of failing with "database is locked".
+
+    SQLITE_JOURNAL_MODE   journal_mode (default WAL)
+    SQLITE_BUSY_TIMEOUT   busy_timeout in ms (default 5000)
+    SQLITE_SYNCHRONOUS    synchronous (default NORMAL, durable with WAL except on power loss)
+    SQLITE_MMAP_SIZE      mmap_size in bytes (default 268435456, 256 MB)
+    SQLITE_CACHE_SIZE     cache_size, negative values are KiB (default -65536, 64 MB)
+
+PostgreSQL and MySQL:
+    A sized connection pool without pre-ping (which costs a round trip per
+    checkout); stale connections are recycled instead. A statement timeout
+    stops runaway queries from holding a worker.
+
+    DB_POOL_SIZE          pool_size (default 10)
+    DB_MAX_OVERFLOW       max_overflow (default 20)
+    DB_POOL_TIMEOUT       seconds to wait for a connection (default 30)
+    DB_POOL_RECYCLE       seconds before a connection is replaced (default 1800, 280 on MySQL)
+    DB_POOL_PRE_PING      "1" to test connections on checkout (default off)
+    DB_STATEMENT_TIMEOUT  statement timeout in ms, 0 disables it (default 30000)
+"""
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+SQLITE_DEFAULTS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,
+    'synchronous': 'NORMAL',
+    'mmap_size': 268435456,
+    'cache_size': -65536
+}
+
+POOL_DEFAULTS = {
+    'pool_size': 10,
+    'max_overflow': 20,
+    'pool_timeout': 30,
+    'pool_recycle': 1800,
+    'pool_pre_ping': False
+}
+
+# MySQL servers often close idle connections well before the PostgreSQL defaults
+MYSQL_POOL_RECYCLE = 280
+
+STATEMENT_TIMEOUT_DEFAULT = 30000
+
+def _env(name, default, cast=int):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    return cast(value)
+
+def sqlite_pragmas():
+    """Return the pragmas applied to every SQLite connection"""
+    return {
+        'journal_mode': _env('SQLITE_JOURNAL_MODE', SQLITE_DEFAULTS['journal_mode'], str),
+        'busy_timeout': _env('SQLITE_BUSY_TIMEOUT', SQLITE_DEFAULTS['busy_timeout']),
+        'synchronous': _env('SQLITE_SYNCHRONOUS', SQLITE_DEFAULTS['synchronous'], str),
+        'mmap_size': _env('SQLITE_MMAP_SIZE', SQLITE_DEFAULTS['mmap_size']),
+        'cache_size': _env('SQLITE_CACHE_SIZE', SQLITE_DEFAULTS['cache_size'])
+    }
+
+def is_memory_database(url):
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+def archive_url(database_url, archive=None):
+    """
+    Return the URL of the archive database (see archive.py)
+
+    A SQLite file is archived to a <name>_archive.db file next to it; other
+    databases keep their archive tables in the same database.
+    """
+    if archive:
+        return archive
+    if make_url(database_url).get_backend_name() != 'sqlite' or is_memory_database(database_url):
+        return database_url
+
+    # Relative paths are resolved against the instance folder by Flask-SQLAlchemy, as for the primary
+    url = make_url(database_url)
+    stem, extension = os.path.splitext(url.database)
+    return url.set(database=f'{stem}_archive{extension or ".db"}').render_as_string(hide_password=False)
+
+def engine_options(database_url):
+    """
+    Return the SQLALCHEMY_ENGINE_OPTIONS suited to a database URL
+
+    Args:
+        database_url (str): SQLAlchemy database URL
+
+    Returns:
+        dict: Engine options for create_engine
+    """
+    backend = make_url(database_url).get_backend_name()
+
+    if backend == 'sqlite':
+        # Pragmas are set when connections open, see configure_sqlite_connection
+        return {}
+
+    options = {
+        'pool_size': _env('DB_POOL_SIZE', POOL_DEFAULTS['pool_size']),
+        'max_overflow': _env('DB_MAX_OVERFLOW', POOL_DEFAULTS['max_overflow']),
+        'pool_timeout': _env('DB_POOL_TIMEOUT', POOL_DEFAULTS['pool_timeout']),
+        'pool_recycle': _env(
+            'DB_POOL_RECYCLE',
+            MYSQL_POOL_RECYCLE if backend == 'mysql' else POOL_DEFAULTS['pool_recycle']
+        ),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING') == '1'
+    }
+
+    statement_timeout = _env('DB_STATEMENT_TIMEOUT', STATEMENT_TIMEOUT_DEFAULT)
+    if statement_timeout:
+        if backend == 'postgresql':
+            options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+        elif backend == 'mysql':
+            # Only applies to SELECT statements on MySQL
+            options['connect_args'] = {'init_command': f'SET SESSION max_execution_time={statement_timeout}'}
+
+    return options
+
+def configure_sqlite_connection(dbapi_connection, pragmas, memory=False, read_only=False):
+    """Apply the profile pragmas to a new SQLite connection"""
+    cursor = dbapi_connection.cursor()
+    try:
+        # Set the busy timeout first so that switching to WAL waits for other writers
+        cursor.execute(f'PRAGMA busy_timeout = {int(pragmas["busy_timeout"])}')
+        # The journal mode is stored in the file, so read-only connections use the primary's
+        if not memory and not read_only:
+            cursor.execute(f'PRAGMA journal_mode = {pragmas["journal_mode"]}')
+        cursor.execute(f'PRAGMA synchronous = {pragmas["synchronous"]}')
+        cursor.execute(f'PRAGMA mmap_size = {int(pragmas["mmap_size"])}')
+        cursor.execute(f'PRAGMA cache_size = {int(pragmas["cache_size"])}')
+    finally:
+        cursor.close()
+
+def apply_engine_profile(engine):
+    """Register the connection-level settings of the profile on an engine"""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    pragmas = sqlite_pragmas()
+    memory = is_memory_database(engine.url)
+    read_only = engine.url.query.get('mode') == 'ro'
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        configure_sqlite_connection(dbapi_connection, pragmas, memory, read_only)
+
+def describe_engine_profile(engine):
+    """Return the effective settings of an engine, for the metrics endpoint"""
+    if engine.dialect.name == 'sqlite':
+        return {'backend': 'sqlite', 'pragmas': sqlite_pragmas()}
+
+    pool = engine.pool
+    return {
+        'backend': engine.dialect.name,
+        'pool_size': pool.size() if hasattr(pool, 'size') else None,
+        'max_overflow': getattr(pool, '_max_overflow', None),
+        'pool_timeout': getattr(pool, '_timeout', None),
+        'pool_recycle': pool._recycle,
+        'pool_pre_ping': pool._pre_ping
+    }
@@ -1,11 +1,13 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, EmailField, SelectField, SubmitField, TextAreaField, BooleanField
-from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError, Optional
+from wtforms import StringField, PasswordField, EmailField, SelectField, SubmitField, TextAreaField, BooleanField, IntegerField
+from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError, Optional, NumberRange
 from models import User, ROLE_READONLY, ROLE_EDITOR, ROLE_ADMIN
 
 class LoginForm(FlaskForm):
     username = StringField('Nom d\'utilisateur', validators=[DataRequired()])
     password = PasswordField('Mot de passe', validators=[DataRequired()])
+    # Choices are the scout groups, none when the installation has a single database
+    group = SelectField('Groupe', choices=[], validators=[Optional()])
     submit = SubmitField('Se connecter')
 
 class RegisterForm(FlaskForm):
@@ -57,6 +59,7 @@ class TableForm(FlaskForm):
     name = StringField('Nom technique', validators=[DataRequired(), Length(max=100)])
     display_name = StringField('Nom d\'affichage', validators=[DataRequired(), Length(max=100)])
     description = TextAreaField('Description')
+    archive_after_days = IntegerField('Archiver après (jours)', validators=[Optional(), NumberRange(min=1)])
     submit = SubmitField('Enregistrer')
 
 
@@ -0,0 +1,198 @@
+"""
+Group commit for record submissions.
+
+Each submission normally commits its own transaction, and on SQLite every
+commit waits for the previous one and its fsync. With group commit enabled,
+submissions are handed to a writer thread which runs the submissions that
+arrive together in a single transaction and commits them once. Each
+submission runs in its own savepoint, so a validation error only undoes
+that submission, and its submitter gets its own result or error. Results
+are only returned once the transaction has committed.
+
+The submissions of a batch run one after another in the same transaction,
+so unique value checks see the records added earlier in the batch. Each
+scout group (see tenants.py) has its own writer thread, since its
+submissions go to its own database.
+
+Configuration:
+    GROUP_COMMIT: "1" to enable group commit (default off)
+    GROUP_COMMIT_WINDOW_MS: Milliseconds to wait for more submissions once
+        one arrives (default 2). Submissions arriving while a batch commits
+        join the next batch without waiting.
+    GROUP_COMMIT_MAX_BATCH: Maximum submissions per transaction (default 50)
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from flask import current_app
+
+from app import db
+from routing import current_tenant, mark_written, use_tenant
+
+logger = logging.getLogger(__name__)
+
+class GroupCommitWriter:
+    """Writer thread committing the submissions it receives in batches"""
+
+    def __init__(self, app, window=0.002, max_batch=50, tenant=None):
+        self.app = app
+        self.window = window
+        self.max_batch = max_batch
+        self.tenant = tenant
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._tenant_writers = {}
+
+    def for_tenant(self, tenant):
+        """Return the writer of a group's database (None: this writer, of the default database)"""
+        if tenant is None:
+            return self
+        writer = self._tenant_writers.get(tenant)
+        if writer is None:
+            with self._lock:
+                writer = self._tenant_writers.setdefault(
+                    tenant, GroupCommitWriter(self.app, self.window, self.max_batch, tenant=tenant)
+                )
+        return writer
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Run fn in the next batch and wait until the batch has committed
+
+        Returns:
+            The return value of fn
+
+        Raises:
+            The exception raised by fn, or the commit error of the batch
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future.result()
+
+    def _ensure_started(self):
+        # Gunicorn workers are forked after the app is imported: start one thread per process
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            with self.app.app_context():
+                use_tenant(self.tenant)
+                self._commit_batch(batch)
+
+    def _commit_batch(self, batch):
+        outcomes = []
+        try:
+            begin_write_transaction()
+
+            for future, fn, args, kwargs in batch:
+                try:
+                    with db.session.begin_nested():
+                        outcomes.append((future, fn(*args, **kwargs), None))
+                except Exception as e:
+                    outcomes.append((future, None, e))
+
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.exception('Group commit of %d submissions failed', len(batch))
+            for future, fn, args, kwargs in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            db.session.remove()
+
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        logger.debug('Group commit of %d submissions', len(batch))
+
+def begin_write_transaction():
+    """
+    Open the write transaction explicitly on SQLite
+
+    pysqlite only opens a transaction before DML, so releasing a savepoint
+    taken first would commit it on its own. IMMEDIATE also takes the write
+    lock before the transaction reads, instead of failing to upgrade a stale
+    read transaction.
+    """
+    if db.session.get_bind().dialect.name != 'sqlite':
+        return
+    connection = db.session.connection()
+    if not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+def init_group_commit(app):
+    """Read the group commit settings and create the writer when enabled"""
+    app.config.setdefault('GROUP_COMMIT', os.environ.get('GROUP_COMMIT') == '1')
+    app.config.setdefault('GROUP_COMMIT_WINDOW_MS', float(os.environ.get('GROUP_COMMIT_WINDOW_MS', 2)))
+    app.config.setdefault('GROUP_COMMIT_MAX_BATCH', int(os.environ.get('GROUP_COMMIT_MAX_BATCH', 50)))
+
+    if app.config['GROUP_COMMIT']:
+        app.extensions['group_commit'] = GroupCommitWriter(
+            app,
+            window=app.config['GROUP_COMMIT_WINDOW_MS'] / 1000,
+            max_batch=app.config['GROUP_COMMIT_MAX_BATCH']
+        )
+
+def commit_write(fn, *args, **kwargs):
+    """
+    Run a write function and commit it, through the group commit writer when enabled
+
+    fn adds its changes to db.session without committing. Whether batched or
+    not, its exceptions are raised to the caller after its changes are undone.
+    """
+    writer = current_app.extensions.get('group_commit')
+    if writer is not None:
+        writer = writer.for_tenant(current_tenant())
+        # End the request's read transaction first: on SQLite without WAL it would keep
+        # the writer from committing. Loaded objects stay readable once detached.
+        db.session.close()
+        result = writer.submit(fn, *args, **kwargs)
+        mark_written()
+        return result
+
+    try:
+        begin_write_transaction()
+        result = fn(*args, **kwargs)
+        db.session.commit()
+        return result
+    except Exception:
+        db.session.rollback()
+        raise
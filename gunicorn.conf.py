@@ -0,0 +1,31 @@
+"""
+Gunicorn settings for the Scout Management application.
+
+The database is bootstrapped once in the master process, before the workers
+are forked, so workers start without touching the schema and never race each
+other on first boot. This also holds with --preload. Set BOOTSTRAP_ON_START=0
+when `flask bootstrap` is run separately (e.g. in a release step).
+
+Each worker starts its PDF renderer slots (and their Xvfb displays) as soon
+as it boots, unless PDF_RENDERER_PREWARM=0, see pdf_renderer.py.
+"""
+import os
+
+def on_starting(server):
+    from app import app, db, configure_logging
+    configure_logging()
+
+    if os.environ.get('BOOTSTRAP_ON_START', '1') != '1':
+        return
+
+    from bootstrap import bootstrap_database
+    with app.app_context():
+        bootstrap_database()
+        # Workers are forked from this process and must not share its connections
+        db.engine.dispose()
+        app.extensions['tenants'].dispose()
+
+def post_worker_init(worker):
+    from app import app
+    from pdf_renderer import prewarm_pdf_renderer
+    prewarm_pdf_renderer(app)
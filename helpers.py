@@ -2,7 +2,12 @@ from functools import wraps
 from flask import flash, redirect, url_for
 from flask_login import current_user
 from app import db
-from models import User, Table, TableField, ROLE_ADMIN, ROLE_READONLY, ROLE_EDITOR
+from models import User, Table, TableField, Record, RecordValue, RecordChange, RecordUniqueKey, TablePermission, PrintTemplate, GenericText, ROLE_ADMIN, ROLE_READONLY, ROLE_EDITOR
+from sqlalchemy import or_, and_, false, func, insert, update
+from sqlalchemy.exc import IntegrityError
+from routing import current_tenant
+from tenants import tenant_names
+from datetime import datetime
 import json
 
 def admin_required(f):
@@ -23,6 +28,518 @@ def editor_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def tenants_required(f):
+    """Restrict a view to the default database of an installation with scout groups, see tenants.py"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if current_tenant() is not None or not tenant_names():
+            flash('Vous n\'avez pas la permission d\'accéder à cette page.', 'danger')
+            return redirect(url_for('dashboard'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+def escape_like(text):
+    """Escape the LIKE wildcards of user text, for a pattern with escape='\\'"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def get_permitted_records_query(table_id, user=None, query=None):
+    """
+    Build a query over the records of a table that the user is allowed to see
+
+    Editors and admins see every record. Read-only users see the records
+    matched by their TablePermission rows, or all of them with all_access.
+
+    Args:
+        table_id (int): ID of the table
+        user (User, optional): User to scope for, defaults to current_user
+        query (Query, optional): Base query selecting from records, defaults to Record.query
+
+    Returns:
+        Query: Record query restricted to the user's permission scope
+    """
+    user = user or current_user
+    query = (query if query is not None else Record.query).filter(Record.table_id == table_id)
+
+    if user.is_editor():
+        return query
+
+    permissions = TablePermission.query.filter_by(user_id=user.id, table_id=table_id).all()
+
+    if any(p.all_access for p in permissions):
+        return query
+
+    conditions = []
+    for permission in permissions:
+        if permission.field_id and permission.match_value:
+            record_values = RecordValue.query.filter_by(
+                field_id=permission.field_id,
+                text_value=permission.match_value
+            ).with_entities(RecordValue.record_id)
+            conditions.append(Record.id.in_(record_values))
+
+    if not conditions:
+        return query.filter(false())
+
+    return query.filter(or_(*conditions))
+
+def get_record_snapshot(record_id, fields):
+    """Return the current values of a record by field name, loaded in one query"""
+    fields_by_id = {field.id: field for field in fields}
+    snapshot = {field.name: None for field in fields}
+
+    values = db.session.query(
+        RecordValue.field_id,
+        RecordValue.text_value,
+        RecordValue.number_value,
+        RecordValue.date_value
+    ).filter(
+        RecordValue.record_id == record_id,
+        RecordValue.field_id.in_(fields_by_id)
+    )
+    for field_id, text_value, number_value, date_value in values:
+        field = fields_by_id[field_id]
+        snapshot[field.name] = RecordValue.format_value(field.field_type, text_value, number_value, date_value)
+
+    return snapshot
+
+def log_record_change(table_id, record_id, operation, values, changed_by=None, previous=None):
+    """
+    Add a change feed entry to the session, so it commits with the change it describes
+
+    Args:
+        table_id (int): ID of the table
+        record_id (int): ID of the inserted, updated or deleted record
+        operation (str): "insert", "update" or "delete"
+        values (dict): Values of the record by field name (the last values for a delete)
+        changed_by (int, optional): ID of the user who made the change
+        previous (dict, optional): Values an update replaced, by field name
+    """
+    payload = {'values': values}
+    if previous:
+        payload['previous'] = previous
+
+    change = RecordChange(table_id=table_id, record_id=record_id, operation=operation, changed_by=changed_by)
+    change.set_payload(payload)
+    db.session.add(change)
+    return change
+
+def get_change_cursor(table_id):
+    """Return the sequence number of the latest change of a table (0 when there is none)"""
+    return db.session.query(func.max(RecordChange.id)).filter(RecordChange.table_id == table_id).scalar() or 0
+
+def filter_changes_for_user(changes, table_id, user=None):
+    """
+    Restrict change feed entries to the permission scope of a user
+
+    An update that moves a record out of a read-only user's scope is turned
+    into a delete, so the client drops its copy.
+
+    Args:
+        changes (list): RecordChange objects, in sequence order
+        table_id (int): ID of the table
+        user (User, optional): User to scope for, defaults to current_user
+
+    Returns:
+        list: Dicts with seq, record_id, operation, changed_at and values
+    """
+    user = user or current_user
+
+    def as_dict(change, operation, values):
+        return {
+            'seq': change.id,
+            'record_id': change.record_id,
+            'operation': operation,
+            'changed_at': change.changed_at.isoformat(),
+            'values': values
+        }
+
+    permissions = [] if user.is_editor() else TablePermission.query.filter_by(user_id=user.id, table_id=table_id).all()
+    if user.is_editor() or any(p.all_access for p in permissions):
+        return [as_dict(change, change.operation, change.get_payload().get('values')) for change in changes]
+
+    field_ids = {p.field_id for p in permissions if p.field_id and p.match_value}
+    names = dict(db.session.query(TableField.id, TableField.name).filter(TableField.id.in_(field_ids)).all()) if field_ids else {}
+    scopes = [(names[p.field_id], p.match_value) for p in permissions if p.field_id in names and p.match_value]
+
+    def in_scope(values):
+        return any(values.get(name) == match_value for name, match_value in scopes)
+
+    result = []
+    for change in changes:
+        payload = change.get_payload()
+        values = payload.get('values') or {}
+        if in_scope(values):
+            result.append(as_dict(change, change.operation, values))
+        elif change.operation == 'update' and in_scope({**values, **payload.get('previous', {})}):
+            result.append(as_dict(change, 'delete', None))
+    return result
+
+def iter_record_rows(records_query, fields, chunk_size=500, newest_first=True):
+    """
+    Iterate over the rows of a records query, one chunk of records at a time
+
+    Records are paged by (created_at, id) and the values of each chunk are
+    loaded with a single query, so memory use does not grow with the table.
+
+    Args:
+        records_query (Query): Record query, e.g. from get_permitted_records_query
+        fields (list): TableField objects to include in each row
+        chunk_size (int): Number of records loaded per query
+        newest_first (bool): Order rows by descending creation date
+
+    Yields:
+        dict: Row with the record id, created_at and a value per field name
+    """
+    base_query = records_query.with_entities(Record.id, Record.created_at)
+    if newest_first:
+        order = (Record.created_at.desc(), Record.id.desc())
+    else:
+        order = (Record.created_at, Record.id)
+
+    last = None
+    while True:
+        query = base_query
+        if last is not None:
+            record_id, created_at = last
+            if newest_first:
+                query = query.filter(or_(
+                    Record.created_at < created_at,
+                    and_(Record.created_at == created_at, Record.id < record_id)
+                ))
+            else:
+                query = query.filter(or_(
+                    Record.created_at > created_at,
+                    and_(Record.created_at == created_at, Record.id > record_id)
+                ))
+
+        chunk = query.order_by(*order).limit(chunk_size).all()
+        if not chunk:
+            return
+
+        yield from build_record_rows(chunk, fields)
+
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1]
+
+def build_record_rows(records, fields):
+    """
+    Build display rows for (id, created_at) pairs, loading their values in one query
+
+    Args:
+        records (list): (record_id, created_at) tuples, in display order
+        fields (list): TableField objects to include in each row
+
+    Returns:
+        list: Rows with the record id, created_at and a value per field name
+    """
+    fields_by_id = {field.id: field for field in fields}
+    rows = {}
+    for record_id, created_at in records:
+        row = {'id': record_id, 'created_at': created_at.strftime('%Y-%m-%d %H:%M')}
+        for field in fields:
+            row[field.name] = None
+        rows[record_id] = row
+
+    if rows and fields_by_id:
+        values = db.session.query(
+            RecordValue.record_id,
+            RecordValue.field_id,
+            RecordValue.text_value,
+            RecordValue.number_value,
+            RecordValue.date_value
+        ).filter(
+            RecordValue.record_id.in_(rows),
+            RecordValue.field_id.in_(fields_by_id)
+        )
+        for record_id, field_id, text_value, number_value, date_value in values:
+            field = fields_by_id[field_id]
+            rows[record_id][field.name] = RecordValue.format_value(field.field_type, text_value, number_value, date_value)
+
+    return list(rows.values())
+
+def get_record_page(records_query, fields, offset=0, limit=100, sort=None, descending=True, filters=None, search=None):
+    """
+    Load one page of rows for a records query, sorted and filtered in the database
+
+    Args:
+        records_query (Query): Record query, e.g. from get_permitted_records_query
+        fields (list): TableField objects of the table, in display order
+        offset (int): Number of rows to skip
+        limit (int): Maximum number of rows to return
+        sort (str, optional): Field name to sort by, defaults to the creation date
+        descending (bool): Sort in descending order
+        filters (dict, optional): Field name to value; text fields match on a substring
+        search (str, optional): Text searched in every text and dropdown field
+
+    Returns:
+        tuple: (total number of matching records, list of rows)
+    """
+    from sqlalchemy.orm import aliased
+    from aggregation import value_column
+
+    fields_by_name = {field.name: field for field in fields}
+    query = records_query
+
+    for name, value in (filters or {}).items():
+        field = fields_by_name.get(name)
+        if field is None or value in (None, ''):
+            continue
+        matching = RecordValue.query.filter(RecordValue.field_id == field.id)
+        if field.field_type == 'text':
+            matching = matching.filter(RecordValue.text_value.ilike(f'%{escape_like(value)}%', escape='\\'))
+        else:
+            # Parse the filter value the same way form input is stored
+            record_value = RecordValue()
+            try:
+                record_value.set_value(value, field.field_type)
+            except ValueError:
+                return 0, []
+            matching = matching.filter(value_column(RecordValue, field) == value_column(record_value, field))
+        query = query.filter(Record.id.in_(matching.with_entities(RecordValue.record_id)))
+
+    if search:
+        text_field_ids = [field.id for field in fields if field.field_type in ('text', 'dropdown')]
+        matching = RecordValue.query.filter(
+            RecordValue.field_id.in_(text_field_ids),
+            RecordValue.text_value.ilike(f'%{escape_like(search)}%', escape='\\')
+        ).with_entities(RecordValue.record_id)
+        query = query.filter(Record.id.in_(matching))
+
+    total = query.order_by(None).count()
+
+    page_query = query.with_entities(Record.id, Record.created_at)
+    sort_field = fields_by_name.get(sort)
+    if sort_field is not None:
+        sort_value = aliased(RecordValue)
+        page_query = page_query.outerjoin(
+            sort_value,
+            and_(sort_value.record_id == Record.id, sort_value.field_id == sort_field.id)
+        )
+        sort_column = value_column(sort_value, sort_field)
+    else:
+        sort_column = Record.created_at
+
+    if descending:
+        page_query = page_query.order_by(sort_column.desc(), Record.id.desc())
+    else:
+        page_query = page_query.order_by(sort_column.asc(), Record.id.asc())
+
+    page = page_query.offset(offset).limit(limit).all()
+    return total, build_record_rows(page, fields)
+
+def buffer_chunks(chunks, size=16384):
+    """Join the small pieces yielded by a streamed template into larger writes"""
+    buffer = []
+    length = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield ''.join(buffer)
+
+def claim_record_version(record_id, expected_version):
+    """
+    Increment the version of a record if it is still the one the user edited
+
+    The check and the increment are a single conditional UPDATE, so two
+    concurrent edits cannot both succeed and no lock outlives the transaction.
+
+    Args:
+        record_id (int): ID of the record being edited
+        expected_version (int): Version the edit was based on
+
+    Returns:
+        bool: False if the record was changed (or deleted) in the meantime
+    """
+    result = db.session.execute(
+        update(Record)
+        .where(Record.id == record_id, Record.version == expected_version)
+        .values(version=Record.version + 1, modified_at=datetime.utcnow())
+    )
+    return result.rowcount == 1
+
+class RecordValidationError(ValueError):
+    """Raised when submitted values cannot be saved; the message is shown to the user"""
+
+def set_record_value(record_value, field, value):
+    """
+    Set a submitted value on a RecordValue, converted for the field type
+
+    Raises:
+        RecordValidationError: The value is not a number or a YYYY-MM-DD date, for those fields
+    """
+    try:
+        record_value.set_value(value, field.field_type)
+    except ValueError as e:
+        if field.field_type == 'date':
+            raise RecordValidationError(f'Le champ "{field.display_name}" doit être une date au format AAAA-MM-JJ.') from e
+        raise RecordValidationError(f'Le champ "{field.display_name}" doit être un nombre.') from e
+
+def sync_unique_keys(record_id, fields, record_values, new=False):
+    """
+    Store the keys of a record's unique values, so the database rejects duplicates
+
+    The keys are written in a savepoint: a duplicate only undoes the keys and
+    is reported with the field and value concerned. No query is run for
+    tables without unique fields.
+
+    Args:
+        record_id (int): ID of the record
+        fields (list): Fields of the table
+        record_values (dict): RecordValue of the record by field ID
+        new (bool): The record has no keys yet
+
+    Raises:
+        RecordValidationError: Another record already has one of the values
+    """
+    unique_fields = [field for field in fields if field.unique]
+    if not unique_fields:
+        return
+
+    existing = {}
+    if not new:
+        existing = {
+            key.field_id: key
+            for key in RecordUniqueKey.query.filter(
+                RecordUniqueKey.record_id == record_id,
+                RecordUniqueKey.field_id.in_([field.id for field in unique_fields])
+            )
+        }
+
+    changed = []
+    try:
+        # Pending changes are flushed when the savepoint starts, so only the keys are undone
+        with db.session.begin_nested():
+            for field in unique_fields:
+                record_value = record_values.get(field.id)
+                value_key = record_value and RecordUniqueKey.make_key(
+                    field.field_type, record_value.text_value, record_value.number_value, record_value.date_value
+                )
+                key = existing.get(field.id)
+
+                if key is not None and key.value_key == value_key:
+                    continue
+                if key is not None and value_key is None:
+                    db.session.delete(key)
+                elif key is not None:
+                    key.value_key = value_key
+                    changed.append((field, record_value))
+                elif value_key is not None:
+                    db.session.add(RecordUniqueKey(field_id=field.id, record_id=record_id, value_key=value_key))
+                    changed.append((field, record_value))
+    except IntegrityError:
+        # Name the value that is taken; this lookup only runs when a duplicate was rejected
+        for field, record_value in changed:
+            value_key = RecordUniqueKey.make_key(
+                field.field_type, record_value.text_value, record_value.number_value, record_value.date_value
+            )
+            taken = RecordUniqueKey.query.filter(
+                RecordUniqueKey.field_id == field.id,
+                RecordUniqueKey.value_key == value_key,
+                RecordUniqueKey.record_id != record_id
+            ).first()
+            if taken:
+                value = RecordValue.format_value(
+                    field.field_type, record_value.text_value, record_value.number_value, record_value.date_value
+                )
+                raise RecordValidationError(f'La valeur "{value}" existe déjà pour le champ "{field.display_name}".')
+        raise
+
+def rebuild_unique_keys(field):
+    """
+    Recreate the keys of a field after it was made unique or changed type
+
+    Raises:
+        RecordValidationError: Several records already share a value of the field
+    """
+    RecordUniqueKey.query.filter_by(field_id=field.id).delete(synchronize_session=False)
+    if not field.unique:
+        return
+
+    rows = {}
+    values = db.session.query(
+        RecordValue.record_id,
+        RecordValue.text_value,
+        RecordValue.number_value,
+        RecordValue.date_value
+    ).filter(RecordValue.field_id == field.id)
+    for record_id, text_value, number_value, date_value in values:
+        value_key = RecordUniqueKey.make_key(field.field_type, text_value, number_value, date_value)
+        if value_key is None:
+            continue
+        if value_key in rows:
+            value = RecordValue.format_value(field.field_type, text_value, number_value, date_value)
+            raise RecordValidationError(
+                f'Le champ "{field.display_name}" ne peut pas être unique : '
+                f'la valeur "{value}" apparaît dans plusieurs enregistrements.'
+            )
+        rows[value_key] = {'field_id': field.id, 'record_id': record_id, 'value_key': value_key}
+
+    if rows:
+        db.session.execute(insert(RecordUniqueKey), list(rows.values()))
+
+def create_record(table_id, fields, form_data, created_by=None):
+    """
+    Validate submitted values and add a new record to the session, without committing
+
+    Unique values are enforced by the database through the record_unique_keys
+    table, so concurrent submissions cannot both store the same value.
+
+    Args:
+        table_id (int): ID of the table
+        fields (list): Fields of the table
+        form_data (dict): Submitted values keyed "field_<id>"
+        created_by (int, optional): ID of the user who created the record
+
+    Returns:
+        int: ID of the new record
+
+    Raises:
+        RecordValidationError: A unique value already exists, a required value is missing,
+            or a number or date is invalid
+    """
+    for field in fields:
+        value = form_data.get(f'field_{field.id}')
+        if field.required and (value is None or value.strip() == ''):
+            raise RecordValidationError(f'Le champ "{field.display_name}" est obligatoire.')
+
+    record = Record(table_id=table_id, created_by=created_by)
+    db.session.add(record)
+    db.session.flush()  # Get the record ID
+
+    record_values = {}
+    for field in fields:
+        record_value = record_values[field.id] = RecordValue(record_id=record.id, field_id=field.id)
+        set_record_value(record_value, field, form_data.get(f'field_{field.id}'))
+        db.session.add(record_value)
+
+    sync_unique_keys(record.id, fields, record_values, new=True)
+    log_record_change(table_id, record.id, 'insert', get_record_snapshot(record.id, fields), created_by)
+    return record.id
+
+def create_records(table_id, fields, rows, created_by=None):
+    """
+    Add several records to the session, all or none, without committing
+
+    Returns:
+        list: IDs of the new records, in the order of rows
+
+    Raises:
+        RecordValidationError: A row is invalid, the message gives its position
+    """
+    record_ids = []
+    for position, form_data in enumerate(rows, start=1):
+        try:
+            record_ids.append(create_record(table_id, fields, form_data, created_by))
+        except RecordValidationError as e:
+            raise RecordValidationError(f'Ligne {position} : {e}') from e
+    return record_ids
+
 def create_dynamic_form(fields, values=None):
     """
     Create a dynamic form based on field definitions
@@ -55,59 +572,6 @@ def create_dynamic_form(fields, values=None):
     
     return form_fields
 
-def save_record(table_id, form_data, record_id=None, created_by=None):
-    """
-    Save a record to the database
-    
-    Args:
-        table_id (int): ID of the table
-        form_data (dict): Form data
-        record_id (int, optional): ID of the record to update
-        created_by (int, optional): ID of the user who created the record
-        
-    Returns:
-        bool: True if successful, False otherwise
-    """
-    from models import Record, RecordValue
-    
-    try:
-        if record_id:
-            # Update existing record
-            record = Record.query.get(record_id)
-            if not record or record.table_id != table_id:
-                return False
-        else:
-            # Create new record
-            record = Record(table_id=table_id, created_by=created_by)
-            db.session.add(record)
-            db.session.flush()
-        
-        fields = TableField.query.filter_by(table_id=table_id).all()
-        
-        for field in fields:
-            field_key = f'field_{field.id}'
-            
-            if field_key not in form_data:
-                continue
-                
-            value = form_data[field_key]
-            
-            # Check if value already exists
-            record_value = RecordValue.query.filter_by(record_id=record.id, field_id=field.id).first()
-            
-            if not record_value:
-                record_value = RecordValue(record_id=record.id, field_id=field.id)
-                db.session.add(record_value)
-            
-            record_value.set_value(value, field.field_type)
-        
-        db.session.commit()
-        return True
-    except Exception as e:
-        db.session.rollback()
-        print(f"Error saving record: {str(e)}")
-        return False
-
 def initialize_default_tables():
     """Initialize the default tables if they don't exist"""
     default_tables = [
@@ -189,6 +653,27 @@ def initialize_default_tables():
     
     db.session.commit()
 
+DEFAULT_GENERIC_TEXTS = {
+    'autorisation_camp': '<h2>Autorisation de Camp</h2><p>Je soussigné(e), [nom du parent], autorise [nom de l\'enfant] à participer au camp scout qui se déroulera du [date début] au [date fin] à [lieu].</p><p>Fait à _________________, le _________________</p><p>Signature: _________________</p>'
+}
+
+def initialize_default_print_settings():
+    """Create the default print template and generic texts if they don't exist"""
+    if not PrintTemplate.query.filter_by(is_default=True).first():
+        db.session.add(PrintTemplate(
+            name='Default',
+            header_html='<h1>Gestion des Scouts</h1>',
+            footer_html='<p>Document généré le {{date}}</p>',
+            is_default=True
+        ))
+
+    existing = {name for name, in db.session.query(GenericText.name)}
+    for name, content in DEFAULT_GENERIC_TEXTS.items():
+        if name not in existing:
+            db.session.add(GenericText(name=name, content=content))
+
+    db.session.commit()
+
 def create_default_admin():
     """Create a default admin user if no users exist"""
     user_count = User.query.count()
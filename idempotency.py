@@ -0,0 +1,105 @@
+"""
+Idempotency keys for record creation.
+
+Clients send a key with each creation request, in the Idempotency-Key header
+or in the idempotency_key field of the add form. The key is claimed in the
+transaction that creates the records, and the result is stored with it. A
+retry with the same key returns the stored result instead of creating the
+records again; a concurrent retry waits for the first request to commit.
+
+Keys are scoped to the user and expire after IDEMPOTENCY_KEY_TTL_HOURS
+(default 24). Reusing a key with different data is refused.
+"""
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, request
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_FIELD = 'idempotency_key'
+MAX_KEY_LENGTH = 64
+
+# Seconds between two purges of the expired keys, per process
+PURGE_INTERVAL = 600
+
+_last_purge = 0
+
+class IdempotencyKeyError(ValueError):
+    """Raised for an invalid key, or a key reused with different data"""
+
+def get_idempotency_key():
+    """Return the key sent with the request, or None"""
+    key = request.headers.get(IDEMPOTENCY_HEADER) or request.form.get(IDEMPOTENCY_FIELD)
+    if not key or not key.strip():
+        return None
+    key = key.strip()
+    if len(key) > MAX_KEY_LENGTH:
+        raise IdempotencyKeyError(f'La clé d\'idempotence ne doit pas dépasser {MAX_KEY_LENGTH} caractères.')
+    return key
+
+def request_fingerprint(data):
+    """Return the SHA-256 of request data, to detect a key reused for another request"""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def purge_expired_keys():
+    """Delete the expired keys, at most once per PURGE_INTERVAL"""
+    global _last_purge
+    if time.monotonic() - _last_purge < PURGE_INTERVAL:
+        return
+    _last_purge = time.monotonic()
+    IdempotencyKey.query.filter(IdempotencyKey.created_at < _expiry_cutoff()).delete(synchronize_session=False)
+
+def _expiry_cutoff():
+    return datetime.utcnow() - timedelta(hours=current_app.config['IDEMPOTENCY_KEY_TTL_HOURS'])
+
+def _claim(user_id, key, fingerprint):
+    """Insert the key, or return the existing row when it is already taken"""
+    claim = IdempotencyKey(user_id=user_id, key=key, fingerprint=fingerprint)
+    try:
+        with db.session.begin_nested():
+            db.session.add(claim)
+        return claim, None
+    except IntegrityError:
+        return None, IdempotencyKey.query.filter_by(user_id=user_id, key=key).one()
+
+def run_idempotent(user_id, key, fingerprint, fn, *args, **kwargs):
+    """
+    Run a write function once per user and key, in the caller's transaction
+
+    Args:
+        user_id (int): ID of the user sending the request
+        key (str): Idempotency key, None to always run fn
+        fingerprint (str): Fingerprint of the request data, see request_fingerprint
+        fn (callable): Write function returning a JSON serializable result
+
+    Returns:
+        tuple: (result, replayed), replayed is True when the result was stored by an earlier request
+
+    Raises:
+        IdempotencyKeyError: The key was used for a request with different data
+    """
+    if key is None:
+        return fn(*args, **kwargs), False
+
+    purge_expired_keys()
+
+    claim, existing = _claim(user_id, key, fingerprint)
+    if existing is not None and existing.created_at < _expiry_cutoff():
+        db.session.delete(existing)
+        db.session.flush()
+        claim, existing = _claim(user_id, key, fingerprint)
+
+    if existing is not None:
+        if existing.fingerprint != fingerprint:
+            raise IdempotencyKeyError('Cette clé d\'idempotence a déjà été utilisée pour une autre requête.')
+        return existing.get_result(), True
+
+    result = fn(*args, **kwargs)
+    claim.set_result(result)
+    return result, False
@@ -0,0 +1,121 @@
+"""
+Session-cached user identity.
+
+Flask-Login used to load the user with a query on every request. The id,
+username, role and session version of the user are now kept in the signed
+session cookie when the user logs in, and requests are served from this
+snapshot: a page that only reads cached data runs no query at all.
+
+A snapshot is reloaded from the database:
+    - after IDENTITY_CACHE_TTL seconds (default 300)
+    - after any user was edited or deleted, or changed their password. These
+      touch the identity epoch file, which every worker process checks with a
+      stat() per request, so the change applies at once on this host.
+
+Changing a password increments the user's session_version: their other
+sessions no longer match it and are logged out. Deleted users are logged out
+the same way.
+
+Configuration:
+    IDENTITY_CACHE_TTL: Seconds a snapshot is used without reloading the user
+        (default 300). It also bounds how long a change takes to apply on
+        other hosts, which do not share the epoch file.
+    IDENTITY_EPOCH_FILE: Epoch file (default: identity_epoch in the instance
+        folder)
+"""
+import logging
+import os
+import time
+
+from flask import current_app, session
+from flask_login import UserMixin
+
+from app import db
+from models import User, ROLE_ADMIN, ROLE_EDITOR
+
+logger = logging.getLogger(__name__)
+
+IDENTITY_KEY = '_identity'
+
+class SessionUser(UserMixin):
+    """The current user, as stored in the session"""
+
+    def __init__(self, id, username, role, session_version):
+        self.id = id
+        self.username = username
+        self.role = role
+        self.session_version = session_version
+
+    def is_admin(self):
+        return self.role == ROLE_ADMIN
+
+    def is_editor(self):
+        return self.role == ROLE_EDITOR or self.role == ROLE_ADMIN
+
+    def load(self):
+        """Return the User row, for the views that change it"""
+        return db.session.get(User, self.id)
+
+    def __repr__(self):
+        return f'<SessionUser {self.username}>'
+
+def identity_epoch():
+    """Return the modification time of the epoch file, 0 until a user was changed"""
+    try:
+        return os.stat(current_app.config['IDENTITY_EPOCH_FILE']).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+def touch_identity_epoch():
+    """Make every worker reload the identities stored in sessions, after a user was changed"""
+    path = current_app.config['IDENTITY_EPOCH_FILE']
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as f:
+        f.write(str(time.time_ns()))
+    os.replace(temporary, path)
+
+def remember_identity(user):
+    """Store the snapshot of a user in the session, on login or once reloaded"""
+    session[IDENTITY_KEY] = {
+        'id': user.id,
+        'username': user.username,
+        'role': user.role,
+        'version': user.session_version,
+        'epoch': identity_epoch(),
+        'expires': time.time() + current_app.config['IDENTITY_CACHE_TTL']
+    }
+
+def forget_identity():
+    session.pop(IDENTITY_KEY, None)
+
+def load_session_user(user_id):
+    """
+    Flask-Login user loader: return the current user from the session snapshot when it is fresh
+
+    Returns:
+        SessionUser: The user, None to log the session out
+    """
+    user_id = int(user_id)
+    snapshot = session.get(IDENTITY_KEY)
+    if snapshot is not None and snapshot['id'] != user_id:
+        snapshot = None
+
+    if snapshot is not None and snapshot['expires'] > time.time() and snapshot['epoch'] == identity_epoch():
+        return SessionUser(snapshot['id'], snapshot['username'], snapshot['role'], snapshot['version'])
+
+    user = db.session.get(User, user_id)
+    if user is None or (snapshot is not None and snapshot['version'] != user.session_version):
+        # Deleted user, or a session opened before the password was changed
+        forget_identity()
+        return None
+
+    remember_identity(user)
+    return SessionUser(user.id, user.username, user.role, user.session_version)
+
+def init_identity(app):
+    """Read the identity settings"""
+    app.config.setdefault('IDENTITY_CACHE_TTL', float(os.environ.get('IDENTITY_CACHE_TTL', 300)))
+    app.config.setdefault('IDENTITY_EPOCH_FILE', os.environ.get(
+        'IDENTITY_EPOCH_FILE', os.path.join(app.instance_path, 'identity_epoch')
+    ))
@@ -0,0 +1,245 @@
+"""
+Per-request instrumentation of database and rendering work.
+
+SQL statements are counted and timed through SQLAlchemy engine events, and
+template rendering through Flask signals. Totals are kept per endpoint,
+optionally reported in a Server-Timing header, and checked against the query
+budget configured for the endpoint. Connection pools are watched through pool
+events, so that checkouts and pool exhaustion can be followed per engine.
+
+Configuration:
+    INSTRUMENTATION_ENABLED: Record metrics for each request (default True)
+    SERVER_TIMING_HEADER: Add a Server-Timing header to responses (default False)
+    TRACK_MEMORY: Record peak allocated memory with tracemalloc (default False)
+    QUERY_BUDGETS: Maximum number of queries per endpoint name, None for no budget
+    QUERY_BUDGET_DEFAULT: Budget for endpoints missing from QUERY_BUDGETS (default None)
+    QUERY_BUDGET_STRICT: Raise QueryBudgetExceeded instead of logging (default app.testing)
+"""
+import logging
+import threading
+import time
+import tracemalloc
+
+from flask import g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+# engine name -> pool counters
+_pool_stats = {}
+
+class QueryBudgetExceeded(RuntimeError):
+    """Raised in strict mode when a request runs more queries than its budget"""
+
+class RequestMetrics:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.render_started = []
+        self.peak_memory = None
+
+    @property
+    def total_time(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        return ', '.join([
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.query_count} queries"',
+            f'render;dur={self.render_time * 1000:.1f}',
+            f'total;dur={self.total_time * 1000:.1f}'
+        ])
+
+def _current_metrics():
+    if has_request_context():
+        return g.get('_request_metrics')
+    return None
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, which is dropped with the statement: a failed query
+    # never reaches after_cursor_execute
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics = _current_metrics()
+    if metrics is not None:
+        metrics.query_count += 1
+        started = getattr(context, '_query_started', None)
+        if started is not None:
+            metrics.db_time += time.perf_counter() - started
+
+def _before_render_template(sender, template, context, **extra):
+    metrics = _current_metrics()
+    if metrics is not None:
+        metrics.render_started.append(time.perf_counter())
+
+def _template_rendered(sender, template, context, **extra):
+    metrics = _current_metrics()
+    if metrics is not None and metrics.render_started:
+        metrics.render_time += time.perf_counter() - metrics.render_started.pop()
+
+def record_metrics(metrics):
+    """Add the metrics of a finished request to the per-endpoint totals"""
+    with _stats_lock:
+        stats = _stats.setdefault(metrics.endpoint, {
+            'requests': 0,
+            'queries': 0,
+            'max_queries': 0,
+            'db_time_ms': 0.0,
+            'render_time_ms': 0.0,
+            'total_time_ms': 0.0,
+            'max_total_time_ms': 0.0,
+            'max_peak_memory_kb': None
+        })
+        total_time_ms = metrics.total_time * 1000
+        stats['requests'] += 1
+        stats['queries'] += metrics.query_count
+        stats['max_queries'] = max(stats['max_queries'], metrics.query_count)
+        stats['db_time_ms'] += metrics.db_time * 1000
+        stats['render_time_ms'] += metrics.render_time * 1000
+        stats['total_time_ms'] += total_time_ms
+        stats['max_total_time_ms'] = max(stats['max_total_time_ms'], total_time_ms)
+        if metrics.peak_memory is not None:
+            stats['max_peak_memory_kb'] = max(stats['max_peak_memory_kb'] or 0, metrics.peak_memory // 1024)
+
+def get_endpoint_stats():
+    """Return a copy of the per-endpoint totals with averages per request"""
+    with _stats_lock:
+        result = {}
+        for endpoint, stats in _stats.items():
+            entry = dict(stats)
+            requests = stats['requests'] or 1
+            entry['avg_queries'] = stats['queries'] / requests
+            entry['avg_db_time_ms'] = stats['db_time_ms'] / requests
+            entry['avg_render_time_ms'] = stats['render_time_ms'] / requests
+            entry['avg_total_time_ms'] = stats['total_time_ms'] / requests
+            result[endpoint] = entry
+        return result
+
+def reset_endpoint_stats():
+    with _stats_lock:
+        _stats.clear()
+
+def watch_pool(engine, name):
+    """Count the connections opened, checked out and invalidated by an engine's pool"""
+    if name in _pool_stats:
+        return
+
+    stats = _pool_stats[name] = {
+        'engine': engine,
+        'connects': 0,
+        'checkouts': 0,
+        'checkins': 0,
+        'invalidations': 0,
+        'max_checked_out': 0
+    }
+
+    def on_connect(dbapi_connection, connection_record):
+        with _stats_lock:
+            stats['connects'] += 1
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        with _stats_lock:
+            stats['checkouts'] += 1
+            checked_out = stats['checkouts'] - stats['checkins']
+            stats['max_checked_out'] = max(stats['max_checked_out'], checked_out)
+
+    def on_checkin(dbapi_connection, connection_record):
+        with _stats_lock:
+            stats['checkins'] += 1
+
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        with _stats_lock:
+            stats['invalidations'] += 1
+
+    event.listen(engine, 'connect', on_connect)
+    event.listen(engine, 'checkout', on_checkout)
+    event.listen(engine, 'checkin', on_checkin)
+    event.listen(engine, 'invalidate', on_invalidate)
+
+def get_pool_stats():
+    """Return the pool counters and current pool state of every watched engine"""
+    result = {}
+    with _stats_lock:
+        for name, stats in _pool_stats.items():
+            pool = stats['engine'].pool
+            entry = {key: value for key, value in stats.items() if key != 'engine'}
+            entry['pool'] = type(pool).__name__
+            for attribute in ('size', 'checkedin', 'checkedout', 'overflow'):
+                method = getattr(pool, attribute, None)
+                entry[attribute] = method() if callable(method) else None
+            result[name] = entry
+    return result
+
+def init_instrumentation(app):
+    """Register the engine listeners and request hooks on an application"""
+    app.config.setdefault('INSTRUMENTATION_ENABLED', True)
+    app.config.setdefault('SERVER_TIMING_HEADER', False)
+    app.config.setdefault('TRACK_MEMORY', False)
+    app.config.setdefault('QUERY_BUDGETS', {})
+    app.config.setdefault('QUERY_BUDGET_DEFAULT', None)
+    app.config.setdefault('QUERY_BUDGET_STRICT', None)
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render_template, app)
+    template_rendered.connect(_template_rendered, app)
+
+    def finish(metrics):
+        if metrics.peak_memory is None and app.config['TRACK_MEMORY'] and tracemalloc.is_tracing():
+            metrics.peak_memory = tracemalloc.get_traced_memory()[1]
+
+        record_metrics(metrics)
+        logger.debug(
+            '%s: %d queries, %.1f ms db, %.1f ms render, %.1f ms total',
+            metrics.endpoint, metrics.query_count, metrics.db_time * 1000,
+            metrics.render_time * 1000, metrics.total_time * 1000
+        )
+
+        budget = app.config['QUERY_BUDGETS'].get(metrics.endpoint, app.config['QUERY_BUDGET_DEFAULT'])
+        if budget is not None and metrics.query_count > budget:
+            message = f'{metrics.endpoint} ran {metrics.query_count} queries (budget {budget})'
+            strict = app.config['QUERY_BUDGET_STRICT']
+            if strict is None:
+                strict = app.testing
+            if strict:
+                raise QueryBudgetExceeded(message)
+            logger.warning('Query budget exceeded: %s', message)
+
+    @app.before_request
+    def start_request_metrics():
+        if not app.config['INSTRUMENTATION_ENABLED']:
+            return
+        if app.config['TRACK_MEMORY']:
+            # Peaks are process-wide, so concurrent requests in threaded servers share them
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        g._request_metrics = RequestMetrics(request.endpoint or 'unknown')
+
+    @app.after_request
+    def end_request_metrics(response):
+        metrics = g.pop('_request_metrics', None)
+        if metrics is None:
+            return response
+
+        if app.config['SERVER_TIMING_HEADER']:
+            response.headers['Server-Timing'] = metrics.server_timing()
+
+        if response.is_streamed and not response.direct_passthrough:
+            # Streamed bodies keep querying after this hook, so totals are taken once the body is sent.
+            # Passthrough bodies (send_file) skip the close callbacks and run no queries.
+            g._request_metrics = metrics
+            response.call_on_close(lambda: finish(metrics))
+        else:
+            finish(metrics)
+        return response
@@ -1,6 +1,11 @@
+from app import create_app, configure_logging
 
-from app import app
-from routes import *  # Import all routes
+app = create_app()
 
 if __name__ == "__main__":
+    from bootstrap import bootstrap_database
+
+    configure_logging("DEBUG")
+    with app.app_context():
+        bootstrap_database()
     app.run(host="127.0.0.1", port=5000, debug=True)
@@ -0,0 +1,14 @@
+"""
+Add table_permissions.all_access, the permission on every record of a table
+
+Replaces script.py. Rows added while the column had no default get False.
+"""
+import sqlalchemy as sa
+
+table_permissions = sa.table('table_permissions', sa.column('id', sa.Integer), sa.column('all_access', sa.Boolean))
+
+def expand(migration):
+    migration.add_column('table_permissions', sa.Column('all_access', sa.Boolean, server_default=sa.false()))
+
+def backfill(migration):
+    migration.backfill(table_permissions, {'all_access': False}, table_permissions.c.all_access.is_(None))
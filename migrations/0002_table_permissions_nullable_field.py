@@ -0,0 +1,78 @@
+"""
+Make table_permissions.field_id nullable, for the permissions on a whole table
+
+Replaces script2.py, which rebuilt the table in a single transaction.
+PostgreSQL and MySQL drop the constraint in place. SQLite cannot change a
+column: the table is copied in batches to table_permissions_new, which
+triggers keep up to date with the permissions saved meanwhile, and the copy
+replaces the table in a short final transaction.
+"""
+import sqlalchemy as sa
+
+COLUMNS = ['id', 'user_id', 'table_id', 'field_id', 'match_value', 'all_access', 'created_at']
+
+table_permissions = sa.table('table_permissions', *(sa.column(name) for name in COLUMNS))
+table_permissions_new = sa.table('table_permissions_new', *(sa.column(name) for name in COLUMNS))
+
+NEW_VALUES = ', '.join(f'NEW.{name}' for name in COLUMNS)
+
+SQLITE_COPY = [
+    """
+    CREATE TABLE IF NOT EXISTS table_permissions_new (
+        id INTEGER NOT NULL PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users (id),
+        table_id INTEGER NOT NULL REFERENCES tables (id),
+        field_id INTEGER REFERENCES table_fields (id),
+        match_value VARCHAR(255),
+        all_access BOOLEAN,
+        created_at DATETIME
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS table_permissions_copy_insert AFTER INSERT ON table_permissions
+    BEGIN
+        INSERT OR REPLACE INTO table_permissions_new ({', '.join(COLUMNS)}) VALUES ({NEW_VALUES});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS table_permissions_copy_update AFTER UPDATE ON table_permissions
+    BEGIN
+        DELETE FROM table_permissions_new WHERE id = OLD.id;
+        INSERT OR REPLACE INTO table_permissions_new ({', '.join(COLUMNS)}) VALUES ({NEW_VALUES});
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS table_permissions_copy_delete AFTER DELETE ON table_permissions
+    BEGIN
+        DELETE FROM table_permissions_new WHERE id = OLD.id;
+    END
+    """,
+]
+
+SQLITE_SWAP = [
+    'DROP TRIGGER table_permissions_copy_insert',
+    'DROP TRIGGER table_permissions_copy_update',
+    'DROP TRIGGER table_permissions_copy_delete',
+    'DROP TABLE table_permissions',
+    'ALTER TABLE table_permissions_new RENAME TO table_permissions',
+]
+
+def expand(migration):
+    columns = migration.columns('table_permissions')
+    if columns['field_id']['nullable']:
+        return
+    if migration.dialect == 'postgresql':
+        # Only changes the catalog, the rows are not rewritten
+        migration.execute('ALTER TABLE table_permissions ALTER COLUMN field_id DROP NOT NULL')
+    elif migration.dialect == 'mysql':
+        migration.execute('ALTER TABLE table_permissions MODIFY field_id INTEGER NULL')
+    else:
+        migration.execute(*SQLITE_COPY)
+
+def backfill(migration):
+    if migration.has_table('table_permissions_new'):
+        migration.copy_rows(table_permissions, table_permissions_new, COLUMNS)
+
+def contract(migration):
+    if migration.has_table('table_permissions_new'):
+        migration.execute(*SQLITE_SWAP)
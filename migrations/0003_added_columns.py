@@ -0,0 +1,64 @@
+"""
+Add the columns introduced since the first release
+
+Previously added by helpers.ensure_columns on every bootstrap. The minified
+CSS of the existing print templates is filled in, so they are not minified
+on every print.
+"""
+import re
+
+import sqlalchemy as sa
+
+print_templates = sa.table(
+    'print_templates', sa.column('id', sa.Integer), sa.column('css', sa.Text), sa.column('css_minified', sa.Text)
+)
+
+# Copy of print_assets.minify_css when this migration was written
+CSS_TOKENS = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/', re.S)
+
+def _squeeze_css(chunk):
+    chunk = re.sub(r'\s+', ' ', chunk)
+    chunk = re.sub(r' ?([{};,>]) ?', r'\1', chunk)
+    chunk = chunk.replace(': ', ':')
+    return chunk.replace(';}', '}')
+
+def minify_css(css):
+    """Remove the comments and the whitespace of a style sheet, leaving strings untouched"""
+    if not css:
+        return css
+    parts = []
+    pending = ''
+    position = 0
+    for match in CSS_TOKENS.finditer(css):
+        pending += css[position:match.start()]
+        if match.group(1):
+            parts.append(_squeeze_css(pending))
+            parts.append(match.group(1))
+            pending = ''
+        else:
+            pending += ' '
+        position = match.end()
+    parts.append(_squeeze_css(pending + css[position:]))
+    return ''.join(parts).strip()
+
+COLUMNS = [
+    ('users', sa.Column('session_version', sa.Integer, nullable=False, server_default=sa.text('1'))),
+    ('tables', sa.Column('archive_after_days', sa.Integer)),
+    ('records', sa.Column('version', sa.Integer, nullable=False, server_default=sa.text('1'))),
+    ('print_templates', sa.Column('css_minified', sa.Text)),
+    ('print_templates', sa.Column('logo_file', sa.String(80))),
+]
+
+def expand(migration):
+    for table_name, column in COLUMNS:
+        migration.add_column(table_name, column)
+
+def backfill(migration):
+    pending = [print_templates.c.css.isnot(None), print_templates.c.css_minified.is_(None)]
+    for connection, rows in migration.batches(print_templates, *pending, columns=[print_templates.c.css]):
+        for row in rows:
+            connection.execute(
+                sa.update(print_templates)
+                .where(print_templates.c.id == row.id, *pending)
+                .values(css_minified=minify_css(row.css))
+            )
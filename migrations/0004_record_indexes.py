@@ -0,0 +1,17 @@
+"""
+Index records and their values, the change feed and the idempotency keys
+
+Previously created by helpers.ensure_indexes on every bootstrap.
+"""
+INDEXES = [
+    ('ix_records_table_id', 'records', 'table_id'),
+    ('ix_record_values_record_field', 'record_values', 'record_id', 'field_id'),
+    ('ix_record_values_field_text', 'record_values', 'field_id', 'text_value'),
+    ('ix_record_unique_keys_record', 'record_unique_keys', 'record_id'),
+    ('ix_record_changes_table_seq', 'record_changes', 'table_id', 'id'),
+    ('ix_idempotency_keys_created_at', 'idempotency_keys', 'created_at'),
+]
+
+def expand(migration):
+    for index_name, table_name, *columns in INDEXES:
+        migration.create_index(index_name, table_name, *columns)
@@ -0,0 +1,103 @@
+"""
+Build the keys of the unique fields created before record_unique_keys existed
+
+Previously built by helpers.ensure_unique_keys on every bootstrap, a field at
+a time in one transaction. The keys are now inserted a batch of values at a
+time. When several records already share a value, the first one keeps it and
+the others are reported in the log: they cannot be enforced until edited.
+"""
+import hashlib
+import logging
+
+import sqlalchemy as sa
+
+logger = logging.getLogger(__name__)
+
+table_fields = sa.table(
+    'table_fields', sa.column('id', sa.Integer), sa.column('field_type', sa.String), sa.column('unique', sa.Boolean)
+)
+record_values = sa.table(
+    'record_values',
+    sa.column('id', sa.Integer),
+    sa.column('record_id', sa.Integer),
+    sa.column('field_id', sa.Integer),
+    sa.column('text_value', sa.Text),
+    sa.column('number_value', sa.Float),
+    sa.column('date_value', sa.Date)
+)
+record_unique_keys = sa.table(
+    'record_unique_keys',
+    sa.column('field_id', sa.Integer),
+    sa.column('record_id', sa.Integer),
+    sa.column('value_key', sa.String)
+)
+
+def value_key(field_type, text_value, number_value, date_value):
+    """
+    Return the key of a value, or None for an empty value
+
+    Must give the keys of models.RecordUniqueKey.make_key when this
+    migration was written: the SHA-256 of the value as displayed.
+    """
+    if field_type in ('text', 'dropdown'):
+        value = text_value
+    elif field_type == 'number':
+        value = number_value
+    elif field_type == 'date':
+        value = date_value.strftime('%Y-%m-%d') if date_value else None
+    else:
+        value = None
+    if value is None or value == '':
+        return None
+    return hashlib.sha256(str(value).encode('utf-8')).hexdigest()
+
+def _fields_without_keys(migration):
+    """Unique fields with values that have no key, as [id, field_type]"""
+    # Not "fields without keys": records saved since the upgrade already have theirs
+    value_without_key = sa.exists().where(
+        record_values.c.field_id == table_fields.c.id,
+        ~sa.exists().where(
+            record_unique_keys.c.field_id == table_fields.c.id,
+            record_unique_keys.c.record_id == record_values.c.record_id
+        )
+    )
+    with migration.engine.connect() as connection:
+        return [list(row) for row in connection.execute(
+            sa.select(table_fields.c.id, table_fields.c.field_type)
+            .where(table_fields.c.unique == sa.true(), value_without_key)
+            .order_by(table_fields.c.id)
+        )]
+
+def backfill(migration):
+    if 'fields' not in migration.checkpoint:
+        # Fields get keys as they are processed: remember which ones were missing
+        migration.checkpoint['fields'] = _fields_without_keys(migration)
+        with migration.write() as connection:
+            migration.save_checkpoint(connection)
+
+    columns = [record_values.c.record_id, record_values.c.text_value, record_values.c.number_value, record_values.c.date_value]
+    for field_id, field_type in migration.checkpoint['fields']:
+        duplicates = 0
+        for connection, rows in migration.batches(
+            record_values, record_values.c.field_id == field_id, columns=columns, name=f'field_{field_id}'
+        ):
+            keys = {}
+            for row in rows:
+                key = value_key(field_type, row.text_value, row.number_value, row.date_value)
+                if key is not None:
+                    keys[row.record_id] = key
+            if not keys:
+                continue
+
+            connection.execute(migration.insert_ignore(record_unique_keys), [
+                {'field_id': field_id, 'record_id': record_id, 'value_key': key}
+                for record_id, key in keys.items()
+            ])
+            keyed = set(connection.execute(
+                sa.select(record_unique_keys.c.record_id)
+                .where(record_unique_keys.c.field_id == field_id, record_unique_keys.c.record_id.in_(list(keys)))
+            ).scalars())
+            duplicates += len(keys) - len(keyed)
+
+        if duplicates:
+            logger.warning('Field %d: %d records share their value with another record and are not unique', field_id, duplicates)
@@ -0,0 +1,101 @@
+"""
+Never reuse the id of a deleted or archived record on SQLite
+
+Without AUTOINCREMENT, SQLite gives a new record the id of the newest record
+archived or deleted, which the archive and the change feed already use.
+Declaring it needs a new table: records is copied in batches to records_new,
+which triggers keep up to date, as in 0002. The swap starts the ids after the
+highest id ever archived or logged. PostgreSQL and MySQL never reuse ids.
+"""
+import sqlalchemy as sa
+
+COLUMNS = ['id', 'table_id', 'created_by', 'created_at', 'modified_at', 'version']
+
+records = sa.table('records', *(sa.column(name) for name in COLUMNS))
+records_new = sa.table('records_new', *(sa.column(name) for name in COLUMNS))
+archived_records = sa.table('archived_records', sa.column('id', sa.Integer))
+record_changes = sa.table('record_changes', sa.column('record_id', sa.Integer))
+
+NEW_VALUES = ', '.join(f'NEW.{name}' for name in COLUMNS)
+
+SQLITE_COPY = [
+    """
+    CREATE TABLE IF NOT EXISTS records_new (
+        id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+        table_id INTEGER NOT NULL REFERENCES tables (id),
+        created_by INTEGER NOT NULL REFERENCES users (id),
+        created_at DATETIME,
+        modified_at DATETIME,
+        version INTEGER DEFAULT 1 NOT NULL
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS records_copy_insert AFTER INSERT ON records
+    BEGIN
+        INSERT OR REPLACE INTO records_new ({', '.join(COLUMNS)}) VALUES ({NEW_VALUES});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS records_copy_update AFTER UPDATE ON records
+    BEGIN
+        DELETE FROM records_new WHERE id = OLD.id;
+        INSERT OR REPLACE INTO records_new ({', '.join(COLUMNS)}) VALUES ({NEW_VALUES});
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS records_copy_delete AFTER DELETE ON records
+    BEGIN
+        DELETE FROM records_new WHERE id = OLD.id;
+    END
+    """,
+]
+
+SQLITE_SWAP = [
+    'DROP TRIGGER records_copy_insert',
+    'DROP TRIGGER records_copy_update',
+    'DROP TRIGGER records_copy_delete',
+    'DROP TABLE records',
+    # Also renames its sqlite_sequence row
+    'ALTER TABLE records_new RENAME TO records',
+    'CREATE INDEX IF NOT EXISTS ix_records_table_id ON records (table_id)',
+]
+
+def _is_autoincrement(migration):
+    with migration.engine.connect() as connection:
+        sql = connection.execute(sa.text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'records'")).scalar()
+    return 'AUTOINCREMENT' in (sql or '').upper()
+
+def _highest_used_id(migration):
+    """Return the highest record id archived or in the change feed"""
+    highest = 0
+    if sa.inspect(migration.archive_engine).has_table('archived_records'):
+        with migration.archive_engine.connect() as connection:
+            highest = connection.execute(sa.select(sa.func.max(archived_records.c.id))).scalar() or 0
+    if migration.has_table('record_changes'):
+        with migration.engine.connect() as connection:
+            highest = max(highest, connection.execute(sa.select(sa.func.max(record_changes.c.record_id))).scalar() or 0)
+    return highest
+
+def expand(migration):
+    if migration.dialect == 'sqlite' and not _is_autoincrement(migration):
+        migration.execute(*SQLITE_COPY)
+
+def backfill(migration):
+    if migration.has_table('records_new'):
+        migration.copy_rows(records, records_new, COLUMNS)
+
+def contract(migration):
+    if not migration.has_table('records_new'):
+        return
+    highest = _highest_used_id(migration)
+    with migration.write() as connection:
+        for statement in SQLITE_SWAP:
+            connection.exec_driver_sql(statement)
+        # Only set by inserts: missing if records was empty
+        connection.execute(sa.text(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT 'records', 0 "
+            "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'records')"
+        ))
+        connection.execute(sa.text(
+            "UPDATE sqlite_sequence SET seq = MAX(seq, :highest) WHERE name = 'records'"
+        ), {'highest': highest})
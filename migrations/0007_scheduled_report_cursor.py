@@ -0,0 +1,10 @@
+"""
+Remember the change feed position of the precomputed reports
+
+Reports rendered before this migration have no position: they are rendered
+again on the next run of the scheduler.
+"""
+import sqlalchemy as sa
+
+def expand(migration):
+    migration.add_column('scheduled_reports', sa.Column('change_cursor', sa.Integer))
@@ -0,0 +1,335 @@
+"""
+Versioned schema migrations.
+
+Each module of this package is one migration, applied in the order of its
+number (0001_..., 0002_...). The first line of its docstring describes it,
+and it defines up to three steps, functions taking a Migration:
+
+    expand(migration)    Additions the running code does not mind: nullable
+                         columns or columns with a default, indexes, copies
+                         of tables being rebuilt
+    backfill(migration)  Data changes, in batches of MIGRATION_BATCH_SIZE rows,
+                         each committed with a checkpoint: an interrupted
+                         backfill resumes after its last batch
+    contract(migration)  Removals and swaps, once no running code needs the
+                         old schema
+
+Expand and backfill run while the application serves requests, so a release
+that changes the schema is deployed in two steps:
+
+    flask --app main migrate --expand-only   # the previous version still runs
+    (deploy the new version)
+    flask --app main migrate                 # also run by bootstrap
+
+New tables are created from the models before the migrations run. The
+progress of each migration is stored in schema_migrations. A database
+created by bootstrap from the current models already has the schema of every
+migration: they are recorded as complete without running.
+
+Migrations describe the tables they change with SQLAlchemy Core instead of
+the models, which keep changing, and check what exists before changing it,
+so they also apply to databases changed by hand. Only the default database,
+or the database of the current scout group (see tenants.py), is migrated;
+the archive and replica binds are not.
+
+Configuration:
+    MIGRATION_BATCH_SIZE: Rows per backfill batch (default 1000)
+    MIGRATION_BATCH_PAUSE: Seconds between two batches, leaving the database
+        to the workers (default 0.01)
+"""
+import importlib
+import json
+import logging
+import os
+import pkgutil
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import click
+from flask import current_app
+from sqlalchemy import inspect, insert, select, text, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateColumn
+
+from app import app, db
+from models import SchemaMigration
+from routing import ARCHIVE_BIND
+from tenants import current_engine
+
+logger = logging.getLogger(__name__)
+
+migrations_table = SchemaMigration.__table__
+
+class Migration:
+    """A migration module, with the helpers its steps use"""
+
+    def __init__(self, version, name, module):
+        self.version = version
+        self.name = name
+        self.module = module
+        self.description = (module.__doc__ or name).strip().splitlines()[0]
+        self.engine = current_engine()
+        # Read only: migrations do not change the archive
+        self.archive_engine = current_engine(ARCHIVE_BIND)
+        self.batch_size = current_app.config['MIGRATION_BATCH_SIZE']
+        self.pause = current_app.config['MIGRATION_BATCH_PAUSE']
+        self.checkpoint = {}
+
+    @property
+    def dialect(self):
+        return self.engine.dialect.name
+
+    def has_table(self, table_name):
+        return inspect(self.engine).has_table(table_name)
+
+    def columns(self, table_name):
+        """Return the columns of a table in the database, by name"""
+        return {column['name']: column for column in inspect(self.engine).get_columns(table_name)}
+
+    def has_index(self, table_name, index_name):
+        return any(index['name'] == index_name for index in inspect(self.engine).get_indexes(table_name))
+
+    @contextmanager
+    def write(self):
+        """Yield a connection in a write transaction, committed at the end of the block"""
+        with self.engine.connect() as connection:
+            if self.dialect == 'sqlite':
+                # Take the write lock before reading, see group_commit.begin_write_transaction
+                connection.exec_driver_sql('BEGIN IMMEDIATE')
+            yield connection
+            connection.commit()
+
+    def execute(self, *statements):
+        """Run SQL statements in one write transaction"""
+        with self.write() as connection:
+            for statement in statements:
+                connection.execute(text(statement) if isinstance(statement, str) else statement)
+
+    def add_column(self, table_name, column):
+        """
+        Add a column unless it exists
+
+        NOT NULL columns need a server default; adding them is then instant on
+        SQLite and PostgreSQL 11+, whatever the size of the table.
+        """
+        if column.name in self.columns(table_name):
+            return
+        definition = CreateColumn(column).compile(dialect=self.engine.dialect)
+        self.execute(f'ALTER TABLE {table_name} ADD COLUMN {definition}')
+        logger.info('Added column %s.%s', table_name, column.name)
+
+    def create_index(self, index_name, table_name, *columns, unique=False):
+        """
+        Create an index unless it exists
+
+        PostgreSQL builds it CONCURRENTLY, without blocking writes. SQLite has
+        no such option: writes wait while the index is built.
+        """
+        statement = f'CREATE {"UNIQUE " if unique else ""}INDEX {{}}{index_name} ON {table_name} ({", ".join(columns)})'
+        if self.dialect == 'postgresql':
+            with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                # A failed concurrent build leaves an invalid index behind
+                invalid = connection.execute(text(
+                    'SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name'
+                ), {'name': index_name}).scalar()
+                if invalid:
+                    connection.exec_driver_sql(f'DROP INDEX CONCURRENTLY {index_name}')
+                elif invalid is not None:
+                    return
+                connection.exec_driver_sql(statement.format('CONCURRENTLY '))
+        else:
+            if self.has_index(table_name, index_name):
+                return
+            self.execute(statement.format(''))
+        logger.info('Created index %s', index_name)
+
+    def save_checkpoint(self, connection):
+        connection.execute(
+            update(migrations_table)
+            .where(migrations_table.c.version == self.version)
+            .values(checkpoint=json.dumps(self.checkpoint))
+        )
+
+    def batches(self, table, *where, columns=None, name='backfill'):
+        """
+        Yield the rows of a table by increasing id, a batch at a time, each with a connection in a write transaction
+
+        The transaction is committed, with the checkpoint of the batch, when
+        the next batch is requested: after an interruption the batches
+        resume after the last one committed. Rows are read before the write
+        transaction starts, so changes must check their condition again
+        (e.g. UPDATE ... WHERE column IS NULL).
+
+        Args:
+            table (TableClause): Table to read, with an id column
+            where: Conditions on the rows
+            columns (list, optional): Columns to read, defaults to the id
+            name (str): Checkpoint of this loop, for migrations with several
+
+        Yields:
+            tuple: (Connection, rows)
+        """
+        key = table.c.id
+        columns = columns or [key]
+        if not any(column is key for column in columns):
+            columns = [key, *columns]
+        count = 0
+        while True:
+            query = select(*columns).where(*where).order_by(key).limit(self.batch_size)
+            last = self.checkpoint.get(name)
+            if last is not None:
+                query = query.where(key > last)
+            with self.engine.connect() as connection:
+                rows = connection.execute(query).all()
+            if not rows:
+                return
+
+            with self.write() as connection:
+                yield connection, rows
+                self.checkpoint[name] = rows[-1].id
+                self.save_checkpoint(connection)
+            count += len(rows)
+            logger.debug('Migration %s: %d rows of %s, up to id %s', self.version, count, table.name, rows[-1].id)
+            time.sleep(self.pause)
+
+    def backfill(self, table, values, *where, name='backfill'):
+        """Set values on the rows matching where, a batch of ids at a time"""
+        for connection, rows in self.batches(table, *where, name=name):
+            connection.execute(
+                update(table).where(table.c.id.between(rows[0].id, rows[-1].id), *where).values(values)
+            )
+
+    def insert_ignore(self, table):
+        """Return an INSERT into table that skips the rows violating a unique constraint"""
+        if self.dialect == 'postgresql':
+            return postgresql.insert(table).on_conflict_do_nothing()
+        return insert(table).prefix_with('OR IGNORE' if self.dialect == 'sqlite' else 'IGNORE')
+
+    def copy_rows(self, source, target, columns, name='copy'):
+        """Copy the rows of source missing from target, a batch of ids at a time, for table rebuilds"""
+        source_columns = [source.c[column] for column in columns]
+        for connection, rows in self.batches(source, name=name):
+            rows_query = select(*source_columns).where(source.c.id.between(rows[0].id, rows[-1].id))
+            connection.execute(self.insert_ignore(target).from_select(columns, rows_query))
+
+    def run(self, step, phase):
+        """Run a step of the migration, if it has one, and record the phase reached"""
+        function = getattr(self.module, step, None)
+        started = time.perf_counter()
+        if function is not None:
+            logger.info('Migration %s (%s): %s', self.version, self.description, step)
+            function(self)
+
+        values = {'phase': phase}
+        if phase == 'complete':
+            values['completed_at'] = datetime.utcnow()
+        with self.write() as connection:
+            connection.execute(update(migrations_table).where(migrations_table.c.version == self.version).values(values))
+        if function is not None:
+            logger.info('Migration %s: %s done in %.1f s', self.version, step, time.perf_counter() - started)
+
+def load_migrations():
+    """Return the migrations of this package, by version"""
+    migrations = []
+    for module_info in pkgutil.iter_modules(__path__):
+        version, _, name = module_info.name.partition('_')
+        if version.isdigit():
+            migrations.append(Migration(version, name, importlib.import_module(f'{__name__}.{module_info.name}')))
+    return sorted(migrations, key=lambda migration: migration.version)
+
+def migration_states():
+    """Return the schema_migrations rows, by version"""
+    engine = current_engine()
+    if not inspect(engine).has_table(migrations_table.name):
+        return {}
+    with engine.connect() as connection:
+        return {row.version: row for row in connection.execute(select(migrations_table))}
+
+def stamp_migrations():
+    """Record every migration as complete, on a database just created from the models"""
+    states = migration_states()
+    now = datetime.utcnow()
+    rows = [
+        {'version': migration.version, 'name': migration.name, 'phase': 'complete', 'started_at': now, 'completed_at': now}
+        for migration in load_migrations() if migration.version not in states
+    ]
+    if rows:
+        with current_engine().begin() as connection:
+            connection.execute(insert(migrations_table), rows)
+
+def run_migrations(expand_only=False):
+    """
+    Apply the pending migrations, resuming any that was interrupted
+
+    Args:
+        expand_only (bool): Stop before the first contract step, while the
+            previous version of the application still runs
+
+    Returns:
+        list: Versions of the migrations completed
+    """
+    states = migration_states()
+    completed = []
+    for migration in load_migrations():
+        state = states.get(migration.version)
+        phase = state.phase if state is not None else 'pending'
+        if phase == 'complete':
+            continue
+
+        if state is None:
+            with current_engine().begin() as connection:
+                connection.execute(insert(migrations_table).values(
+                    version=migration.version, name=migration.name, phase='pending', started_at=datetime.utcnow()
+                ))
+        elif state.checkpoint:
+            migration.checkpoint = json.loads(state.checkpoint)
+            logger.info('Migration %s: resuming after %s', migration.version, migration.checkpoint)
+
+        if phase == 'pending':
+            migration.run('expand', 'expanded')
+            phase = 'expanded'
+        if phase == 'expanded':
+            migration.run('backfill', 'backfilled')
+        if expand_only and hasattr(migration.module, 'contract'):
+            # Later migrations may rely on the contracted schema
+            logger.info('Migration %s: contract left for after the deployment', migration.version)
+            break
+        migration.run('contract', 'complete')
+        completed.append(migration.version)
+    return completed
+
+def migrate_database(expand_only=False):
+    """
+    Create the new tables and apply the pending migrations
+
+    Returns:
+        list: Versions of the migrations completed
+    """
+    fresh = not inspect(current_engine()).has_table('users')
+    for bind_key, metadata in db.metadatas.items():
+        metadata.create_all(current_engine(bind_key))
+    if fresh:
+        stamp_migrations()
+        return []
+    return run_migrations(expand_only)
+
+def init_migrations(app):
+    """Read the migration settings"""
+    app.config.setdefault('MIGRATION_BATCH_SIZE', int(os.environ.get('MIGRATION_BATCH_SIZE', 1000)))
+    app.config.setdefault('MIGRATION_BATCH_PAUSE', float(os.environ.get('MIGRATION_BATCH_PAUSE', 0.01)))
+
+@app.cli.command('migrate')
+@click.option('--expand-only', is_flag=True, help='Stop before the contract steps, while the previous version still runs.')
+@click.option('--status', is_flag=True, help='List the migrations and the phase they reached.')
+def migrate_command(expand_only, status):
+    """Apply the pending schema migrations."""
+    if status:
+        states = migration_states()
+        for migration in load_migrations():
+            state = states.get(migration.version)
+            print(f'{migration.version}  {state.phase if state is not None else "pending":<10}  {migration.description}')
+        return
+
+    completed = migrate_database(expand_only)
+    print(f'{len(completed)} migration(s) appliquée(s).')
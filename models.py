@@ -2,6 +2,7 @@ from app import db
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+import hashlib
 import json
 
 # Define roles as constants
@@ -18,6 +19,8 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(256), nullable=False)
     role = db.Column(db.String(20), nullable=False, default=ROLE_READONLY)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Incremented to log out the user's sessions, see identity.py
+    session_version = db.Column(db.Integer, nullable=False, default=1, server_default=db.text('1'))
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -43,6 +46,8 @@ class Table(db.Model):
     description = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     modified_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Records unchanged for this many days are moved to the archive, see archive.py (None: never)
+    archive_after_days = db.Column(db.Integer, nullable=True)
 
     # Relationships
     fields = db.relationship('TableField', backref='table', cascade='all, delete-orphan')
@@ -75,6 +80,7 @@ class TableField(db.Model):
 
     # Relationships
     values = db.relationship('RecordValue', backref='field', cascade='all, delete-orphan')
+    unique_keys = db.relationship('RecordUniqueKey', cascade='all, delete-orphan')
 
     def __repr__(self):
         return f'<TableField {self.name} ({self.field_type})>'
@@ -101,15 +107,20 @@ class TableField(db.Model):
 
 class Record(db.Model):
     __tablename__ = 'records'
+    # Never reuse the id of a deleted or archived record, see migrations/0006
+    __table_args__ = {'sqlite_autoincrement': True}
 
     id = db.Column(db.Integer, primary_key=True)
-    table_id = db.Column(db.Integer, db.ForeignKey('tables.id'), nullable=False)
+    table_id = db.Column(db.Integer, db.ForeignKey('tables.id'), nullable=False, index=True)
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     modified_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Incremented by every edit, see helpers.claim_record_version
+    version = db.Column(db.Integer, nullable=False, default=1, server_default=db.text('1'))
 
     # Relationships
     values = db.relationship('RecordValue', backref='record', cascade='all, delete-orphan')
+    unique_keys = db.relationship('RecordUniqueKey', cascade='all, delete-orphan')
     creator = db.relationship('User', backref='created_records')
 
     def __repr__(self):
@@ -126,12 +137,17 @@ class Record(db.Model):
             'created_by': self.created_by,
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M'),
             'modified_at': self.modified_at.strftime('%Y-%m-%d %H:%M'),
+            'version': self.version,
             'values': values_dict,
             'creator': self.creator.username
         }
 
 class RecordValue(db.Model):
     __tablename__ = 'record_values'
+    __table_args__ = (
+        db.Index('ix_record_values_record_field', 'record_id', 'field_id'),
+        db.Index('ix_record_values_field_text', 'field_id', 'text_value'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     record_id = db.Column(db.Integer, db.ForeignKey('records.id'), nullable=False)
@@ -155,13 +171,48 @@ class RecordValue(db.Model):
                 self.date_value = value
 
     def get_value(self):
-        if self.field.field_type == 'text' or self.field.field_type == 'dropdown':
-            return self.text_value
-        elif self.field.field_type == 'number':
-            return self.number_value
-        elif self.field.field_type == 'date':
-            return self.date_value.strftime('%Y-%m-%d') if self.date_value else None
+        return RecordValue.format_value(self.field.field_type, self.text_value, self.number_value, self.date_value)
+
+    @staticmethod
+    def format_value(field_type, text_value, number_value, date_value):
+        """Return the display value of raw record_values columns for a field type"""
+        if field_type == 'text' or field_type == 'dropdown':
+            return text_value
+        elif field_type == 'number':
+            return number_value
+        elif field_type == 'date':
+            return date_value.strftime('%Y-%m-%d') if date_value else None
         return None
+
+class RecordUniqueKey(db.Model):
+    """
+    Value of a unique field, one row per record
+
+    The unique constraint on (field_id, value_key) makes the database reject
+    a duplicate value, whatever the value type, see helpers.sync_unique_keys.
+    """
+    __tablename__ = 'record_unique_keys'
+    __table_args__ = (
+        db.UniqueConstraint('field_id', 'value_key', name='uq_record_unique_keys_field_value'),
+        db.Index('ix_record_unique_keys_record', 'record_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    field_id = db.Column(db.Integer, db.ForeignKey('table_fields.id'), nullable=False)
+    record_id = db.Column(db.Integer, db.ForeignKey('records.id'), nullable=False)
+    # SHA-256 of the display value, so that long texts fit in an indexed column
+    value_key = db.Column(db.String(64), nullable=False)
+
+    def __repr__(self):
+        return f'<RecordUniqueKey for Record {self.record_id}, Field {self.field_id}>'
+
+    @staticmethod
+    def make_key(field_type, text_value, number_value, date_value):
+        """Return the key of raw record_values columns, or None for an empty value"""
+        value = RecordValue.format_value(field_type, text_value, number_value, date_value)
+        if value is None or value == '':
+            return None
+        return hashlib.sha256(str(value).encode('utf-8')).hexdigest()
 class PrintTemplate(db.Model):
     __tablename__ = 'print_templates'
 
@@ -170,7 +221,9 @@ class PrintTemplate(db.Model):
     header_html = db.Column(db.Text)
     footer_html = db.Column(db.Text)
     css = db.Column(db.Text)
+    css_minified = db.Column(db.Text)  # Minified copy of css, see print_assets.minify_css
     logo_url = db.Column(db.String(255))
+    logo_file = db.Column(db.String(80))  # Logo stored in PRINT_ASSETS_FOLDER, named after its hash
     is_default = db.Column(db.Boolean, default=False)
 
 class ReportTemplate(db.Model):
@@ -185,6 +238,77 @@ class ReportTemplate(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     modified_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    def get_fields(self):
+        if not self.fields:
+            return []
+        return json.loads(self.fields)
+
+    def set_fields(self, field_ids):
+        self.fields = json.dumps(field_ids)
+
+class ScheduledReport(db.Model):
+    __tablename__ = 'scheduled_reports'
+
+    id = db.Column(db.Integer, primary_key=True)
+    report_id = db.Column(db.Integer, db.ForeignKey('report_templates.id'), nullable=False, unique=True)
+    frequency = db.Column(db.String(20), nullable=False)  # daily, weekly, monthly
+    period = db.Column(db.String(20), nullable=True)  # Period covered by the stored content
+    content = db.Column(db.Text, nullable=True)
+    generated_at = db.Column(db.DateTime, nullable=True)
+    # Latest change feed entry of the report's tables when the content was rendered
+    change_cursor = db.Column(db.Integer, nullable=True)
+
+    report = db.relationship('ReportTemplate', backref=db.backref('schedule', uselist=False, cascade='all, delete-orphan'))
+
+class RecordChange(db.Model):
+    """Entry of the change feed: one insert, update or delete of a record"""
+    __tablename__ = 'record_changes'
+    __table_args__ = (
+        db.Index('ix_record_changes_table_seq', 'table_id', 'id'),
+        # AUTOINCREMENT never reuses ids, so they can serve as sync cursors
+        {'sqlite_autoincrement': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Plain columns: changes outlive the records, and tables or users, they describe
+    table_id = db.Column(db.Integer, nullable=False)
+    record_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(10), nullable=False)  # insert, update, delete
+    changed_by = db.Column(db.Integer, nullable=True)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    payload = db.Column(db.Text)  # JSON: values by field name, and previous values on update
+
+    def get_payload(self):
+        if not self.payload:
+            return {}
+        return json.loads(self.payload)
+
+    def set_payload(self, payload):
+        self.payload = json.dumps(payload)
+
+class IdempotencyKey(db.Model):
+    """Result of a record creation, replayed when a client retries with the same key"""
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_keys_user_key'),
+        db.Index('ix_idempotency_keys_created_at', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    key = db.Column(db.String(64), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)  # SHA-256 of the request data
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    result = db.Column(db.Text)  # JSON result of the request
+
+    def get_result(self):
+        if self.result is None:
+            return None
+        return json.loads(self.result)
+
+    def set_result(self, result):
+        self.result = json.dumps(result)
+
 class TablePermission(db.Model):
     __tablename__ = 'table_permissions'
 
@@ -205,4 +329,45 @@ class GenericText(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
-    content = db.Column(db.Text, nullable=False)
\ No newline at end of file
+    content = db.Column(db.Text, nullable=False)
+
+class SchemaMigration(db.Model):
+    """Progress of a schema migration, see migrations/__init__.py"""
+    __tablename__ = 'schema_migrations'
+
+    version = db.Column(db.String(20), primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    phase = db.Column(db.String(20), nullable=False, default='pending')  # pending, expanded, backfilled, complete
+    checkpoint = db.Column(db.Text)  # JSON: last key processed by each backfill
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+
+class ArchivedRecord(db.Model):
+    """Record moved out of the working tables by archive.py, with its values"""
+    __bind_key__ = 'archive'
+    __tablename__ = 'archived_records'
+    __table_args__ = (
+        db.Index('ix_archived_records_table_created', 'table_id', 'created_at'),
+    )
+
+    # Same ID as in `records`; plain columns, the archive may be another database
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    table_id = db.Column(db.Integer, nullable=False)
+    created_by = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime)
+    modified_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    values = db.Column(db.Text, nullable=False)  # JSON: values by field name
+    search_text = db.Column(db.Text, nullable=False, default='')  # Lowercase values, for searching
+
+    def get_values(self):
+        return json.loads(self.values)
+
+    @staticmethod
+    def encode_pair(name, value):
+        """Return a field value as it appears in `values`, to match it with LIKE"""
+        return json.dumps({name: value})[1:-1]
+
+    def set_values(self, values):
+        self.values = json.dumps(values)
+        self.search_text = '\n'.join(str(value) for value in values.values() if value not in (None, '')).lower()
@@ -0,0 +1,284 @@
+"""
+Server-side PDF rendering with wkhtmltopdf.
+
+Renderer slots are created once per worker process and reused across jobs:
+each slot keeps its pdfkit configuration (resolving the wkhtmltopdf binary
+runs `which` every time otherwise) and, when wkhtmltopdf needs an X server,
+a long-lived Xvfb display. Starting Xvfb costs a few hundred milliseconds,
+which used to be paid by every PDF.
+
+wkhtmltopdf itself has no server mode, so each job still runs one short
+wkhtmltopdf process on a warm slot. The number of slots caps how many run
+at once; a job waits up to PDF_RENDERER_TIMEOUT for a free slot. A slot is
+checked before every job (its Xvfb must still run) and restarted after
+PDF_RENDERER_MAX_JOBS jobs or a failed job.
+
+pdfkit and xvfbwrapper are optional: without them, or without the
+wkhtmltopdf binary, the print pages stay browser-printed HTML.
+
+Configuration:
+    PDF_RENDERER_SLOTS: Renderer slots per worker process (default 2)
+    PDF_RENDERER_MAX_JOBS: Jobs before a slot is restarted (default 200)
+    PDF_RENDERER_TIMEOUT: Seconds to wait for a free slot (default 30)
+    PDF_RENDERER_XVFB: "1" or "0" to force or disable Xvfb (default: used
+        when DISPLAY is unset and wkhtmltopdf is not built with patched Qt)
+    PDF_RENDERER_PREWARM: "1" to start the slots when a worker starts,
+        "0" to start them on the first PDF (default 1)
+    WKHTMLTOPDF_PATH: Path of the wkhtmltopdf binary (default: from PATH)
+"""
+import atexit
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+PDF_OPTIONS = {
+    'encoding': 'UTF-8',
+    'page-size': 'A4',
+    'quiet': ''
+}
+
+# xvfbwrapper sets and restores DISPLAY for the whole process: slots starting or
+# stopping on several threads would otherwise restore each other's value
+_display_lock = threading.Lock()
+
+class PdfRendererUnavailable(RuntimeError):
+    """Raised when PDFs cannot be rendered on this server"""
+
+class PdfRendererBusy(RuntimeError):
+    """Raised when no renderer slot became free in time"""
+
+class RendererSlot:
+    """A warm renderer: pdfkit configuration and, if needed, its own Xvfb display"""
+
+    def __init__(self, wkhtmltopdf, use_xvfb):
+        self.wkhtmltopdf = wkhtmltopdf
+        self.use_xvfb = use_xvfb
+        self.xvfb = None
+        self.configuration = None
+        self.jobs = 0
+        self.started_at = None
+
+    def start(self):
+        import pdfkit
+
+        with _display_lock:
+            environ = dict(os.environ)
+            if self.use_xvfb:
+                from xvfbwrapper import Xvfb
+
+                display = environ.get('DISPLAY')
+                self.xvfb = Xvfb(width=1280, height=1024)
+                self.xvfb.start()
+                # xvfbwrapper exports DISPLAY for the whole process; only this slot's jobs use it
+                if display is None:
+                    os.environ.pop('DISPLAY', None)
+                else:
+                    os.environ['DISPLAY'] = display
+                environ['DISPLAY'] = f':{self.xvfb.new_display}'
+
+        self.configuration = pdfkit.configuration(wkhtmltopdf=self.wkhtmltopdf, environ=environ)
+        self.jobs = 0
+        self.started_at = time.monotonic()
+
+    def stop(self):
+        if self.xvfb is not None:
+            with _display_lock:
+                display = os.environ.get('DISPLAY')
+                # stop() deletes DISPLAY before terminating Xvfb and fails if it is unset
+                os.environ.setdefault('DISPLAY', f':{self.xvfb.new_display}')
+                try:
+                    self.xvfb.stop()
+                except Exception as e:
+                    logger.warning('Error stopping Xvfb: %s', e)
+                # stop() restores the DISPLAY seen when the slot was created
+                if display is None:
+                    os.environ.pop('DISPLAY', None)
+                else:
+                    os.environ['DISPLAY'] = display
+            self.xvfb = None
+        self.configuration = None
+
+    def is_healthy(self):
+        if self.configuration is None:
+            return False
+        return self.xvfb is None or (self.xvfb.proc is not None and self.xvfb.proc.poll() is None)
+
+    def render(self, html):
+        import pdfkit
+
+        self.jobs += 1
+        return pdfkit.from_string(html, False, options=PDF_OPTIONS, configuration=self.configuration)
+
+class PdfRendererPool:
+    """Fixed set of renderer slots shared by the threads of a worker process"""
+
+    def __init__(self, size=2, max_jobs=200, timeout=30, use_xvfb=None, wkhtmltopdf=None):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.use_xvfb = use_xvfb
+        self.wkhtmltopdf = wkhtmltopdf
+        self._slots = None
+        self._all_slots = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {'jobs': 0, 'failures': 0, 'restarts': 0, 'waits': 0, 'render_ms': 0.0}
+
+    def _find_wkhtmltopdf(self):
+        path = self.wkhtmltopdf or shutil.which('wkhtmltopdf')
+        if not path or not os.access(path, os.X_OK):
+            raise PdfRendererUnavailable('wkhtmltopdf est introuvable sur ce serveur.')
+        return path
+
+    def _needs_xvfb(self, wkhtmltopdf):
+        if self.use_xvfb is not None:
+            return self.use_xvfb
+        with _display_lock:
+            display = os.environ.get('DISPLAY')
+        if display:
+            return False
+        # Builds with patched Qt render headless; the others need an X server
+        try:
+            version = subprocess.run([wkhtmltopdf, '--version'], capture_output=True, text=True, timeout=10).stdout
+        except (OSError, subprocess.SubprocessError):
+            return False
+        return 'patched qt' not in version.lower()
+
+    def start(self):
+        """Create and warm the slots of this process (after a fork, the parent's slots are not used)"""
+        with self._lock:
+            if self._slots is not None and self._pid == os.getpid():
+                return
+
+            try:
+                import pdfkit  # noqa: F401
+            except ImportError:
+                raise PdfRendererUnavailable('pdfkit n\'est pas installé.')
+
+            wkhtmltopdf = self._find_wkhtmltopdf()
+            use_xvfb = self._needs_xvfb(wkhtmltopdf)
+            if use_xvfb:
+                try:
+                    import xvfbwrapper  # noqa: F401
+                except ImportError:
+                    raise PdfRendererUnavailable('xvfbwrapper n\'est pas installé.')
+
+            slots = queue.LifoQueue()
+            self._all_slots = []
+            for _ in range(self.size):
+                slot = RendererSlot(wkhtmltopdf, use_xvfb)
+                slot.start()
+                self._all_slots.append(slot)
+                slots.put(slot)
+
+            self._slots = slots
+            self._pid = os.getpid()
+            logger.info('PDF renderer started with %d slots (Xvfb: %s)', self.size, use_xvfb)
+
+    def stop(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                for slot in self._all_slots:
+                    slot.stop()
+            self._slots = None
+            self._all_slots = []
+
+    def _count(self, name, value=1):
+        with self._stats_lock:
+            self.stats[name] += value
+
+    def _restart(self, slot):
+        slot.stop()
+        slot.start()
+        self._count('restarts')
+
+    def render(self, html):
+        """
+        Render HTML to PDF bytes on a free slot
+
+        Raises:
+            PdfRendererUnavailable: wkhtmltopdf or pdfkit is missing, or the rendering failed
+            PdfRendererBusy: No slot became free within the timeout
+        """
+        self.start()
+
+        try:
+            slot = self._slots.get_nowait()
+        except queue.Empty:
+            self._count('waits')
+            try:
+                slot = self._slots.get(timeout=self.timeout)
+            except queue.Empty:
+                raise PdfRendererBusy('Tous les générateurs PDF sont occupés, réessayez dans un instant.')
+
+        try:
+            try:
+                if not slot.is_healthy() or slot.jobs >= self.max_jobs:
+                    self._restart(slot)
+                started = time.perf_counter()
+                pdf = slot.render(html)
+            except Exception as e:
+                self._count('failures')
+                logger.warning('PDF rendering failed: %s', e)
+                # The display may be what failed: start the next job on a fresh one
+                try:
+                    self._restart(slot)
+                except Exception:
+                    # Retried before the next job, see is_healthy
+                    logger.exception('Could not restart a PDF renderer slot')
+                raise PdfRendererUnavailable('La génération du PDF a échoué, réessayez dans un instant.') from e
+            self._count('jobs')
+            self._count('render_ms', (time.perf_counter() - started) * 1000)
+            return pdf
+        finally:
+            self._slots.put(slot)
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['slots'] = self.size
+        stats['free'] = self._slots.qsize() if self._slots is not None and self._pid == os.getpid() else 0
+        stats['mean_render_ms'] = round(stats['render_ms'] / stats['jobs'], 1) if stats['jobs'] else None
+        return stats
+
+def init_pdf_renderer(app):
+    """Read the renderer settings and create the pool; slots start on first use or prewarm_pdf_renderer"""
+    app.config.setdefault('PDF_RENDERER_SLOTS', int(os.environ.get('PDF_RENDERER_SLOTS', 2)))
+    app.config.setdefault('PDF_RENDERER_MAX_JOBS', int(os.environ.get('PDF_RENDERER_MAX_JOBS', 200)))
+    app.config.setdefault('PDF_RENDERER_TIMEOUT', float(os.environ.get('PDF_RENDERER_TIMEOUT', 30)))
+    app.config.setdefault('PDF_RENDERER_PREWARM', os.environ.get('PDF_RENDERER_PREWARM', '1') == '1')
+    xvfb = os.environ.get('PDF_RENDERER_XVFB')
+    app.config.setdefault('PDF_RENDERER_XVFB', None if xvfb in (None, '') else xvfb == '1')
+
+    pool = PdfRendererPool(
+        size=app.config['PDF_RENDERER_SLOTS'],
+        max_jobs=app.config['PDF_RENDERER_MAX_JOBS'],
+        timeout=app.config['PDF_RENDERER_TIMEOUT'],
+        use_xvfb=app.config['PDF_RENDERER_XVFB'],
+        wkhtmltopdf=os.environ.get('WKHTMLTOPDF_PATH')
+    )
+    app.extensions['pdf_renderer'] = pool
+    atexit.register(pool.stop)
+
+def prewarm_pdf_renderer(app):
+    """Start the slots of this process now, unless PDF_RENDERER_PREWARM is off"""
+    if not app.config.get('PDF_RENDERER_PREWARM'):
+        return
+    try:
+        app.extensions['pdf_renderer'].start()
+    except PdfRendererUnavailable as e:
+        # Servers without wkhtmltopdf keep the HTML print pages
+        logger.info('PDF renderer not started: %s', e)
+
+def render_pdf(html):
+    """Render HTML to PDF bytes with the pool of the current app"""
+    return current_app.extensions['pdf_renderer'].render(html)
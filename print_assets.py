@@ -0,0 +1,308 @@
+"""
+Local assets of the print templates.
+
+Logos are stored in the instance folder under the SHA-256 of their content,
+so a logo never changes behind its name: the browser caches it for good
+(immutable), and PDFs embed it as a data URI, so printing needs no network.
+A logo given by URL is downloaded once when the template is saved, only
+from a public http or https address. With Pillow installed, logos are shrunk
+to the size they are printed at; without it they are stored as uploaded.
+
+Template CSS is minified when the template is saved.
+
+Each scout group (see tenants.py) stores its logos in a subfolder named
+after it, so deleting the logos its templates no longer use keeps the other
+groups' logos.
+
+Configuration:
+    PRINT_ASSETS_FOLDER: Folder of the stored logos (default: print_assets in
+        the instance folder, with a subfolder per group)
+    PRINT_LOGO_MAX_BYTES: Largest logo accepted, in bytes (default 2 MB)
+    PRINT_LOGO_MAX_WIDTH, PRINT_LOGO_MAX_HEIGHT: Box logos are shrunk to, in
+        pixels (default 800x200, twice the printed size)
+    PRINT_LOGO_FETCH_TIMEOUT: Seconds to download a logo URL (default 10)
+"""
+import base64
+import hashlib
+import http.client
+import io
+import ipaddress
+import logging
+import os
+import re
+import socket
+import urllib.parse
+import urllib.request
+from functools import lru_cache
+
+from flask import current_app, url_for
+
+from routing import current_tenant
+
+logger = logging.getLogger(__name__)
+
+# Magic bytes of the accepted formats, with their extension and MIME type
+LOGO_FORMATS = [
+    (b'\x89PNG\r\n\x1a\n', 'png', 'image/png'),
+    (b'\xff\xd8\xff', 'jpg', 'image/jpeg'),
+    (b'GIF87a', 'gif', 'image/gif'),
+    (b'GIF89a', 'gif', 'image/gif'),
+]
+MIME_TYPES = {extension: mime_type for _, extension, mime_type in LOGO_FORMATS}
+MIME_TYPES['webp'] = 'image/webp'
+
+LOGO_FILENAME = re.compile(r'^[0-9a-f]{64}\.(png|jpg|gif|webp)$')
+
+class PrintAssetError(ValueError):
+    """Raised when a logo cannot be stored; the message is shown to the user"""
+
+def logo_folder():
+    """Return the folder of the logos of the current group"""
+    folder = current_app.config['PRINT_ASSETS_FOLDER']
+    tenant = current_tenant()
+    return os.path.join(folder, tenant) if tenant else folder
+
+def _logo_format(data):
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    for magic, extension, _ in LOGO_FORMATS:
+        if data.startswith(magic):
+            return extension
+    return None
+
+def _shrink(data, extension):
+    """Shrink a logo to PRINT_LOGO_MAX_WIDTH x PRINT_LOGO_MAX_HEIGHT with Pillow, if installed"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return data, extension
+
+    box = (current_app.config['PRINT_LOGO_MAX_WIDTH'], current_app.config['PRINT_LOGO_MAX_HEIGHT'])
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if getattr(image, 'is_animated', False) or (image.width <= box[0] and image.height <= box[1]):
+                return data, extension
+            image.thumbnail(box)
+            output = io.BytesIO()
+            if extension == 'jpg':
+                image.convert('RGB').save(output, 'JPEG', quality=90, optimize=True)
+            else:
+                image.save(output, 'PNG', optimize=True)
+                extension = 'png'
+    except Exception as e:
+        raise PrintAssetError(f'L\'image du logo est illisible : {e}')
+    return output.getvalue(), extension
+
+def store_logo(data):
+    """
+    Store a logo under the hash of its content
+
+    Args:
+        data (bytes): PNG, JPEG, GIF or WebP image
+
+    Returns:
+        str: File name of the stored logo
+
+    Raises:
+        PrintAssetError: The file is too large or not a supported image
+    """
+    if len(data) > current_app.config['PRINT_LOGO_MAX_BYTES']:
+        raise PrintAssetError('Le logo est trop volumineux.')
+    extension = _logo_format(data)
+    if extension is None:
+        raise PrintAssetError('Le logo doit être une image PNG, JPEG, GIF ou WebP.')
+
+    data, extension = _shrink(data, extension)
+    filename = f'{hashlib.sha256(data).hexdigest()}.{extension}'
+    folder = logo_folder()
+    path = os.path.join(folder, filename)
+    if not os.path.exists(path):
+        os.makedirs(folder, exist_ok=True)
+        # Write then rename, so a concurrent print never reads a partial file
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+    return filename
+
+def _is_public_address(address):
+    """Whether the server may download from an IP address: not loopback, private, link-local or reserved"""
+    return ipaddress.ip_address(address).is_global
+
+def _connect_public(address, timeout, source_address=None):
+    """
+    socket.create_connection, only to public addresses
+
+    The address checked is the address connected to, so a host name that
+    resolves to another address on the second lookup cannot reach the
+    internal network.
+    """
+    host, port = address
+    try:
+        addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise PrintAssetError(f'Impossible de télécharger le logo : {e}')
+    if not addresses or not all(_is_public_address(sockaddr[0]) for *_, sockaddr in addresses):
+        raise PrintAssetError('Le logo doit être téléchargé depuis une adresse publique.')
+    sockaddr = addresses[0][4]
+    return socket.create_connection(sockaddr[:2], timeout, source_address)
+
+class _PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+class _PublicHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req, context=self._context)
+
+class _LogoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if urllib.parse.urlsplit(newurl).scheme not in ('http', 'https'):
+            raise PrintAssetError('L\'URL du logo redirige vers une adresse qui n\'est pas http:// ou https://.')
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+def _logo_opener():
+    """Opener for http and https only, without proxies, connecting to public addresses only"""
+    opener = urllib.request.OpenerDirector()
+    for handler in (
+        urllib.request.UnknownHandler(),
+        _PublicHTTPHandler(),
+        _PublicHTTPSHandler(),
+        urllib.request.HTTPDefaultErrorHandler(),
+        _LogoRedirectHandler(),
+        urllib.request.HTTPErrorProcessor(),
+    ):
+        opener.add_handler(handler)
+    return opener
+
+def fetch_logo(url):
+    """
+    Download a logo URL once and store it locally
+
+    Only http and https URLs of public addresses are downloaded, redirects
+    included, and at most PRINT_LOGO_MAX_BYTES are read: the URL is typed by
+    an admin but fetched by the server, from inside its network.
+
+    Raises:
+        PrintAssetError: The URL is not allowed, cannot be downloaded or is not a supported image
+    """
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise PrintAssetError('L\'URL du logo doit commencer par http:// ou https://.')
+
+    max_bytes = current_app.config['PRINT_LOGO_MAX_BYTES']
+    request = urllib.request.Request(url, headers={'User-Agent': 'ScoutsDataManager'})
+    try:
+        with _logo_opener().open(request, timeout=current_app.config['PRINT_LOGO_FETCH_TIMEOUT']) as response:
+            length = response.headers.get('Content-Length')
+            if length and length.isdigit() and int(length) > max_bytes:
+                raise PrintAssetError('Le logo est trop volumineux.')
+            data = response.read(max_bytes + 1)
+    except PrintAssetError:
+        raise
+    except (OSError, ValueError, http.client.HTTPException) as e:
+        raise PrintAssetError(f'Impossible de télécharger le logo : {e}')
+    return store_logo(data)
+
+def purge_unused_logos(used):
+    """Delete the stored logos that no template refers to"""
+    folder = logo_folder()
+    if not os.path.isdir(folder):
+        return
+    for filename in os.listdir(folder):
+        if LOGO_FILENAME.match(filename) and filename not in used:
+            try:
+                os.remove(os.path.join(folder, filename))
+            except OSError as e:
+                logger.warning('Could not delete unused logo %s: %s', filename, e)
+
+@lru_cache(maxsize=16)
+def _logo_data_uri(path):
+    # Stored logos never change, so the path is enough as cache key
+    with open(path, 'rb') as f:
+        data = f.read()
+    mime_type = MIME_TYPES[path.rsplit('.', 1)[1]]
+    return f'data:{mime_type};base64,{base64.b64encode(data).decode("ascii")}'
+
+def print_logo_src(template, inline=False):
+    """
+    Return the src of a template's logo, None if it has none
+
+    Args:
+        template (PrintTemplate): Print template
+        inline (bool): Embed the logo as a data URI, for PDFs
+
+    Templates saved before logos were stored locally keep their remote URL
+    until they are saved again.
+    """
+    if template is None:
+        return None
+    if template.logo_file:
+        if inline:
+            try:
+                return _logo_data_uri(os.path.join(logo_folder(), template.logo_file))
+            except OSError as e:
+                logger.warning('Stored logo %s is missing: %s', template.logo_file, e)
+                return None
+        return url_for('print_asset', filename=template.logo_file)
+    return template.logo_url or None
+
+_CSS_TOKENS = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/', re.S)
+
+def _squeeze_css(chunk):
+    chunk = re.sub(r'\s+', ' ', chunk)
+    chunk = re.sub(r' ?([{};,>]) ?', r'\1', chunk)
+    # Only the space after ":" goes: "a :hover" and "a:hover" are different selectors
+    chunk = chunk.replace(': ', ':')
+    return chunk.replace(';}', '}')
+
+def minify_css(css):
+    """Remove the comments and the whitespace of a style sheet, leaving strings untouched"""
+    if not css:
+        return css
+    parts = []
+    pending = ''
+    position = 0
+    for match in _CSS_TOKENS.finditer(css):
+        pending += css[position:match.start()]
+        if match.group(1):
+            parts.append(_squeeze_css(pending))
+            parts.append(match.group(1))
+            pending = ''
+        else:
+            # A comment separates tokens like a space
+            pending += ' '
+        position = match.end()
+    parts.append(_squeeze_css(pending + css[position:]))
+    return ''.join(parts).strip()
+
+def print_css(template):
+    """Return the minified CSS of a print template"""
+    if template is None:
+        return ''
+    if template.css_minified is None and template.css:
+        return minify_css(template.css)
+    return template.css_minified or ''
+
+def init_print_assets(app):
+    """Read the print asset settings and expose the helpers to the print templates"""
+    app.config.setdefault('PRINT_ASSETS_FOLDER', os.environ.get(
+        'PRINT_ASSETS_FOLDER', os.path.join(app.instance_path, 'print_assets')
+    ))
+    app.config.setdefault('PRINT_LOGO_MAX_BYTES', int(os.environ.get('PRINT_LOGO_MAX_BYTES', 2 * 1024 * 1024)))
+    app.config.setdefault('PRINT_LOGO_MAX_WIDTH', int(os.environ.get('PRINT_LOGO_MAX_WIDTH', 800)))
+    app.config.setdefault('PRINT_LOGO_MAX_HEIGHT', int(os.environ.get('PRINT_LOGO_MAX_HEIGHT', 200)))
+    app.config.setdefault('PRINT_LOGO_FETCH_TIMEOUT', float(os.environ.get('PRINT_LOGO_FETCH_TIMEOUT', 10)))
+
+    app.jinja_env.globals['print_logo_src'] = print_logo_src
+    app.jinja_env.globals['print_css'] = print_css
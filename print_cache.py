@@ -0,0 +1,102 @@
+"""
+Cached default print template and generic texts.
+
+Every print page and the print APIs need them, and they only change when an
+admin saves them. Lookups are served from the shared cache, as plain copies of the rows, so
+they also stay usable while a page is streamed after the session was closed.
+The template is kept in the "print_settings" namespace and the texts in
+"generic_texts": saving the template or a text invalidates its namespace in
+every worker process, and leaves the other one cached.
+
+The default rows are created by bootstrap (initialize_default_print_settings):
+looking them up never writes.
+
+Configuration:
+    PRINT_CACHE_TTL: Seconds the copies are cached (default 3600)
+"""
+import hashlib
+import os
+from collections import namedtuple
+
+from flask import current_app
+
+from cache import cache
+from models import GenericText, PrintTemplate
+
+CachedPrintTemplate = namedtuple('CachedPrintTemplate', [
+    'id', 'name', 'header_html', 'footer_html', 'css', 'css_minified', 'logo_url', 'logo_file'
+])
+CachedGenericText = namedtuple('CachedGenericText', ['id', 'name', 'content', 'etag'])
+
+# Used when bootstrap has not been run on this database
+FALLBACK_PRINT_TEMPLATE = CachedPrintTemplate(
+    id=None,
+    name='Default',
+    header_html='<h1>Gestion des Scouts</h1>',
+    footer_html='<p>Document généré le {{date}}</p>',
+    css=None,
+    css_minified=None,
+    logo_url=None,
+    logo_file=None
+)
+
+CACHE_NAMESPACE = 'print_settings'
+GENERIC_TEXTS_NAMESPACE = 'generic_texts'
+
+def _cached(key, load, namespace=CACHE_NAMESPACE):
+    return cache.get_or_set(namespace, key, load, ttl=current_app.config['PRINT_CACHE_TTL'])
+
+def _load_default_print_template():
+    template = PrintTemplate.query.filter_by(is_default=True).first()
+    if template is None:
+        return FALLBACK_PRINT_TEMPLATE
+    return CachedPrintTemplate(
+        id=template.id,
+        name=template.name,
+        header_html=template.header_html or '',
+        footer_html=template.footer_html or '',
+        css=template.css,
+        css_minified=template.css_minified,
+        logo_url=template.logo_url,
+        logo_file=template.logo_file
+    )
+
+def get_default_print_template():
+    """Return a copy of the default print template"""
+    return _cached('default_template', _load_default_print_template)
+
+def get_generic_text(name):
+    """
+    Return a copy of a generic text
+
+    Args:
+        name (str): Name of the text
+
+    Returns:
+        CachedGenericText: The text and the ETag of its content, None if it does not exist
+    """
+    def load():
+        text = GenericText.query.filter_by(name=name).first()
+        if text is None:
+            return None
+        etag = hashlib.sha256(text.content.encode('utf-8')).hexdigest()[:32]
+        return CachedGenericText(id=text.id, name=text.name, content=text.content, etag=etag)
+
+    return _cached(name, load, namespace=GENERIC_TEXTS_NAMESPACE)
+
+def forget_print_template():
+    """Drop the default print template from the cache, after it was saved"""
+    cache.invalidate(CACHE_NAMESPACE)
+
+def forget_generic_texts():
+    """
+    Drop the generic texts from the cache, after one was saved
+
+    The whole namespace goes: dropping a single entry would leave the copies
+    in the local tier of the other worker processes.
+    """
+    cache.invalidate(GENERIC_TEXTS_NAMESPACE)
+
+def init_print_cache(app):
+    """Read the print cache settings"""
+    app.config.setdefault('PRINT_CACHE_TTL', float(os.environ.get('PRINT_CACHE_TTL', 3600)))
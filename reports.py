@@ -0,0 +1,251 @@
+"""
+Rendering of ReportTemplate objects against table data.
+
+Report templates are compiled once in a sandboxed Jinja environment and kept
+until the template is modified. The declared fields are fetched in a single
+query, read in batches while the report is streamed, and scheduled reports
+are rendered ahead of time, by `flask precompute-reports --loop`, so that
+recurring reports open without touching the record tables.
+"""
+import logging
+import time
+from datetime import datetime
+
+import click
+from jinja2.sandbox import SandboxedEnvironment
+from sqlalchemy import and_, distinct, func, or_
+
+from app import app, db
+from cache import cache
+from models import Record, RecordValue, Table, TableField, ScheduledReport
+from helpers import get_change_cursor, get_permitted_records_query
+from routing import current_tenant, use_tenant
+
+logger = logging.getLogger(__name__)
+
+REPORT_FREQUENCIES = {
+    'daily': 'Quotidien',
+    'weekly': 'Hebdomadaire',
+    'monthly': 'Mensuel'
+}
+
+# Report templates are written by admins, so they run without access to the app internals
+report_environment = SandboxedEnvironment(autoescape=True)
+
+def compile_report(report):
+    """
+    Return the compiled template of a report, compiling it only when it changed
+
+    Compiled templates cannot be pickled, so they stay in the local tier of the cache.
+
+    Raises:
+        jinja2.TemplateSyntaxError: If the template HTML is invalid
+    """
+    return cache.get_or_set(
+        'report_templates',
+        (report.id, report.modified_at),
+        lambda: report_environment.from_string(report.template_html),
+        shared=False
+    )
+
+def forget_report(report_id):
+    """Drop the compiled templates of the reports after one was edited or deleted"""
+    cache.invalidate('report_templates')
+
+# Rows fetched at a time while a report is rendered
+REPORT_BATCH_SIZE = 500
+
+class ReportRecords:
+    """
+    Records of a report, loaded while the template loops over them
+
+    The rows are fetched REPORT_BATCH_SIZE at a time and each record is
+    handed to the template as soon as its values are read, so a report over
+    a large table is streamed without holding its records in memory. Every
+    loop over the records runs the query again; `|length` counts them.
+    """
+
+    def __init__(self, query, fields_by_id):
+        self._query = query
+        self._fields_by_id = fields_by_id
+
+    def __iter__(self):
+        current = None
+        rows = self._query.yield_per(REPORT_BATCH_SIZE)
+        for record_id, table_id, created_at, field_id, text_value, number_value, date_value in rows:
+            if current is None or current['id'] != record_id:
+                if current is not None:
+                    yield current
+                current = {'id': record_id, 'created_at': created_at.strftime('%Y-%m-%d %H:%M')}
+            if field_id is None:
+                continue
+            field = self._fields_by_id[field_id]
+            current[field.name] = RecordValue.format_value(field.field_type, text_value, number_value, date_value)
+        if current is not None:
+            yield current
+
+    def __len__(self):
+        return self._query.with_entities(func.count(distinct(Record.id))).order_by(None).scalar()
+
+def load_report_data(report, user=None):
+    """
+    Build the template context of a report, with its records loaded as they are rendered
+
+    The values of the declared fields are read with a single query,
+    ordered so that the values of a record are consecutive (see ReportRecords).
+    Every record of the report's tables is included, with or without values.
+
+    Args:
+        report (ReportTemplate): Report to load data for
+        user (User, optional): User whose permissions scope the records.
+            When omitted, all records are loaded (used for scheduled reports).
+
+    Returns:
+        dict: Template context with `tables`, `fields` and `records`
+    """
+    field_ids = [int(field_id) for field_id in report.get_fields()]
+    fields = TableField.query.filter(TableField.id.in_(field_ids)).order_by(TableField.order).all() if field_ids else []
+    fields_by_id = {field.id: field for field in fields}
+    tables = Table.query.filter(Table.id.in_({field.table_id for field in fields})).all() if fields else []
+
+    query = db.session.query(
+        Record.id,
+        Record.table_id,
+        Record.created_at,
+        RecordValue.field_id,
+        RecordValue.text_value,
+        RecordValue.number_value,
+        RecordValue.date_value
+    ).outerjoin(
+        # In the join condition: records without a value for these fields are kept
+        RecordValue, and_(RecordValue.record_id == Record.id, RecordValue.field_id.in_(fields_by_id))
+    ).filter(
+        Record.table_id.in_([table.id for table in tables])
+    ).order_by(
+        Record.table_id, Record.created_at, Record.id
+    )
+
+    if user is not None and not user.is_editor() and tables:
+        scopes = [
+            Record.id.in_(get_permitted_records_query(table.id, user, query=db.session.query(Record.id)))
+            for table in tables
+        ]
+        query = query.filter(or_(*scopes))
+
+    return {
+        'tables': {
+            table.name: {
+                'table': table,
+                'fields': [field for field in fields if field.table_id == table.id],
+                'records': ReportRecords(query.filter(Record.table_id == table.id), fields_by_id)
+            }
+            for table in tables
+        },
+        'fields': fields,
+        'records': ReportRecords(query, fields_by_id)
+    }
+
+def generate_report(report, user=None):
+    """Yield the rendered HTML of a report chunk by chunk"""
+    template = compile_report(report)
+    context = load_report_data(report, user)
+    context.update(
+        report={'name': report.name, 'description': report.description},
+        date=datetime.now().strftime('%d/%m/%Y')
+    )
+    return template.generate(context)
+
+def current_period(frequency, now=None):
+    """Return the label of the period a scheduled report covers"""
+    now = now or datetime.now()
+    if frequency == 'daily':
+        return now.strftime('%Y-%m-%d')
+    if frequency == 'weekly':
+        year, week, _ = now.isocalendar()
+        return f'{year}-W{week:02d}'
+    return now.strftime('%Y-%m')
+
+def report_change_cursor(report):
+    """Return the latest change feed entry of the tables a report reads (0 when there is none)"""
+    field_ids = [int(field_id) for field_id in report.get_fields()]
+    if not field_ids:
+        return 0
+    table_ids = db.session.query(distinct(TableField.table_id)).filter(TableField.id.in_(field_ids)).all()
+    return max((get_change_cursor(table_id) for table_id, in table_ids), default=0)
+
+def get_fresh_snapshot(report):
+    """Return the precomputed content of a report if its period, template and records did not change"""
+    schedule = report.schedule
+    if not schedule or schedule.content is None:
+        return None
+    if schedule.period != current_period(schedule.frequency):
+        return None
+    if report.modified_at and schedule.generated_at < report.modified_at:
+        return None
+    if schedule.change_cursor is None or schedule.change_cursor != report_change_cursor(report):
+        return None
+    return schedule
+
+def precompute_reports():
+    """Render the scheduled reports whose stored content is missing or outdated"""
+    rendered = 0
+    for schedule in ScheduledReport.query.all():
+        if get_fresh_snapshot(schedule.report):
+            continue
+
+        # Read first: changes committed while the report renders make it stale again
+        change_cursor = report_change_cursor(schedule.report)
+        try:
+            content = ''.join(generate_report(schedule.report))
+        except Exception as e:
+            logger.error('Error rendering report %s: %s', schedule.report_id, e)
+            continue
+
+        schedule.content = content
+        schedule.period = current_period(schedule.frequency)
+        schedule.generated_at = datetime.utcnow()
+        schedule.change_cursor = change_cursor
+        db.session.commit()
+        rendered += 1
+
+    return rendered
+
+def precompute_all_reports():
+    """
+    Render the due reports of the current database, or of every database without a group
+
+    Returns:
+        int: Reports rendered
+    """
+    # Each scout group has its own reports, see tenants.py
+    tenants = [current_tenant()] if current_tenant() is not None else [None] + app.extensions['tenants'].tenants
+    rendered = 0
+    for tenant in tenants:
+        try:
+            with app.app_context():
+                use_tenant(tenant)
+                rendered += precompute_reports()
+        except Exception as e:
+            logger.error('Report scheduler error in %s: %s', tenant or 'the default database', e)
+    return rendered
+
+def run_report_scheduler(interval):
+    """Precompute the scheduled reports every `interval` seconds, until interrupted"""
+    logger.info('Report scheduler started, every %s s', interval)
+    while True:
+        started = time.monotonic()
+        precompute_all_reports()
+        time.sleep(max(0, interval - (time.monotonic() - started)))
+
+@app.cli.command('precompute-reports')
+@click.option('--loop', is_flag=True, help='Keep running, every REPORT_SCHEDULER_INTERVAL seconds.')
+@click.option('--interval', type=int, help='Seconds between two runs with --loop.')
+def precompute_reports_command(loop, interval):
+    """Render the scheduled reports that are due."""
+    if loop:
+        interval = interval or app.config['REPORT_SCHEDULER_INTERVAL']
+        if interval <= 0:
+            raise click.UsageError('--loop demande un intervalle positif (--interval ou REPORT_SCHEDULER_INTERVAL).')
+        run_report_scheduler(interval)
+    count = precompute_all_reports()
+    print(f'{count} rapport(s) généré(s).')
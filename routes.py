@@ -1,13 +1,30 @@
-from flask import render_template, redirect, url_for, flash, request, jsonify, abort, send_file
+from flask import render_template, redirect, url_for, flash, request, jsonify, abort, send_file, send_from_directory, stream_template, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import app, db
-from models import User, Table, TableField, Record, RecordValue, PrintTemplate, GenericText, TablePermission, ROLE_READONLY, ROLE_EDITOR, ROLE_ADMIN
+from models import User, Table, TableField, Record, RecordValue, RecordChange, PrintTemplate, GenericText, TablePermission, ReportTemplate, ScheduledReport, ROLE_READONLY, ROLE_EDITOR, ROLE_ADMIN
 from forms import LoginForm, RegisterForm, UserManagementForm, TableForm, TableFieldForm, ChangePasswordForm
-from helpers import admin_required, editor_required, create_dynamic_form, save_record
+from helpers import admin_required, editor_required, tenants_required, create_dynamic_form, get_permitted_records_query, iter_record_rows, get_record_page, buffer_chunks, get_record_snapshot, log_record_change, get_change_cursor, filter_changes_for_user, claim_record_version, create_record, create_records, RecordValidationError, set_record_value, sync_unique_keys, rebuild_unique_keys, DEFAULT_GENERIC_TEXTS
+from aggregation import aggregate_table, table_analytics, AggregationError
+from reports import REPORT_FREQUENCIES, report_environment, forget_report, generate_report, get_fresh_snapshot
+from jinja2 import TemplateSyntaxError
+from instrumentation import get_endpoint_stats, get_pool_stats
+from routing import use_read_replica, use_tenant
+from group_commit import commit_write
+from idempotency import IDEMPOTENCY_FIELD, IdempotencyKeyError, get_idempotency_key, request_fingerprint, run_idempotent
+from engine_profiles import describe_engine_profile
+from pdf_renderer import PdfRendererBusy, PdfRendererUnavailable, render_pdf
+from identity import remember_identity, forget_identity, touch_identity_epoch
+from cache import cache
+from archive import archived_records_query
+from print_cache import get_default_print_template, get_generic_text, forget_print_template, forget_generic_texts
+from print_assets import LOGO_FILENAME, PrintAssetError, store_logo, fetch_logo, purge_unused_logos, minify_css, print_logo_src, print_css, logo_folder
+from tenants import tenant_choices, tenant_names, remember_tenant, forget_tenant, map_tenants
 import json
+import uuid
 from datetime import datetime, date, timedelta
 from sqlalchemy import func, cast, Date
+from sqlalchemy.orm import selectinload
 
 # Updating record access logic to handle all_access permissions
 @app.route('/')
@@ -21,13 +38,19 @@ def login():
         return redirect(url_for('dashboard'))
 
     form = LoginForm()
+    form.group.choices = tenant_choices()
     if form.validate_on_submit():
+        # Users are looked up in the database of the group they chose
+        tenant = form.group.data or None
+        use_tenant(tenant)
         user = User.query.filter_by(username=form.username.data).first()
         if user is None or not user.check_password(form.password.data):
             flash('Nom d\'utilisateur ou mot de passe incorrect.', 'danger')
             return redirect(url_for('login'))
 
         login_user(user)
+        remember_tenant(tenant)
+        remember_identity(user)
         next_page = request.args.get('next')
         if not next_page or next_page.startswith('/'):
             next_page = url_for('dashboard')
@@ -62,6 +85,8 @@ def register():
 @login_required
 def logout():
     logout_user()
+    forget_identity()
+    forget_tenant()
     flash('Vous avez été déconnecté.', 'info')
     return redirect(url_for('login'))
 
@@ -76,50 +101,117 @@ def settings():
 def change_password():
     form = ChangePasswordForm()
     if form.validate_on_submit():
-        if current_user.check_password(form.current_password.data):
-            current_user.set_password(form.new_password.data)
+        user = current_user.load()
+        if user.check_password(form.current_password.data):
+            user.set_password(form.new_password.data)
+            # Log out the user's other sessions; this one gets the new version
+            user.session_version += 1
             db.session.commit()
+            touch_identity_epoch()
+            remember_identity(user)
             flash('Votre mot de passe a été mis à jour.', 'success')
             return redirect(url_for('settings'))
         else:
             flash('Mot de passe actuel incorrect.', 'danger')
     return redirect(url_for('settings'))
 
-@app.route('/dashboard')
-@login_required
-def dashboard():
+def dashboard_record_stats():
+    """
+    Count the records per table, day and weekday for the dashboard
+
+    The counts cover all records, so every user shares them. They are cached
+    until a record changes (the change feed moves), a table is added,
+    renamed or deleted, or the day changes.
+    """
+    data_version = db.session.query(
+        db.session.query(func.max(RecordChange.id)).scalar_subquery(),
+        db.session.query(func.count(Table.id)).scalar_subquery(),
+        db.session.query(func.max(Table.modified_at)).scalar_subquery()
+    ).one()
+    today = datetime.now().date()
+    return cache.get_or_set(
+        'dashboard', (tuple(data_version), today.isoformat()), lambda: _count_dashboard_records(today), ttl=3600
+    )
+
+def _count_dashboard_records(today):
     # Get counts for each table
-    tables = Table.query.all()
+    counts = dict(db.session.query(Record.table_id, func.count(Record.id)).group_by(Record.table_id).all())
     table_stats = []
-
-    for table in tables:
-        record_count = Record.query.filter_by(table_id=table.id).count()
+    for table in Table.query.all():
         table_stats.append({
             'name': table.display_name,
-            'count': record_count
+            'count': counts.get(table.id, 0)
         })
 
-    # Get records trend data (last 7 days)
+    record_count = Record.query.count()
+
+    # Get today and this week's record count
+    record_today_count = Record.query.filter(func.date(Record.created_at) == today).count()
+
+    # Calculate first day of the current week (Monday)
+    today_weekday = today.weekday()  # Monday=0, Sunday=6
+    first_day_of_week = today - timedelta(days=today_weekday)
+    record_week_count = Record.query.filter(
+        func.date(Record.created_at) >= first_day_of_week
+    ).count()
+
+    # Generate data for record trends (last 14 days)
     records_trend_data = []
-    for i in range(7):
-        date = datetime.now().date() - timedelta(days=i)
-        count = Record.query.filter(func.date(Record.created_at) == date).count()
+
+    for i in range(13, -1, -1):
+        date_to_check = today - timedelta(days=i)
+        count = Record.query.filter(func.date(Record.created_at) == date_to_check).count()
         records_trend_data.append({
-            'date': date.strftime('%Y-%m-%d'),
+            'date': date_to_check.strftime('%Y-%m-%d'),
             'count': count
         })
-    records_trend_data.reverse()
-
-    # Get activity by day of week
-    activity_by_day = []
-    days = ['Lundi', 'Mardi', 'Mercredi', 'Jeudi', 'Vendredi', 'Samedi', 'Dimanche']
-    for day_num, day in enumerate(days):
-        count = Record.query.filter(func.extract('dow', Record.created_at) == (day_num + 1) % 7).count()
-        activity_by_day.append({
-            'day': day,
+
+    # Calculate activity by day of week
+    weekday_mapping = {
+        0: 'Lundi',
+        1: 'Mardi',
+        2: 'Mercredi',
+        3: 'Jeudi',
+        4: 'Vendredi',
+        5: 'Samedi',
+        6: 'Dimanche'
+    }
+
+    activity_by_day = db.session.query(
+        func.extract('dow', Record.created_at).label('weekday'), 
+        func.count().label('count')
+    ).group_by('weekday').all()
+
+    activity_data = []
+    for weekday, count in activity_by_day:
+        # SQLite returns 0-6 where 0 is Sunday, PostgreSQL returns 0-6 where 0 is Sunday
+        # Adjusting to ensure 0=Sunday regardless of database
+        day_num = int(weekday)
+        if day_num == 0:  # Sunday in PostgreSQL
+            day_name = 'Dimanche'
+        else:
+            day_name = weekday_mapping.get(day_num - 1, f'Jour {day_num}')
+
+        activity_data.append({
+            'day': day_name,
             'count': count
         })
 
+    return {
+        'table_stats': table_stats,
+        'record_count': record_count,
+        'record_today_count': record_today_count,
+        'record_week_count': record_week_count,
+        'records_trend_data': records_trend_data,
+        'activity_data': activity_data
+    }
+
+@app.route('/dashboard')
+@login_required
+@use_read_replica
+def dashboard():
+    stats = dashboard_record_stats()
+
     # Get recent records with permission check
     if current_user.is_editor():
         recent_records = db.session.query(
@@ -169,267 +261,231 @@ def dashboard():
     editor_count = User.query.filter_by(role=ROLE_EDITOR).count()
     readonly_count = User.query.filter_by(role=ROLE_READONLY).count()
 
-    record_count = Record.query.count()
-
-    # Get today and this week's record count
-    today = datetime.now().date()
-    record_today_count = Record.query.filter(func.date(Record.created_at) == today).count()
-
-    # Calculate first day of the current week (Monday)
-    today_weekday = today.weekday()  # Monday=0, Sunday=6
-    first_day_of_week = today - timedelta(days=today_weekday)
-    record_week_count = Record.query.filter(
-        func.date(Record.created_at) >= first_day_of_week
-    ).count()
-
-    # Generate data for record trends (last 14 days)
-    records_trend_data = []
-
-    for i in range(13, -1, -1):
-        date_to_check = today - timedelta(days=i)
-        count = Record.query.filter(func.date(Record.created_at) == date_to_check).count()
-        records_trend_data.append({
-            'date': date_to_check.strftime('%Y-%m-%d'),
-            'count': count
-        })
-
-    # Calculate activity by day of week
-    weekday_mapping = {
-        0: 'Lundi',
-        1: 'Mardi',
-        2: 'Mercredi',
-        3: 'Jeudi',
-        4: 'Vendredi',
-        5: 'Samedi',
-        6: 'Dimanche'
-    }
-
-    activity_by_day = db.session.query(
-        func.extract('dow', Record.created_at).label('weekday'), 
-        func.count().label('count')
-    ).group_by('weekday').all()
-
-    activity_data = []
-    for weekday, count in activity_by_day:
-        # SQLite returns 0-6 where 0 is Sunday, PostgreSQL returns 0-6 where 0 is Sunday
-        # Adjusting to ensure 0=Sunday regardless of database
-        day_num = int(weekday)
-        if day_num == 0:  # Sunday in PostgreSQL
-            day_name = 'Dimanche'
-        else:
-            day_name = weekday_mapping.get(day_num - 1, f'Jour {day_num}')
-
-        activity_data.append({
-            'day': day_name,
-            'count': count
-        })
-
     return render_template(
         'dashboard.html', 
         title='Tableau de bord',
-        table_stats=table_stats,
+        table_stats=stats['table_stats'],
         recent_records=record_list,
         user_count=user_count,
         admin_count=admin_count,
         editor_count=editor_count,
         readonly_count=readonly_count,
-        record_count=record_count,
-        record_today_count=record_today_count,
-        record_week_count=record_week_count,
-        records_trend_data=json.dumps(records_trend_data),
-        activity_by_day=json.dumps(activity_data)
+        record_count=stats['record_count'],
+        record_today_count=stats['record_today_count'],
+        record_week_count=stats['record_week_count'],
+        records_trend_data=json.dumps(stats['records_trend_data']),
+        activity_by_day=json.dumps(stats['activity_data'])
     )
 
 @app.route('/tables')
 @login_required
+@use_read_replica
 def tables():
     tables = Table.query.all()
     return render_template('view_table.html', title='Consulter les données', tables=tables)
 
+def wants_pdf():
+    """Print pages are rendered as PDF by the server with ?format=pdf, and printed by the browser otherwise"""
+    return request.args.get('format') == 'pdf'
+
+def pdf_response(html, filename):
+    """Render a print page to PDF on the renderer pool"""
+    try:
+        pdf = render_pdf(html)
+    except (PdfRendererUnavailable, PdfRendererBusy) as e:
+        abort(503, description=str(e))
+
+    response = app.response_class(pdf, mimetype='application/pdf')
+    response.headers['Content-Disposition'] = f'inline; filename="{filename}"'
+    return response
+
 @app.route('/tables/<int:table_id>/records/pdf')
 @login_required
+@use_read_replica
 def export_table_pdf(table_id):
+    template = get_default_print_template()
     table = Table.query.get_or_404(table_id)
     fields = TableField.query.filter_by(table_id=table_id).order_by(TableField.order).all()
 
     # Get records with permission check
-    if current_user.is_editor():
-        records = Record.query.filter_by(table_id=table_id).all()
-    else:
-        # Get user's permissions for this table
-        permissions = TablePermission.query.filter_by(
-            user_id=current_user.id,
-            table_id=table_id
-        ).all()
-
-        if not permissions:
-            records = []
-        else:
-            # Check if user has all access
-            has_all_access = any(p.all_access for p in permissions)
-
-            if has_all_access:
-                records = Record.query.filter_by(table_id=table_id).all()
-            else:
-                # Build query for records matching any permission
-                from sqlalchemy import or_
-                conditions = []
-                for permission in permissions:
-                    if not permission.all_access and permission.field_id and permission.match_value:
-                        record_values = RecordValue.query.filter_by(
-                            field_id=permission.field_id,
-                            text_value=permission.match_value
-                        ).with_entities(RecordValue.record_id)
-                        conditions.append(Record.id.in_(record_values))
-
-                if conditions:
-                    records = Record.query.filter(
-                        Record.table_id == table_id,
-                        or_(*conditions)
-                    ).all()
-                else:
-                    records = []
-
-    # Get template
-    template = PrintTemplate.query.filter_by(is_default=True).first()
-    if not template:
-        template = PrintTemplate(
-            name="Default",
-            header_html='<h1>{{table.display_name}}</h1>',
-            footer_html='<p>Document généré le {{date}}</p>',
-            is_default=True
+    records_query = get_permitted_records_query(table_id)
+
+    if wants_pdf():
+        # wkhtmltopdf needs the whole document
+        html = render_template(
+            'print_table.html',
+            table=table,
+            fields=fields,
+            records=iter_record_rows(records_query, fields, newest_first=False),
+            template=template,
+            date=datetime.now().strftime('%d/%m/%Y'),
+            pdf=True
         )
-        db.session.add(template)
-        db.session.commit()
-
-    # Get values for all records
-    records_data = []
-    for record in records:
-        values = {}
-        for field in fields:
-            value = RecordValue.query.filter_by(record_id=record.id, field_id=field.id).first()
-            if value:
-                values[field.name] = value.get_value()
-            else:
-                values[field.name] = None
-        records_data.append(values)
+        return pdf_response(html, f'{table.name}.pdf')
 
-    # Generate HTML
-    from datetime import datetime
-    return render_template(
+    # Stream the rows as they are loaded instead of building the whole page in memory
+    return app.response_class(stream_with_context(buffer_chunks(stream_template(
         'print_table.html',
         table=table,
         fields=fields,
-        records=records_data,
+        records=iter_record_rows(records_query, fields, newest_first=False),
         template=template,
         date=datetime.now().strftime('%d/%m/%Y')
-    )
+    ))))
 
 @app.route('/tables/<int:table_id>/records')
 @login_required
+@use_read_replica
 def table_records(table_id):
     table = Table.query.get_or_404(table_id)
 
-    # If user is admin or editor, show all records
-    if current_user.is_editor():
-        records = Record.query.filter_by(table_id=table_id).order_by(Record.created_at.desc()).all()
-    else:
-        # Get user's permissions for this table
-        permissions = TablePermission.query.filter_by(
-            user_id=current_user.id,
-            table_id=table_id
-        ).all()
-
-        if not permissions:
-            records = []
-        else:
-            # Check if user has all access
-            has_all_access = any(p.all_access for p in permissions)
-
-            if has_all_access:
-                records = Record.query.filter_by(table_id=table_id).order_by(Record.created_at.desc()).all()
-            else:
-                # Build query for records matching any permission
-                from sqlalchemy import or_
-                conditions = []
-                for permission in permissions:
-                    if not permission.all_access and permission.field_id and permission.match_value:
-                        record_values = RecordValue.query.filter_by(
-                            field_id=permission.field_id,
-                            text_value=permission.match_value
-                        ).with_entities(RecordValue.record_id)
-                        conditions.append(Record.id.in_(record_values))
-
-                if conditions:
-                    records = Record.query.filter(
-                        Record.table_id == table_id,
-                        or_(*conditions)
-                    ).order_by(Record.created_at.desc()).all()
-                else:
-                    records = []
+    # Editors see all records, read-only users only those matching their permissions
+    records_query = get_permitted_records_query(table_id)
+    has_records = db.session.query(records_query.exists()).scalar()
 
     fields = TableField.query.filter_by(table_id=table_id).order_by(TableField.order).all()
 
-    records_data = []
-    for record in records:
-        record_data = {'id': record.id, 'created_at': record.created_at.strftime('%Y-%m-%d %H:%M')}
-
-        for field in fields:
-            value = RecordValue.query.filter_by(record_id=record.id, field_id=field.id).first()
-            if value:
-                record_data[field.name] = value.get_value()
-            else:
-                record_data[field.name] = None
-
-        records_data.append(record_data)
+    # Rows are loaded page by page from table_rows; the full listing is kept for browsers without JavaScript
+    if request.args.get('mode') != 'full':
+        return render_template(
+            'view_table.html',
+            title=f'Données - {table.display_name}',
+            table=table,
+            fields=fields,
+            records=None,
+            has_records=has_records,
+            is_records_view=True
+        )
 
-    return render_template(
-        'view_table.html', 
+    return app.response_class(stream_with_context(buffer_chunks(stream_template(
+        'view_table.html',
         title=f'Données - {table.display_name}',
         table=table,
         fields=fields,
-        records=records_data,
+        records=iter_record_rows(records_query, fields),
+        has_records=has_records,
         is_records_view=True
+    ))))
+
+@app.route('/api/tables/<int:table_id>/rows')
+@login_required
+@use_read_replica
+def table_rows(table_id):
+    table = Table.query.get_or_404(table_id)
+    fields = TableField.query.filter_by(table_id=table_id).order_by(TableField.order).all()
+
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 500)
+    filters = {
+        key[len('filter_'):]: value
+        for key, value in request.args.items()
+        if key.startswith('filter_')
+    }
+
+    # Read before the rows, so that a client syncing from this cursor cannot miss a change
+    cursor = get_change_cursor(table_id)
+
+    total, rows = get_record_page(
+        get_permitted_records_query(table_id),
+        fields,
+        offset=offset,
+        limit=limit,
+        sort=request.args.get('sort'),
+        descending=request.args.get('direction', 'desc') != 'asc',
+        filters=filters,
+        search=request.args.get('q', '').strip() or None
     )
 
+    return jsonify({
+        'table_id': table.id,
+        'total': total,
+        'offset': offset,
+        'fields': [
+            {'name': field.name, 'display_name': field.display_name, 'field_type': field.field_type}
+            for field in fields
+        ],
+        'rows': rows,
+        'cursor': cursor
+    })
+
+@app.route('/api/tables/<int:table_id>/changes')
+@login_required
+@use_read_replica
+def table_changes(table_id):
+    table = Table.query.get_or_404(table_id)
+
+    since = max(request.args.get('since', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 500, type=int), 1), 1000)
+
+    query = RecordChange.query.filter(RecordChange.table_id == table_id, RecordChange.id > since)
+    settle = app.config['CHANGE_FEED_SETTLE_SECONDS']
+    if settle:
+        query = query.filter(RecordChange.changed_at <= datetime.utcnow() - timedelta(seconds=settle))
+    changes = query.order_by(RecordChange.id).limit(limit).all()
+
+    return jsonify({
+        'table_id': table.id,
+        'since': since,
+        # The cursor advances over changes outside the user's scope too
+        'cursor': changes[-1].id if changes else since,
+        'has_more': len(changes) == limit,
+        'changes': filter_changes_for_user(changes, table_id)
+    })
+
+@app.route('/api/tables/<int:table_id>/aggregate')
+@login_required
+@use_read_replica
+def aggregate_table_records(table_id):
+    table = Table.query.get_or_404(table_id)
+
+    # Accept both repeated parameters and comma separated lists
+    group_by = [spec for value in request.args.getlist('group_by') for spec in value.split(',') if spec]
+    metrics = [spec for value in request.args.getlist('metric') for spec in value.split(',') if spec] or ['count']
+    limit = request.args.get('limit', type=int)
+
+    try:
+        result = aggregate_table(table, group_by=group_by, metrics=metrics, limit=limit)
+    except AggregationError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    return jsonify(result)
+
+@app.route('/api/tables/<int:table_id>/analytics')
+@login_required
+@use_read_replica
+def table_analytics_data(table_id):
+    table = Table.query.get_or_404(table_id)
+    return jsonify(table_analytics(table, current_user))
+
 @app.route('/tables/<int:table_id>/records/<int:record_id>/pdf')
 @login_required
+@use_read_replica
 def print_record(table_id, record_id):
     table = Table.query.get_or_404(table_id)
     record = Record.query.get_or_404(record_id)
     fields = TableField.query.filter_by(table_id=table_id).order_by(TableField.order).all()
 
-    values = {}
-    for field in fields:
-        value = RecordValue.query.filter_by(record_id=record.id, field_id=field.id).first()
-        if value:
-            values[field.name] = value.get_value()
-        else:
-            values[field.name] = None
-
-    template = PrintTemplate.query.filter_by(is_default=True).first()
-    if not template:
-        template = PrintTemplate(
-            name="Default",
-            header_html='<h1>{{table.display_name}}</h1>',
-            footer_html='<p>Document généré le {{date}}</p>',
-            is_default=True
-        )
-        db.session.add(template)
-        db.session.commit()
+    values = get_record_snapshot(record.id, fields)
 
-    return render_template(
+    template = get_default_print_template()
+
+    html = render_template(
         'print_record.html',
         table=table,
         record=record,
         fields=fields,
         values=values,
         template=template,
-        date=datetime.now().strftime('%d/%m/%Y')
+        date=datetime.now().strftime('%d/%m/%Y'),
+        pdf=wants_pdf()
     )
+    if wants_pdf():
+        return pdf_response(html, f'{table.name}_{record.id}.pdf')
+    return html
 
 @app.route('/tables/<int:table_id>/records/<int:record_id>')
 @login_required
+@use_read_replica
 def view_record(table_id, record_id):
     table = Table.query.get_or_404(table_id)
     record = Record.query.get_or_404(record_id)
@@ -439,14 +495,7 @@ def view_record(table_id, record_id):
         return redirect(url_for('table_records', table_id=table_id))
 
     fields = TableField.query.filter_by(table_id=table_id).order_by(TableField.order).all()
-    values = {}
-
-    for field in fields:
-        value = RecordValue.query.filter_by(record_id=record.id, field_id=field.id).first()
-        if value:
-            values[field.name] = value.get_value()
-        else:
-            values[field.name] = None
+    values = get_record_snapshot(record.id, fields)
 
     return render_template(
         'edit_record.html',
@@ -480,38 +529,18 @@ def add_table_record(table_id):
     fields = TableField.query.filter_by(table_id=table_id).order_by(TableField.order).all()
 
     if request.method == 'POST':
-        # First check unique constraints
-        for field in fields:
-            value = request.form.get(f'field_{field.id}')
-            if field.unique and value:
-                # Check if value already exists
-                existing_value = RecordValue.query.join(Record).filter(
-                    Record.table_id == table_id,
-                    RecordValue.field_id == field.id,
-                    RecordValue.text_value == value
-                ).first()
-
-                if existing_value:
-                    flash(f'La valeur "{value}" existe déjà pour le champ "{field.display_name}".', 'danger')
-                    return redirect(url_for('add_table_record', table_id=table_id))
-
-        record = Record(table_id=table_id, created_by=current_user.id)
-        db.session.add(record)
-        db.session.flush()  # Get the record ID
-
-        # Process each field
-        for field in fields:
-            value = request.form.get(f'field_{field.id}')
-
-            if field.required and (value is None or value.strip() == ''):
-                flash(f'Le champ "{field.display_name}" est obligatoire.', 'danger')
-                return redirect(url_for('add_table_record', table_id=table_id))
-
-            record_value = RecordValue(record_id=record.id, field_id=field.id)
-            record_value.set_value(value, field.field_type)
-            db.session.add(record_value)
+        form_data = {key: value for key, value in request.form.items() if key not in (IDEMPOTENCY_FIELD, 'csrf_token')}
+        user_id = current_user.id
+        try:
+            # A double click or a resubmitted form carries the same key and does not add the record twice
+            commit_write(
+                run_idempotent, user_id, get_idempotency_key(), request_fingerprint(form_data),
+                create_record, table_id, fields, form_data, user_id
+            )
+        except (RecordValidationError, IdempotencyKeyError) as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('add_table_record', table_id=table_id))
 
-        db.session.commit()
         flash('Enregistrement ajouté avec succès.', 'success')
         return redirect(url_for('table_records', table_id=table_id))
 
@@ -519,9 +548,76 @@ def add_table_record(table_id):
         'add_record.html',
         title=f'Ajouter un enregistrement - {table.display_name}',
         table=table,
-        fields=fields
+        fields=fields,
+        idempotency_key=uuid.uuid4().hex
     )
 
+def _api_form_data(fields, values):
+    """Map JSON values by field name to the form data expected by create_record"""
+    if not isinstance(values, dict):
+        raise RecordValidationError('Les valeurs doivent être un objet {"nom du champ": valeur}.')
+
+    fields_by_name = {field.name: field for field in fields}
+    unknown = [name for name in values if name not in fields_by_name]
+    if unknown:
+        raise RecordValidationError(f'Champ inconnu: {", ".join(unknown)}')
+
+    return {
+        f'field_{fields_by_name[name].id}': None if value is None else str(value)
+        for name, value in values.items()
+    }
+
+def _api_create(table_id, build_rows, create, status=201):
+    """Create records from the JSON body, once per Idempotency-Key, and return the JSON response"""
+    if not current_user.is_editor():
+        return jsonify({'success': False, 'message': 'Vous n\'avez pas la permission d\'ajouter des enregistrements.'}), 403
+
+    Table.query.get_or_404(table_id)
+    fields = TableField.query.filter_by(table_id=table_id).order_by(TableField.order).all()
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'success': False, 'message': 'Le corps de la requête doit être un objet JSON.'}), 400
+
+    user_id = current_user.id
+    try:
+        rows = build_rows(fields, payload)
+        result, replayed = commit_write(
+            run_idempotent, user_id, get_idempotency_key(), request_fingerprint(payload),
+            create, table_id, fields, rows, user_id
+        )
+    except (RecordValidationError, IdempotencyKeyError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 422
+
+    response = jsonify({'success': True, **result})
+    response.status_code = status
+    if replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+@app.route('/api/tables/<int:table_id>/records', methods=['POST'])
+@login_required
+def api_create_record(table_id):
+    """Create a record from {"values": {"field name": value}}"""
+    def create(table_id, fields, form_data, user_id):
+        return {'id': create_record(table_id, fields, form_data, user_id)}
+
+    return _api_create(table_id, lambda fields, payload: _api_form_data(fields, payload.get('values')), create)
+
+@app.route('/api/tables/<int:table_id>/records/bulk', methods=['POST'])
+@login_required
+def api_create_records(table_id):
+    """Create up to 1000 records from {"records": [{"values": {...}}, ...]}, all or none"""
+    def build_rows(fields, payload):
+        records = payload.get('records')
+        if not isinstance(records, list) or not 1 <= len(records) <= 1000:
+            raise RecordValidationError('"records" doit être une liste de 1 à 1000 enregistrements.')
+        return [_api_form_data(fields, (record or {}).get('values') if isinstance(record, dict) else None) for record in records]
+
+    def create(table_id, fields, rows, user_id):
+        return {'ids': create_records(table_id, fields, rows, user_id)}
+
+    return _api_create(table_id, build_rows, create)
+
 @app.route('/tables/<int:table_id>/records/<int:record_id>/edit', methods=['GET', 'POST'])
 @login_required
 @admin_required  # Changed from editor_required to admin_required
@@ -536,6 +632,18 @@ def edit_record(table_id, record_id):
     fields = TableField.query.filter_by(table_id=table_id).order_by(TableField.order).all()
 
     if request.method == 'POST':
+        # Reject the edit if the record changed since the form was loaded; a form
+        # without the version cannot tell, so it is rejected too
+        expected_version = request.form.get('version', type=int)
+        if expected_version is None or not claim_record_version(record_id, expected_version):
+            db.session.rollback()
+            flash('Cet enregistrement a été modifié par un autre utilisateur pendant votre modification. '
+                  'Vos changements n\'ont pas été enregistrés : vérifiez les nouvelles valeurs puis recommencez.', 'warning')
+            return redirect(url_for('edit_record', table_id=table_id, record_id=record_id))
+
+        previous = get_record_snapshot(record_id, fields)
+        record_values = {value.field_id: value for value in RecordValue.query.filter_by(record_id=record_id)}
+
         # Update record values
         for field in fields:
             value = request.form.get(f'field_{field.id}')
@@ -544,28 +652,36 @@ def edit_record(table_id, record_id):
                 flash(f'Le champ "{field.display_name}" est obligatoire.', 'danger')
                 return redirect(url_for('edit_record', table_id=table_id, record_id=record_id))
 
-            record_value = RecordValue.query.filter_by(record_id=record_id, field_id=field.id).first()
+            record_value = record_values.get(field.id)
 
             if not record_value:
-                record_value = RecordValue(record_id=record_id, field_id=field.id)
+                record_value = record_values[field.id] = RecordValue(record_id=record_id, field_id=field.id)
                 db.session.add(record_value)
 
-            record_value.set_value(value, field.field_type)
+            try:
+                set_record_value(record_value, field, value)
+            except RecordValidationError as e:
+                db.session.rollback()
+                flash(str(e), 'danger')
+                return redirect(url_for('edit_record', table_id=table_id, record_id=record_id))
+
+        try:
+            sync_unique_keys(record_id, fields, record_values)
+        except RecordValidationError as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
+            return redirect(url_for('edit_record', table_id=table_id, record_id=record_id))
 
-        record.modified_at = datetime.utcnow()
+        values = get_record_snapshot(record_id, fields)
+        changed = {name: value for name, value in previous.items() if values[name] != value}
+        log_record_change(table_id, record_id, 'update', values, current_user.id, changed)
         db.session.commit()
 
         flash('Enregistrement mis à jour avec succès.', 'success')
         return redirect(url_for('table_records', table_id=table_id))
 
     # Get current values
-    values = {}
-    for field in fields:
-        value = RecordValue.query.filter_by(record_id=record_id, field_id=field.id).first()
-        if value:
-            values[field.name] = value.get_value()
-        else:
-            values[field.name] = None
+    values = get_record_snapshot(record_id, fields)
 
     return render_template(
         'edit_record.html',
@@ -587,6 +703,9 @@ def delete_record(table_id, record_id):
         flash('Enregistrement non trouvé.', 'danger')
         return redirect(url_for('table_records', table_id=table_id))
 
+    # The last values are kept so that scoped clients can tell whether the delete concerns them
+    fields = TableField.query.filter_by(table_id=table_id).all()
+    log_record_change(table_id, record_id, 'delete', get_record_snapshot(record_id, fields), current_user.id)
     db.session.delete(record)
     db.session.commit()
 
@@ -681,8 +800,11 @@ def edit_user(user_id):
 
             if form.password.data:
                 user.set_password(form.password.data)
+                user.session_version += 1
 
             db.session.commit()
+            # The user's sessions reload the new role, or are logged out after a new password
+            touch_identity_epoch()
             flash('Utilisateur mis à jour avec succès.', 'success')
             return redirect(url_for('manage_users'))
         else:
@@ -715,6 +837,7 @@ def delete_user(user_id):
 
     db.session.delete(user)
     db.session.commit()
+    touch_identity_epoch()
 
     flash('Utilisateur supprimé avec succès.', 'success')
     return redirect(url_for('manage_users'))
@@ -751,7 +874,8 @@ def add_table():
         table = Table(
             name=form.name.data,
             display_name=form.display_name.data,
-            description=form.description.data
+            description=form.description.data,
+            archive_after_days=form.archive_after_days.data
         )
 
         db.session.add(table)
@@ -784,6 +908,7 @@ def edit_table(table_id):
             table.name = form.name.data
             table.display_name = form.display_name.data
             table.description = form.description.data
+            table.archive_after_days = form.archive_after_days.data
 
             db.session.commit()
             flash('Table mise à jour avec succès.', 'success')
@@ -859,6 +984,7 @@ def add_field(table_id):
             display_name=form.display_name.data,
             field_type=form.field_type.data,
             required=form.required.data,
+            unique=form.unique.data,
             order=next_order
         )
 
@@ -899,6 +1025,9 @@ def edit_field(table_id, field_id):
                 flash('Un champ avec ce nom existe déjà dans cette table.', 'danger')
                 return redirect(url_for('edit_field', table_id=table_id, field_id=field_id))
 
+            # The keys of a unique field depend on its type
+            rebuild_keys = field.unique != form.unique.data or (field.unique and field.field_type != form.field_type.data)
+
             field.name = form.name.data
             field.display_name = form.display_name.data
             field.field_type = form.field_type.data
@@ -912,6 +1041,14 @@ def edit_field(table_id, field_id):
             else:
                 field.options = None
 
+            if rebuild_keys:
+                try:
+                    rebuild_unique_keys(field)
+                except RecordValidationError as e:
+                    db.session.rollback()
+                    flash(str(e), 'danger')
+                    return redirect(url_for('edit_field', table_id=table_id, field_id=field_id))
+
             db.session.commit()
             flash('Champ mis à jour avec succès.', 'success')
             return redirect(url_for('manage_fields', table_id=table_id))
@@ -964,16 +1101,105 @@ def reorder_fields(table_id):
         return jsonify({'success': False, 'message': 'Données invalides'}), 400
 
     field_orders = data['fields']
+    fields = {field.id: field for field in TableField.query.filter_by(table_id=table_id)}
 
     for field_id, order in field_orders.items():
-        field = TableField.query.get(int(field_id))
+        field = fields.get(int(field_id))
 
-        if field and field.table_id == table_id:
+        if field:
             field.order = order
 
     db.session.commit()
 
     return jsonify({'success': True})
+@app.route('/admin/metrics')
+@login_required
+@admin_required
+def request_metrics():
+    return jsonify({
+        'endpoints': get_endpoint_stats(),
+        'pools': get_pool_stats(),
+        'pdf_renderer': app.extensions['pdf_renderer'].get_stats(),
+        'cache': cache.get_stats(),
+        'engines': {
+            bind_key or 'default': describe_engine_profile(engine)
+            for bind_key, engine in db.engines.items()
+        },
+        'tenant_engines': {
+            f'{tenant}:{bind_key}' if bind_key else tenant: describe_engine_profile(engine)
+            for (tenant, bind_key), engine in app.extensions['tenants'].engines().items()
+        }
+    })
+
+def tenant_summary():
+    """Count the tables, records and users of the current group's database"""
+    since = datetime.utcnow() - timedelta(days=7)
+    return {
+        'tables': Table.query.count(),
+        'records': Record.query.count(),
+        'records_week': Record.query.filter(Record.created_at >= since).count(),
+        'users': User.query.count(),
+        'last_change': db.session.query(func.max(RecordChange.changed_at)).scalar()
+    }
+
+def _tenant_error(error):
+    if isinstance(error, (TimeoutError, AggregationError)):
+        return str(error)
+    return 'Base de données indisponible.'
+
+@app.route('/admin/tenants')
+@login_required
+@admin_required
+@tenants_required
+def tenants_overview():
+    # Every group is queried in its own thread: a large group only delays its own row
+    summaries, errors = map_tenants(tenant_summary)
+    totals = {
+        key: sum(summary[key] for summary in summaries.values())
+        for key in ('tables', 'records', 'records_week', 'users')
+    }
+    return render_template(
+        'tenants.html',
+        title='Groupes',
+        tenants=tenant_names(),
+        summaries=summaries,
+        errors={tenant: _tenant_error(error) for tenant, error in errors.items()},
+        totals=totals
+    )
+
+@app.route('/api/tenants/aggregate')
+@login_required
+@admin_required
+@tenants_required
+def aggregate_tenant_records():
+    """Run the aggregation of /api/tables/<id>/aggregate on the table of that name in every group"""
+    table_name = request.args.get('table', '')
+    group_by = [spec for value in request.args.getlist('group_by') for spec in value.split(',') if spec]
+    metrics = [spec for value in request.args.getlist('metric') for spec in value.split(',') if spec] or ['count']
+    limit = request.args.get('limit', type=int)
+    # The threads have no request: the admin is passed explicitly, and sees every record
+    user = current_user._get_current_object()
+
+    def aggregate():
+        table = Table.query.filter_by(name=table_name).first()
+        if table is None:
+            raise AggregationError(f'Table inconnue: {table_name}')
+        return aggregate_table(table, group_by=group_by, metrics=metrics, user=user, limit=limit)
+
+    results, errors = map_tenants(aggregate)
+    metric_keys = next(iter(results.values()))['metrics'] if results else []
+    return jsonify({
+        'table': table_name,
+        'group_by': group_by,
+        'metrics': metric_keys,
+        'rows': [
+            {'tenant': tenant, **row}
+            for tenant in tenant_names() if tenant in results
+            for row in results[tenant]['rows']
+        ],
+        'errors': {tenant: _tenant_error(error) for tenant, error in errors.items()}
+    })
+
 @app.route('/manage_print_templates')
 @login_required
 @admin_required
@@ -983,53 +1209,44 @@ def manage_print_templates():
 
 @app.route('/print/generic_text/autorisation_camp')
 @login_required
+@use_read_replica
 def print_generic_text():
-    text = GenericText.query.filter_by(name='autorisation_camp').first()
-    if not text:
-        text = GenericText(
-            name='autorisation_camp',
-            content='<h2>Autorisation de Camp</h2><p>Je soussigné(e), [nom du parent], autorise [nom de l\'enfant] à participer au camp scout qui se déroulera du [date début] au [date fin] à [lieu].</p><p>Fait à _________________, le _________________</p><p>Signature: _________________</p>'
-        )
-        db.session.add(text)
-        db.session.commit()
-
-    template = PrintTemplate.query.filter_by(is_default=True).first()
-    if not template:
-        template = PrintTemplate(
-            name="Default",
-            header_html='<h1>Gestion des Scouts</h1>',
-            footer_html='<p>Document généré le {{date}}</p>',
-            is_default=True
-        )
-        db.session.add(template)
-        db.session.commit()
+    text = get_generic_text('autorisation_camp')
+    if text is None:
+        abort(404)
+    template = get_default_print_template()
 
-    return render_template(
+    html = render_template(
         'print_generic_text.html',
         text=text,
         template=template,
-        date=datetime.now().strftime('%d/%m/%Y')
+        date=datetime.now().strftime('%d/%m/%Y'),
+        pdf=wants_pdf()
     )
+    if wants_pdf():
+        return pdf_response(html, f'{text.name}.pdf')
+    return html
 
 @app.route('/api/print_template/active')
 def get_active_template():
-    template = PrintTemplate.query.filter_by(is_default=True).first()
-    if not template:
-        template = PrintTemplate(
-            name="Default",
-            header_html='<h1>Gestion des Scouts</h1>',
-            footer_html='<p>Document généré le ${new Date().toLocaleDateString("fr-FR")}</p>',
-            is_default=True
-        )
-        db.session.add(template)
-        db.session.commit()
+    template = get_default_print_template()
     return jsonify({
         'header_html': template.header_html,
         'footer_html': template.footer_html,
-        'css': template.css,
-        'logo_url': template.logo_url
+        'css': print_css(template),
+        'logo_url': print_logo_src(template)
     })
 
+@app.route('/print_assets/<filename>')
+@login_required
+def print_asset(filename):
+    # Stored logos are named after their content: a new logo gets a new URL
+    if not LOGO_FILENAME.match(filename):
+        abort(404)
+    response = send_from_directory(logo_folder(), filename, max_age=365 * 24 * 3600)
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/manage_print_templates/<int:template_id>', methods=['POST'])
 @login_required
 @admin_required
@@ -1038,11 +1255,154 @@ def update_print_template(template_id):
     template.header_html = request.form.get('header_html', '')
     template.footer_html = request.form.get('footer_html', '')
     template.css = request.form.get('css', '')
-    template.logo_url = request.form.get('logo_url', '')
+    template.css_minified = minify_css(template.css)
+
+    # The logo is stored locally once, so printing needs no network
+    upload = request.files.get('logo_file')
+    logo_url = request.form.get('logo_url', '').strip()
+    try:
+        if upload and upload.filename:
+            template.logo_file = store_logo(upload.read())
+            template.logo_url = ''
+        elif request.form.get('remove_logo'):
+            template.logo_file = None
+            template.logo_url = ''
+        elif logo_url != (template.logo_url or '') or (logo_url and not template.logo_file):
+            # Until the download succeeds, the logo is loaded from its URL
+            template.logo_url = logo_url
+            template.logo_file = None
+            if logo_url:
+                template.logo_file = fetch_logo(logo_url)
+    except PrintAssetError as e:
+        flash(str(e), 'warning')
+
     db.session.commit()
+    forget_print_template()
+    purge_unused_logos({logo_file for logo_file, in db.session.query(PrintTemplate.logo_file).filter(PrintTemplate.logo_file.isnot(None))})
     flash('Template updated successfully', 'success')
     return redirect(url_for('manage_print_templates'))
 
+@app.route('/reports')
+@login_required
+@use_read_replica
+def reports():
+    report_templates = ReportTemplate.query.options(selectinload(ReportTemplate.schedule)).order_by(ReportTemplate.name).all()
+    return render_template('reports.html', title='Rapports', reports=report_templates, frequencies=REPORT_FREQUENCIES)
+
+@app.route('/reports/<int:report_id>')
+@login_required
+@use_read_replica
+def view_report(report_id):
+    report = ReportTemplate.query.get_or_404(report_id)
+
+    # Precomputed content covers all records, so only users who can see everything get it
+    snapshot = None
+    if current_user.is_editor() and not request.args.get('refresh'):
+        snapshot = get_fresh_snapshot(report)
+
+    if snapshot:
+        body = [snapshot.content]
+        generated_at = snapshot.generated_at
+    else:
+        try:
+            body = generate_report(report, current_user)
+        except TemplateSyntaxError as e:
+            flash(f'Le modèle de rapport contient une erreur: {e.message}', 'danger')
+            return redirect(url_for('reports'))
+        generated_at = None
+
+    return app.response_class(stream_with_context(buffer_chunks(stream_template(
+        'print_report.html',
+        report=report,
+        body=body,
+        generated_at=generated_at
+    ))))
+
+@app.route('/manage_reports', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def manage_reports():
+    if request.method == 'POST':
+        return save_report_template(ReportTemplate())
+
+    report_templates = ReportTemplate.query.options(selectinload(ReportTemplate.schedule)).order_by(ReportTemplate.name).all()
+    edit_report = None
+    report_id = request.args.get('edit', type=int)
+    if report_id:
+        edit_report = ReportTemplate.query.get_or_404(report_id)
+
+    return render_template(
+        'manage_report_templates.html',
+        title='Modèles de rapports',
+        reports=report_templates,
+        edit_report=edit_report,
+        tables=Table.query.options(selectinload(Table.fields)).all(),
+        frequencies=REPORT_FREQUENCIES
+    )
+
+@app.route('/manage_reports/<int:report_id>', methods=['POST'])
+@login_required
+@admin_required
+def update_report_template(report_id):
+    return save_report_template(ReportTemplate.query.get_or_404(report_id))
+
+def save_report_template(report):
+    name = request.form.get('name', '').strip()
+    template_html = request.form.get('template_html', '')
+
+    if not name or not template_html.strip():
+        flash('Le nom et le modèle HTML sont obligatoires.', 'danger')
+        return redirect(url_for('manage_reports', edit=report.id))
+
+    try:
+        report_environment.parse(template_html)
+    except TemplateSyntaxError as e:
+        flash(f'Le modèle de rapport contient une erreur: {e.message}', 'danger')
+        return redirect(url_for('manage_reports', edit=report.id))
+
+    try:
+        field_ids = list(dict.fromkeys(int(field_id) for field_id in request.form.getlist('fields')))
+    except ValueError:
+        field_ids = None
+    if field_ids is None or TableField.query.filter(TableField.id.in_(field_ids)).count() != len(field_ids):
+        flash('Les champs sélectionnés pour le rapport sont invalides.', 'danger')
+        return redirect(url_for('manage_reports', edit=report.id))
+
+    report.name = name
+    report.description = request.form.get('description', '')
+    report.template_html = template_html
+    report.set_fields(field_ids)
+    report.modified_at = datetime.utcnow()
+
+    frequency = request.form.get('frequency')
+    if frequency in REPORT_FREQUENCIES:
+        if report.schedule:
+            report.schedule.frequency = frequency
+        else:
+            report.schedule = ScheduledReport(frequency=frequency)
+    elif report.schedule:
+        db.session.delete(report.schedule)
+
+    db.session.add(report)
+    db.session.commit()
+    forget_report(report.id)
+
+    flash('Modèle de rapport enregistré avec succès.', 'success')
+    return redirect(url_for('manage_reports'))
+
+@app.route('/manage_reports/<int:report_id>/delete', methods=['POST'])
+@login_required
+@admin_required
+def delete_report_template(report_id):
+    report = ReportTemplate.query.get_or_404(report_id)
+
+    db.session.delete(report)
+    db.session.commit()
+    forget_report(report_id)
+
+    flash('Modèle de rapport supprimé avec succès.', 'success')
+    return redirect(url_for('manage_reports'))
+
 @app.route('/manage_table_permissions', methods=['GET', 'POST'])
 @app.route('/manage_table_permissions/<int:table_id>', methods=['GET', 'POST'])
 @login_required
@@ -1153,28 +1513,39 @@ def bulk_grant_permissions(table_id):
 def manage_generic_text(name):
     text = GenericText.query.filter_by(name=name).first()
     if not text:
+        # Created when first saved
         text = GenericText(
             name=name,
-            content='Texte par défaut'
+            content=DEFAULT_GENERIC_TEXTS.get(name, 'Texte par défaut')
         )
-        db.session.add(text)
-        db.session.commit()
 
     if request.method == 'POST':
         text.content = request.form.get('content', '')
+        db.session.add(text)
         db.session.commit()
+        forget_generic_texts()
         flash('Texte mis à jour avec succès.', 'success')
         return redirect(url_for('manage_generic_text', name=name))
 
     return render_template('manage_generic_text.html', text=text)
-    template.header_html = request.form.get('header_html', '')
-    template.footer_html = request.form.get('footer_html', '')
-    template.css = request.form.get('css', '')
-    template.logo_url = request.form.get('logo_url', '')
-    db.session.commit()
-    return redirect(url_for('manage_print_templates'))
+
+@app.route('/api/generic_text/<name>')
+@login_required
+def get_generic_text_content(name):
+    text = get_generic_text(name)
+    if text is None:
+        return jsonify({'success': False, 'message': 'Texte introuvable.'}), 404
+
+    response = jsonify({'name': text.name, 'content': text.content})
+    # Browsers revalidate with the ETag and get a 304 while the text is unchanged
+    response.set_etag(text.etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @app.route('/tables/<int:table_id>/export', methods=['GET', 'POST'])
 @login_required
+@use_read_replica
 def export_table(table_id):
     table = Table.query.get_or_404(table_id)
     fields = TableField.query.filter_by(table_id=table_id).order_by(TableField.order).all()
@@ -1183,39 +1554,7 @@ def export_table(table_id):
         selected_fields = request.form.getlist('fields')
 
         # Get records with permission check
-        if current_user.is_editor():
-            records_query = Record.query.filter_by(table_id=table_id)
-        else:
-            # Get user's permissions for this table
-            permissions = TablePermission.query.filter_by(
-                user_id=current_user.id,
-                table_id=table_id
-            ).all()
-
-            if not permissions:
-                records_query = Record.query.filter_by(id=0)  # Return empty set
-            else:
-                # Check if user has all access
-                has_all_access = any(p.all_access for p in permissions)
-
-                if has_all_access:
-                    records_query = Record.query.filter_by(table_id=table_id)
-                else:
-                    # Build query for records matching any permission
-                    from sqlalchemy import or_
-                    conditions = []
-                    for permission in permissions:
-                        record_values = RecordValue.query.filter_by(
-                            field_id=permission.field_id
-                        ).filter(
-                            RecordValue.text_value == permission.match_value
-                        ).with_entities(RecordValue.record_id)
-                        conditions.append(Record.id.in_(record_values))
-
-                    records_query = Record.query.filter(
-                        Record.table_id == table_id,
-                        or_(*conditions)
-                    )
+        records_query = get_permitted_records_query(table_id)
 
         # Apply additional filters
         for field in fields:
@@ -1229,19 +1568,16 @@ def export_table(table_id):
                 ).with_entities(RecordValue.record_id)
                 records_query = records_query.filter(Record.id.in_(matching_records))
 
-        records = records_query.all()
-
         import pandas as pd
         from io import BytesIO
 
-        data = []
-        for record in records:
-            row = {}
-            for field_id in selected_fields:
-                field = TableField.query.get(field_id)
-                value = RecordValue.query.filter_by(record_id=record.id, field_id=field.id).first()
-                row[field.display_name] = value.get_value() if value else None
-            data.append(row)
+        # Values are loaded one chunk of records at a time instead of one query per cell
+        fields_by_id = {str(field.id): field for field in fields}
+        export_fields = [fields_by_id[field_id] for field_id in selected_fields if field_id in fields_by_id]
+        data = [
+            {field.display_name: row[field.name] for field in export_fields}
+            for row in iter_record_rows(records_query, export_fields, newest_first=False)
+        ]
 
         df = pd.DataFrame(data)
         output = BytesIO()
@@ -1256,4 +1592,76 @@ def export_table(table_id):
             download_name=f'{table.name}_export.xlsx'
         )
 
-    return render_template('export_table.html', table=table, fields=fields)
\ No newline at end of file
+    return render_template('export_table.html', table=table, fields=fields)
+
+# Archived records per page
+ARCHIVE_PAGE_SIZE = 50
+
+def _archive_columns(fields, rows):
+    """Return (name, label) pairs for the current fields, then for the fields only found in archived values"""
+    columns = [(field.name, field.display_name) for field in fields]
+    known = {field.name for field in fields}
+    for row in rows:
+        for name in row:
+            if name not in known:
+                known.add(name)
+                columns.append((name, name))
+    return columns
+
+@app.route('/tables/<int:table_id>/archive')
+@login_required
+def table_archive(table_id):
+    table = Table.query.get_or_404(table_id)
+    fields = TableField.query.filter_by(table_id=table_id).order_by(TableField.order).all()
+    search = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+
+    pagination = archived_records_query(table_id, search).paginate(page=page, per_page=ARCHIVE_PAGE_SIZE, error_out=False)
+    records = [(record, record.get_values()) for record in pagination.items]
+
+    return render_template(
+        'view_archive.html',
+        title=f'Archives - {table.display_name}',
+        table=table,
+        columns=_archive_columns(fields, [values for _, values in records]),
+        records=records,
+        pagination=pagination,
+        search=search
+    )
+
+@app.route('/tables/<int:table_id>/archive/export')
+@login_required
+def export_table_archive(table_id):
+    table = Table.query.get_or_404(table_id)
+    fields = TableField.query.filter_by(table_id=table_id).order_by(TableField.order).all()
+    records = [
+        (record, record.get_values())
+        for record in archived_records_query(table_id, request.args.get('q', '').strip()).yield_per(500)
+    ]
+    columns = _archive_columns(fields, [values for _, values in records])
+
+    import pandas as pd
+    from io import BytesIO
+
+    data = [
+        {
+            'ID': record.id,
+            'Créé le': record.created_at.strftime('%Y-%m-%d %H:%M') if record.created_at else None,
+            **{label: values.get(name) for name, label in columns},
+            'Archivé le': record.archived_at.strftime('%Y-%m-%d %H:%M') if record.archived_at else None
+        }
+        for record, values in records
+    ]
+
+    df = pd.DataFrame(data)
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        df.to_excel(writer, sheet_name='Archives', index=False)
+
+    output.seek(0)
+    return send_file(
+        output,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=f'{table.name}_archives.xlsx'
+    )
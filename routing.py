@@ -0,0 +1,102 @@
+"""
+Database routing: scout groups and the read replica.
+
+When scout groups are configured (see tenants.py), the statements of a
+request run on the database of the group the user signed in to: the default
+and archive binds are swapped for the group's engines. Groups do not use the
+replica.
+
+When a `replica` bind is configured, views decorated with @use_read_replica
+run their SELECT statements on the replica. Everything else stays on the
+primary:
+    - statements issued while flushing (INSERT, UPDATE, DELETE)
+    - the rest of a request once it has committed
+    - requests from a browser session that wrote recently (read-your-writes)
+
+Configuration:
+    DATABASE_REPLICA_URL: URL of the replica. "readonly" opens the primary
+        SQLite file through a second, read-only connection, for local testing.
+    READ_YOUR_WRITES_SECONDS: Seconds after a write during which a session
+        keeps reading from the primary (default 10)
+"""
+import time
+from functools import wraps
+
+from flask import current_app, g, has_app_context, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+REPLICA_BIND = 'replica'
+ARCHIVE_BIND = 'archive'
+
+def replica_url(database_url, replica):
+    """
+    Return the URL of the replica engine, or None when routing is disabled
+
+    "readonly" maps a SQLite primary to a read-only URI connection on the same file.
+    """
+    if not replica:
+        return None
+    if replica != 'readonly':
+        return replica
+
+    url = make_url(database_url)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        raise ValueError('DATABASE_REPLICA_URL=readonly requires a SQLite database file')
+
+    # Relative paths are resolved against the instance folder by Flask-SQLAlchemy, as for the primary
+    return f'sqlite:///file:{url.database}?mode=ro&uri=true'
+
+def current_tenant():
+    """Return the scout group whose database the current context uses, None for the default database"""
+    return g.get('_tenant') if has_app_context() else None
+
+def use_tenant(tenant):
+    """Run the rest of the current context on the database of a group (None: the default database)"""
+    g._tenant = tenant
+
+def _reads_from_replica():
+    return has_request_context() and g.get('_read_replica', False)
+
+class RoutingSession(Session):
+    """Session sending statements to the current group's database, and the reads of replica-enabled requests to the replica bind"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None:
+            return engine
+
+        tenant = current_tenant()
+        if tenant is not None:
+            bind_key = ARCHIVE_BIND if engine is self._db.engines.get(ARCHIVE_BIND) else None
+            return current_app.extensions['tenants'].engine(tenant, bind_key)
+
+        if self._flushing or not _reads_from_replica():
+            return engine
+
+        engines = self._db.engines
+        # Only tables of the default bind are replicated
+        if REPLICA_BIND in engines and engine is engines.get(None):
+            return engines[REPLICA_BIND]
+        return engine
+
+def mark_written():
+    """Send the rest of the request, and the session's next requests, to the primary"""
+    if has_request_context():
+        g._read_replica = False
+        session['_last_write'] = time.time()
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _stay_on_primary(db_session):
+    mark_written()
+
+def use_read_replica(f):
+    """Run the reads of a view on the replica, unless this session wrote recently"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        window = current_app.config['READ_YOUR_WRITES_SECONDS']
+        recent_write = time.time() - session.get('_last_write', 0) < window
+        g._read_replica = bool(current_app.config.get('SQLALCHEMY_BINDS', {}).get(REPLICA_BIND)) and not recent_write
+        return f(*args, **kwargs)
+    return decorated_function
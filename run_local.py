@@ -1,5 +1,10 @@
+from app import create_app, configure_logging
+from bootstrap import bootstrap_database
 
-from app import app
+app = create_app()
 
 if __name__ == '__main__':
+    configure_logging('DEBUG')
+    with app.app_context():
+        bootstrap_database()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -286,21 +286,30 @@ function formatChartDate(dateStr) {
 
 /**
  * Generate analytical dashboard for a specific table
+ * The summaries are computed and cached by the server (/api/tables/<id>/analytics),
+ * so only a few hundred bytes are transferred whatever the size of the table.
  * @param {string} containerId - ID of the container element
- * @param {Array} records - Array of record objects
- * @param {Array} fields - Array of field objects
+ * @param {number} tableId - ID of the table
+ * @returns {Object|null} - The analytics returned by the server
  */
-function generateTableAnalytics(containerId, records, fields) {
+async function generateTableAnalytics(containerId, tableId) {
     const container = document.getElementById(containerId);
-    if (!container || !records || !fields) return;
-    
+    if (!container || !tableId) return null;
+
+    const response = await fetch(`/api/tables/${tableId}/analytics`);
+    const analytics = await response.json();
+    if (!response.ok) {
+        console.error('Error loading analytics:', analytics.message);
+        return null;
+    }
+
     // Clear the container
     container.innerHTML = '';
-    
+
     // Create row for charts
     const row = document.createElement('div');
     row.className = 'row g-4 mb-4';
-    
+
     // Create stats card
     const statsCard = document.createElement('div');
     statsCard.className = 'col-md-4';
@@ -313,12 +322,12 @@ function generateTableAnalytics(containerId, records, fields) {
                 <div class="d-flex flex-column gap-3">
                     <div class="d-flex justify-content-between align-items-center">
                         <div>Nombre d'enregistrements</div>
-                        <div class="badge bg-primary">${records.length}</div>
+                        <div class="badge bg-primary">${analytics.records}</div>
                     </div>
                     <div class="d-flex justify-content-between align-items-center">
                         <div>Date du dernier enregistrement</div>
                         <div class="badge bg-info">
-                            ${records.length > 0 ? formatChartDate(records[0].created_at) : 'N/A'}
+                            ${analytics.last_created_at ? formatChartDate(analytics.last_created_at) : 'N/A'}
                         </div>
                     </div>
                 </div>
@@ -326,103 +335,104 @@ function generateTableAnalytics(containerId, records, fields) {
         </div>
     `;
     row.appendChild(statsCard);
-    
-    // Find numeric fields for charts
-    const numericFields = fields.filter(field => field.field_type === 'number');
-    
-    if (numericFields.length > 0) {
-        // Create numeric chart card
-        const chartCard = document.createElement('div');
-        chartCard.className = 'col-md-8';
-        chartCard.innerHTML = `
-            <div class="card h-100">
-                <div class="card-header bg-dark">
-                    <h5 class="mb-0"><i class="fas fa-chart-bar me-2"></i>Distribution des valeurs</h5>
-                </div>
-                <div class="card-body">
-                    <canvas id="numericDataChart" height="200"></canvas>
-                </div>
-            </div>
-        `;
-        row.appendChild(chartCard);
-        
-        // Get data for the first numeric field
-        const firstNumericField = numericFields[0];
-        const numericData = records.map(record => {
-            const fieldValue = record.values[firstNumericField.name];
-            return {
-                name: formatChartDate(record.created_at),
-                value: fieldValue || 0
-            };
-        }).filter(item => item.value !== null);
-        
-        // Add the row to the container
-        container.appendChild(row);
-        
-        // Initialize the chart after adding to the DOM
-        setTimeout(() => {
-            createBarChart('numericDataChart', numericData, {
-                title: firstNumericField.display_name,
-                color: 'rgba(75, 192, 192, 0.7)'
-            });
-        }, 0);
-    } else {
-        // Just add the stats card if no numeric fields
-        container.appendChild(row);
-    }
-    
-    // Add dropdown field analysis if applicable
-    const dropdownFields = fields.filter(field => field.field_type === 'dropdown');
-    
-    if (dropdownFields.length > 0) {
-        dropdownFields.forEach(field => {
-            // Create card for dropdown distribution
-            const dropdownRow = document.createElement('div');
-            dropdownRow.className = 'row mb-4';
-            
-            const dropdownCard = document.createElement('div');
-            dropdownCard.className = 'col-12';
-            dropdownCard.innerHTML = `
+    container.appendChild(row);
+
+    const charts = [];
+    analytics.fields.forEach((field, index) => {
+        const canvasId = `analytics_${tableId}_${index}_chart`;
+        let data;
+        let summary = '';
+        let color = 'rgba(54, 162, 235, 0.7)';
+
+        if (field.field_type === 'number') {
+            if (!field.count) return;
+            data = field.buckets.map(bucket => ({
+                name: `${formatChartNumber(bucket.from)} – ${formatChartNumber(bucket.to)}`,
+                value: bucket.value
+            }));
+            summary = `Min ${formatChartNumber(field.min)} · Moyenne ${formatChartNumber(field.mean)} · Max ${formatChartNumber(field.max)}`;
+            color = 'rgba(75, 192, 192, 0.7)';
+        } else if (field.field_type === 'date') {
+            if (!field.count) return;
+            data = field.values;
+            summary = `Du ${formatChartDate(field.min)} au ${formatChartDate(field.max)}`;
+            color = 'rgba(255, 159, 64, 0.7)';
+        } else {
+            data = field.values;
+        }
+
+        // Create card for the field distribution
+        const fieldRow = document.createElement('div');
+        fieldRow.className = 'row mb-4';
+        fieldRow.innerHTML = `
+            <div class="col-12">
                 <div class="card">
                     <div class="card-header bg-dark">
-                        <h5 class="mb-0"><i class="fas fa-chart-pie me-2"></i>Distribution de ${field.display_name}</h5>
+                        <h5 class="mb-0"><i class="fas fa-chart-bar me-2"></i><span></span></h5>
                     </div>
                     <div class="card-body">
-                        <canvas id="dropdown_${field.id}_chart" height="200"></canvas>
+                        <p class="text-muted small mb-2"></p>
+                        <canvas id="${canvasId}" height="200"></canvas>
                     </div>
                 </div>
-            `;
-            dropdownRow.appendChild(dropdownCard);
-            container.appendChild(dropdownRow);
-            
-            // Calculate distribution data
-            const options = field.options || [];
-            const distribution = {};
-            
-            options.forEach(option => {
-                distribution[option] = 0;
-            });
-            
-            records.forEach(record => {
-                const value = record.values[field.name];
-                if (value && distribution[value] !== undefined) {
-                    distribution[value]++;
-                }
-            });
-            
-            // Format data for chart
-            const chartData = Object.keys(distribution).map(key => ({
-                name: key,
-                value: distribution[key]
-            }));
-            
-            // Initialize the chart
-            setTimeout(() => {
-                createBarChart(`dropdown_${field.id}_chart`, chartData, {
-                    title: `Distribution de ${field.display_name}`,
-                    color: 'rgba(54, 162, 235, 0.7)'
-                });
-            }, 0);
-        });
+            </div>
+        `;
+        // Field names are user-defined: set them as text
+        fieldRow.querySelector('h5 span').textContent = `Distribution de ${field.display_name}`;
+        fieldRow.querySelector('p').textContent = summary;
+        container.appendChild(fieldRow);
+
+        charts.push(() => createBarChart(canvasId, data, {
+            title: `Distribution de ${field.display_name}`,
+            color: color
+        }));
+    });
+
+    // Initialize the charts after adding them to the DOM
+    setTimeout(() => charts.forEach(chart => chart()), 0);
+    return analytics;
+}
+
+/**
+ * Format a number for chart labels
+ * @param {number} value - Number to format
+ * @returns {string} - Formatted number
+ */
+function formatChartNumber(value) {
+    if (value === null || value === undefined) return '';
+    return Number(value).toLocaleString('fr-FR', { maximumFractionDigits: 2 });
+}
+
+/**
+ * Load a server-side aggregation and render it as a bar chart
+ * @param {string} canvasId - ID of the canvas element
+ * @param {number} tableId - ID of the table to aggregate
+ * @param {Object} params - group_by and metric specifications (e.g. {group_by: ['methode_paiement'], metric: ['sum:montant']})
+ * @param {Object} options - Custom options passed to createBarChart
+ */
+async function loadAggregateChart(canvasId, tableId, params = {}, options = {}) {
+    const query = new URLSearchParams();
+    ['group_by', 'metric'].forEach(key => {
+        [].concat(params[key] || []).forEach(value => query.append(key, value));
+    });
+    if (params.limit) {
+        query.append('limit', params.limit);
+    }
+
+    const response = await fetch(`/api/tables/${tableId}/aggregate?${query.toString()}`);
+    const result = await response.json();
+    if (!response.ok) {
+        console.error('Error loading aggregation:', result.message);
+        return null;
     }
+
+    // Chart the first metric against the group labels
+    const dataset = result.datasets[0];
+    const data = result.labels.map((label, index) => ({
+        name: label,
+        value: dataset.data[index] || 0
+    }));
+
+    createBarChart(canvasId, data, { title: dataset.label, ...options });
+    return result;
 }
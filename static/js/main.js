@@ -266,6 +266,10 @@ function showNotification(message, type = 'info', duration = 5000) {
 async function printGenericText() {
     // Get generic text content
     const textResponse = await fetch('/api/generic_text/autorisation_camp');
+    if (!textResponse.ok) {
+        showNotification('Impossible de charger le texte à imprimer.', 'danger');
+        return;
+    }
     const textData = await textResponse.json();
     
     // Get print template
@@ -309,7 +313,7 @@ async function printGenericText() {
                 ${textData.content}
             </div>
             <div class="footer">
-                ${template.footer_html ? template.footer_html.replace('${date}', new Date().toLocaleDateString('fr-FR')) : ''}
+                ${template.footer_html ? template.footer_html.replace('${date}', new Date().toLocaleDateString('fr-FR')).replace('{{date}}', new Date().toLocaleDateString('fr-FR')) : ''}
             </div>
         </body>
         </html>
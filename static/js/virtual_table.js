@@ -0,0 +1,282 @@
+/**
+ * Virtual scrolling for record listings
+ * Rows are fetched page by page from the JSON rows endpoint and only the
+ * rows around the visible area are kept in the DOM
+ */
+
+document.addEventListener('DOMContentLoaded', function() {
+    const container = document.getElementById('recordsTable');
+    if (container) {
+        window.recordsTable = new VirtualTable(container);
+    }
+});
+
+class VirtualTable {
+    /**
+     * @param {HTMLElement} container - Scrollable element holding the table
+     * @param {Object} options - pageSize, overscan and maxPages overrides
+     */
+    constructor(container, options = {}) {
+        this.container = container;
+        this.tbody = container.querySelector('tbody');
+        this.countBadge = document.getElementById('recordsCount');
+        this.columns = [].slice.call(container.querySelectorAll('thead th[data-field]')).map(th => ({
+            name: th.dataset.field,
+            type: th.dataset.type
+        }));
+
+        this.pageSize = options.pageSize || 100;
+        this.overscan = options.overscan || 10;
+        this.maxPages = options.maxPages || 10;
+        this.rowHeight = 41;
+        this.rowHeightMeasured = false;
+
+        this.pages = new Map();
+        this.pending = new Set();
+        this.generation = 0;
+        this.total = 0;
+        this.query = { sort: null, direction: 'desc', q: '', filters: {} };
+
+        this.container.addEventListener('scroll', () => this.scheduleRender(), { passive: true });
+        window.addEventListener('resize', () => this.scheduleRender());
+
+        this.bindSorting();
+        this.bindFilters();
+        this.reload();
+    }
+
+    bindSorting() {
+        this.container.querySelectorAll('thead th[data-sort]').forEach(th => {
+            th.addEventListener('click', () => {
+                const sort = th.dataset.sort;
+                if (this.query.sort === sort) {
+                    this.query.direction = this.query.direction === 'asc' ? 'desc' : 'asc';
+                } else {
+                    this.query.sort = sort;
+                    this.query.direction = 'asc';
+                }
+
+                this.container.querySelectorAll('thead th[data-sort] .sort-indicator').forEach(el => el.remove());
+                const indicator = document.createElement('i');
+                indicator.className = `fas fa-sort-${this.query.direction === 'asc' ? 'up' : 'down'} ms-1 sort-indicator`;
+                th.appendChild(indicator);
+
+                this.reload();
+            });
+        });
+    }
+
+    bindFilters() {
+        let searchTimer = null;
+        const search = document.getElementById('recordsSearch');
+        if (search) {
+            search.addEventListener('input', () => {
+                clearTimeout(searchTimer);
+                searchTimer = setTimeout(() => {
+                    this.query.q = search.value.trim();
+                    this.reload();
+                }, 300);
+            });
+        }
+
+        document.querySelectorAll('[data-filter]').forEach(select => {
+            select.addEventListener('change', () => {
+                this.query.filters[select.dataset.filter] = select.value;
+                this.reload();
+            });
+        });
+    }
+
+    reload() {
+        // Responses for an earlier sort or filter are ignored once the generation changes
+        this.generation++;
+        this.pages.clear();
+        this.pending.clear();
+        this.container.scrollTop = 0;
+        this.loadPage(0);
+    }
+
+    buildUrl(page) {
+        const params = new URLSearchParams({
+            offset: page * this.pageSize,
+            limit: this.pageSize,
+            direction: this.query.direction
+        });
+        if (this.query.sort) {
+            params.append('sort', this.query.sort);
+        }
+        if (this.query.q) {
+            params.append('q', this.query.q);
+        }
+        Object.keys(this.query.filters).forEach(name => {
+            if (this.query.filters[name]) {
+                params.append(`filter_${name}`, this.query.filters[name]);
+            }
+        });
+        return `${this.container.dataset.rowsUrl}?${params.toString()}`;
+    }
+
+    async loadPage(page) {
+        if (this.pages.has(page) || this.pending.has(page)) return;
+
+        const generation = this.generation;
+        this.pending.add(page);
+
+        try {
+            const response = await fetch(this.buildUrl(page));
+            const data = await response.json();
+            if (generation !== this.generation) return;
+
+            this.total = data.total;
+            this.pages.set(page, data.rows);
+            this.evictPages(page);
+            this.updateCount();
+            this.render();
+        } catch (e) {
+            console.error('Error loading records', e);
+        } finally {
+            if (generation === this.generation) {
+                this.pending.delete(page);
+            }
+        }
+    }
+
+    evictPages(currentPage) {
+        // Keep only the pages closest to the current position in memory
+        if (this.pages.size <= this.maxPages) return;
+
+        const pages = Array.from(this.pages.keys()).sort(
+            (a, b) => Math.abs(b - currentPage) - Math.abs(a - currentPage)
+        );
+        pages.slice(0, this.pages.size - this.maxPages).forEach(page => this.pages.delete(page));
+    }
+
+    updateCount() {
+        if (this.countBadge) {
+            this.countBadge.textContent = this.total.toLocaleString('fr-FR');
+        }
+    }
+
+    scheduleRender() {
+        if (this.frame) return;
+        this.frame = requestAnimationFrame(() => {
+            this.frame = null;
+            this.render();
+        });
+    }
+
+    render() {
+        const scrollTop = this.container.scrollTop;
+        const viewport = this.container.clientHeight;
+        const first = Math.max(0, Math.floor(scrollTop / this.rowHeight) - this.overscan);
+        const last = Math.min(this.total, Math.ceil((scrollTop + viewport) / this.rowHeight) + this.overscan);
+
+        for (let page = Math.floor(first / this.pageSize); page * this.pageSize < last; page++) {
+            this.loadPage(page);
+        }
+
+        const fragment = document.createDocumentFragment();
+        fragment.appendChild(this.spacer(first * this.rowHeight));
+        for (let index = first; index < last; index++) {
+            fragment.appendChild(this.renderRow(index));
+        }
+        fragment.appendChild(this.spacer((this.total - last) * this.rowHeight));
+        this.tbody.replaceChildren(fragment);
+
+        this.measureRowHeight();
+    }
+
+    measureRowHeight() {
+        if (this.rowHeightMeasured) return;
+
+        const row = this.tbody.querySelector('tr.virtual-row');
+        if (row && row.offsetHeight) {
+            this.rowHeightMeasured = true;
+            if (row.offsetHeight !== this.rowHeight) {
+                this.rowHeight = row.offsetHeight;
+                this.scheduleRender();
+            }
+        }
+    }
+
+    rowAt(index) {
+        const page = this.pages.get(Math.floor(index / this.pageSize));
+        return page ? page[index % this.pageSize] : null;
+    }
+
+    spacer(height) {
+        const tr = document.createElement('tr');
+        tr.className = 'virtual-spacer';
+        const td = document.createElement('td');
+        td.colSpan = this.columns.length + 3;
+        td.style.height = `${height}px`;
+        tr.appendChild(td);
+        return tr;
+    }
+
+    cell(text) {
+        const td = document.createElement('td');
+        td.textContent = text;
+        return td;
+    }
+
+    renderRow(index) {
+        const tr = document.createElement('tr');
+        tr.className = 'virtual-row';
+        const record = this.rowAt(index);
+
+        if (!record) {
+            tr.appendChild(this.cell('…'));
+            tr.appendChild(this.cell(''));
+            this.columns.forEach(() => tr.appendChild(this.cell('')));
+            tr.appendChild(this.cell(''));
+            return tr;
+        }
+
+        tr.appendChild(this.cell(record.id));
+        tr.appendChild(this.cell(record.created_at));
+        this.columns.forEach(column => {
+            const value = record[column.name];
+            tr.appendChild(this.cell(value === null || value === undefined || value === '' ? '-' : value));
+        });
+
+        const actions = document.createElement('td');
+        actions.className = 'text-end';
+        actions.appendChild(this.actionLink(this.recordUrl('viewUrl', record.id), 'btn-outline-primary', 'fa-eye'));
+
+        if (this.container.dataset.editUrl) {
+            actions.appendChild(document.createTextNode(' '));
+            actions.appendChild(this.actionLink(this.recordUrl('editUrl', record.id), 'btn-outline-warning', 'fa-edit'));
+        }
+
+        if (this.container.dataset.deleteUrl) {
+            const form = document.createElement('form');
+            form.method = 'POST';
+            form.action = this.recordUrl('deleteUrl', record.id);
+            form.className = 'd-inline ms-1';
+            form.innerHTML = '<button type="submit" class="btn btn-sm btn-outline-danger"><i class="fas fa-trash-alt"></i></button>';
+            form.addEventListener('submit', event => {
+                if (!confirmAction('Êtes-vous sûr de vouloir supprimer cet enregistrement ? Cette action est irréversible.')) {
+                    event.preventDefault();
+                }
+            });
+            actions.appendChild(form);
+        }
+
+        tr.appendChild(actions);
+        return tr;
+    }
+
+    recordUrl(key, recordId) {
+        // URLs are rendered server-side for record 0 and completed here
+        return this.container.dataset[key].replace(/\/0(\/|$)/, `/${recordId}$1`);
+    }
+
+    actionLink(href, style, icon) {
+        const link = document.createElement('a');
+        link.href = href;
+        link.className = `btn btn-sm ${style}`;
+        link.innerHTML = `<i class="fas ${icon}"></i>`;
+        return link;
+    }
+}
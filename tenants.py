@@ -0,0 +1,321 @@
+"""
+Scout groups (tenants) served by one installation.
+
+Each group keeps its tables, records, users and settings in its own
+database: a SQLite file per group, or a schema per group in one PostgreSQL
+database. A group's records are never scanned by the queries of another
+one, and each group has its own connection pool, so a large group neither
+slows the others down nor takes their connections.
+
+Users choose their group on the login page. The group is stored in the
+session and every statement of their requests runs on its database, see
+routing.RoutingSession. The default database keeps working as before: its
+administrators see every group in /admin/tenants, which queries the groups
+in parallel.
+
+Groups are created, and brought up to date, by `flask bootstrap`. Other
+commands run in a group with `flask tenants run`:
+
+    flask --app main tenants list
+    flask --app main tenants run archive-records
+    flask --app main tenants run --tenant groupe_12 restore <backup> --yes
+
+Configuration:
+    TENANTS: Comma separated names of the groups (lowercase letters, digits
+        and _). Empty by default: one database, as before.
+    TENANT_DATABASE_URL: Database of a group, with {tenant} in place of its
+        name. Defaults to sqlite:///tenants/{tenant}.db in the instance
+        folder with SQLite, and to DATABASE_URL with a schema per group with
+        PostgreSQL. The archived records of a group are kept next to its
+        database, as for the default database.
+    TENANT_POOL_SIZE, TENANT_MAX_OVERFLOW: Connection pool of each group on
+        PostgreSQL and MySQL (default 5 and 5)
+    TENANT_WORKERS: Groups queried at the same time by the cross-group
+        views (default 8)
+    TENANT_TIMEOUT: Seconds the cross-group views wait for a group; slower
+        groups are shown as unavailable (default 10)
+"""
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+import click
+from flask import current_app, session
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+from app import app, db
+from engine_profiles import engine_options, apply_engine_profile, archive_url, is_memory_database
+from instrumentation import watch_pool
+from routing import ARCHIVE_BIND, current_tenant, use_tenant
+
+logger = logging.getLogger(__name__)
+
+TENANT_NAME = re.compile(r'^[a-z][a-z0-9_]{0,39}$')
+# PostgreSQL schemas a group cannot be named after
+RESERVED_NAMES = {'public', 'information_schema'}
+
+TENANT_SESSION_KEY = '_tenant'
+
+class TenantError(LookupError):
+    """Raised for an unknown group; the message is shown to the user"""
+
+class TenantEngines:
+    """Engines of the groups' databases, created on first use, with a pool per group"""
+
+    def __init__(self, tenants, url_template, instance_path, pool_size=5, max_overflow=5, workers=8):
+        self.tenants = tenants
+        self.url_template = url_template
+        self.instance_path = instance_path
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.workers = workers
+        self._engines = {}
+        self._lock = threading.RLock()
+        self._executor = None
+        self._pid = None
+
+    def database_url(self, tenant):
+        """Return the URL of a group's database"""
+        if '{tenant}' not in self.url_template:
+            # One PostgreSQL database, a schema per group
+            return self.url_template
+        url = make_url(self.url_template.format(tenant=tenant))
+        if url.get_backend_name() == 'sqlite' and not is_memory_database(url) and not os.path.isabs(url.database):
+            # Relative to the instance folder, as Flask-SQLAlchemy does for DATABASE_URL
+            url = url.set(database=os.path.join(self.instance_path, url.database))
+        return url.render_as_string(hide_password=False)
+
+    def _create_engine(self, tenant, url):
+        options = engine_options(url)
+        if 'pool_size' in options:
+            options.update(pool_size=self.pool_size, max_overflow=self.max_overflow)
+        if '{tenant}' not in self.url_template:
+            connect_args = dict(options.get('connect_args', {}))
+            connect_args['options'] = f'{connect_args.get("options", "")} -c search_path={tenant}'.strip()
+            options['connect_args'] = connect_args
+        engine = create_engine(url, **options)
+        apply_engine_profile(engine)
+        return engine
+
+    def engine(self, tenant, bind_key=None):
+        """
+        Return the engine of a group's database (bind_key None) or of its archive ("archive")
+
+        Raises:
+            TenantError: The group is not configured
+        """
+        engine = self._engines.get((tenant, bind_key))
+        if engine is not None:
+            return engine
+
+        with self._lock:
+            if (tenant, bind_key) not in self._engines:
+                if tenant not in self.tenants:
+                    raise TenantError(f'Groupe inconnu : {tenant}')
+                url = self.database_url(tenant)
+                if bind_key == ARCHIVE_BIND:
+                    url = archive_url(url)
+                if bind_key == ARCHIVE_BIND and url == self.database_url(tenant):
+                    # Archive tables in the group's own database: share its pool
+                    engine = self.engine(tenant)
+                else:
+                    engine = self._create_engine(tenant, url)
+                    watch_pool(engine, f'{tenant}:{bind_key}' if bind_key else tenant)
+                self._engines[(tenant, bind_key)] = engine
+            return self._engines[(tenant, bind_key)]
+
+    def engines(self):
+        """Return the engines created so far, by group and bind key"""
+        with self._lock:
+            return dict(self._engines)
+
+    def create_database(self, tenant):
+        """Create the folder or the schema of a group's database, if needed"""
+        engine = self.engine(tenant)
+        if engine.dialect.name == 'sqlite':
+            if not is_memory_database(engine.url):
+                os.makedirs(os.path.dirname(engine.url.database), exist_ok=True)
+        elif engine.dialect.name == 'postgresql' and '{tenant}' not in self.url_template:
+            with engine.begin() as connection:
+                connection.exec_driver_sql(f'CREATE SCHEMA IF NOT EXISTS {tenant}')
+
+    def executor(self):
+        """Return the threads querying the groups, one pool per process"""
+        # Gunicorn workers are forked after the app is imported, as for group_commit
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='tenants')
+                self._pid = os.getpid()
+            return self._executor
+
+    def dispose(self):
+        """Close the pooled connections, e.g. before forking workers"""
+        for engine in self.engines().values():
+            engine.dispose()
+
+def tenant_names():
+    """Return the configured groups"""
+    return current_app.extensions['tenants'].tenants
+
+def tenant_choices():
+    """Return the choices of the group field of the login form, empty without groups"""
+    tenants = tenant_names()
+    if not tenants:
+        return []
+    return [('', 'Base principale')] + [(tenant, tenant) for tenant in tenants]
+
+def remember_tenant(tenant):
+    """Store the group of the user in the session, on login"""
+    if tenant is None:
+        session.pop(TENANT_SESSION_KEY, None)
+    else:
+        session[TENANT_SESSION_KEY] = tenant
+
+def forget_tenant():
+    session.pop(TENANT_SESSION_KEY, None)
+
+def current_engine(bind_key=None):
+    """Return the engine of the current database: the group's, or the default one"""
+    tenant = current_tenant()
+    if tenant is None:
+        return db.engines[bind_key]
+    return current_app.extensions['tenants'].engine(tenant, bind_key)
+
+@contextmanager
+def tenant_context(tenant):
+    """Push an application context working on the database of a group"""
+    with app.app_context():
+        use_tenant(tenant)
+        yield
+
+def _call_in_tenant(tenant, fn):
+    with tenant_context(tenant):
+        return fn()
+
+def map_tenants(fn, tenants=None, timeout=None):
+    """
+    Call fn in the database of every group, in parallel
+
+    Each call runs in its own thread and application context, on the pool
+    of its group. Groups that do not answer within the timeout are reported
+    without waiting for them; their call finishes in the background.
+
+    Args:
+        fn (callable): Function without arguments, returning picklable data
+            rather than models (their session closes with the call)
+        tenants (list, optional): Groups to query, defaults to all of them
+        timeout (float, optional): Seconds to wait, defaults to TENANT_TIMEOUT
+
+    Returns:
+        tuple: (results by group, exceptions by group); a group that timed
+            out has a TimeoutError
+    """
+    registry = current_app.extensions['tenants']
+    tenants = registry.tenants if tenants is None else tenants
+    timeout = current_app.config['TENANT_TIMEOUT'] if timeout is None else timeout
+
+    executor = registry.executor()
+    futures = {tenant: executor.submit(_call_in_tenant, tenant, fn) for tenant in tenants}
+    wait(futures.values(), timeout=timeout)
+
+    results, errors = {}, {}
+    for tenant, future in futures.items():
+        if not future.done():
+            errors[tenant] = TimeoutError(f'Pas de réponse après {timeout:g} s')
+            logger.warning('Group %s did not answer within %s s', tenant, timeout)
+        elif future.exception() is not None:
+            errors[tenant] = future.exception()
+            logger.warning('Group %s failed: %s', tenant, future.exception())
+        else:
+            results[tenant] = future.result()
+    return results, errors
+
+def _default_url_template(database_url):
+    url = make_url(database_url)
+    if url.get_backend_name() == 'sqlite':
+        return 'sqlite:///tenants/{tenant}.db'
+    return database_url
+
+def init_tenants(app):
+    """Read the group settings, and bind each request to the group of its session"""
+    app.config.setdefault('TENANTS', os.environ.get('TENANTS', ''))
+    app.config.setdefault('TENANT_DATABASE_URL', os.environ.get(
+        'TENANT_DATABASE_URL', _default_url_template(app.config['SQLALCHEMY_DATABASE_URI'])
+    ))
+    app.config.setdefault('TENANT_POOL_SIZE', int(os.environ.get('TENANT_POOL_SIZE', 5)))
+    app.config.setdefault('TENANT_MAX_OVERFLOW', int(os.environ.get('TENANT_MAX_OVERFLOW', 5)))
+    app.config.setdefault('TENANT_WORKERS', int(os.environ.get('TENANT_WORKERS', 8)))
+    app.config.setdefault('TENANT_TIMEOUT', float(os.environ.get('TENANT_TIMEOUT', 10)))
+
+    tenants = [name.strip() for name in app.config['TENANTS'].split(',') if name.strip()]
+    for tenant in tenants:
+        if not TENANT_NAME.match(tenant) or tenant in RESERVED_NAMES:
+            raise ValueError(f'Invalid group name in TENANTS: {tenant!r}')
+    url_template = app.config['TENANT_DATABASE_URL']
+    if tenants and '{tenant}' not in url_template and make_url(url_template).get_backend_name() != 'postgresql':
+        raise ValueError('TENANT_DATABASE_URL must contain {tenant}, except on PostgreSQL')
+
+    app.extensions['tenants'] = TenantEngines(
+        tenants,
+        url_template,
+        app.instance_path,
+        pool_size=app.config['TENANT_POOL_SIZE'],
+        max_overflow=app.config['TENANT_MAX_OVERFLOW'],
+        workers=app.config['TENANT_WORKERS']
+    )
+
+    @app.before_request
+    def bind_request_tenant():
+        tenant = session.get(TENANT_SESSION_KEY)
+        if tenant is not None and tenant not in tenants:
+            # Group removed from TENANTS: its sessions end
+            session.clear()
+            tenant = None
+        use_tenant(tenant)
+
+    @app.context_processor
+    def inject_tenant():
+        return {'current_tenant': current_tenant(), 'tenants_enabled': bool(tenants)}
+
+@app.cli.group('tenants')
+def tenants_cli():
+    """Manage the scout groups."""
+
+@tenants_cli.command('list')
+def list_command():
+    """List the groups and their database."""
+    registry = current_app.extensions['tenants']
+    if not registry.tenants:
+        print('Aucun groupe configuré (TENANTS).')
+    for tenant in registry.tenants:
+        print(f'{tenant:<20}  {make_url(registry.database_url(tenant)).render_as_string(hide_password=True)}')
+
+@tenants_cli.command('run', context_settings={'ignore_unknown_options': True, 'allow_interspersed_args': False})
+@click.option('--tenant', 'tenants', multiple=True, help='Only run in this group; repeat the option for several groups.')
+@click.argument('command')
+@click.argument('args', nargs=-1, type=click.UNPROCESSED)
+def run_command(tenants, command, args):
+    """Run a command in every group, e.g. `tenants run archive-records --days 730`."""
+    context = click.get_current_context()
+    cli_command = app.cli.get_command(context, command)
+    if cli_command is None:
+        raise click.UsageError(f'Commande inconnue : {command}')
+    unknown = [tenant for tenant in tenants if tenant not in tenant_names()]
+    if unknown:
+        raise click.UsageError(f'Groupe(s) inconnu(s) : {", ".join(unknown)}')
+
+    failed = []
+    for tenant in tenants or tenant_names():
+        print(f'Groupe {tenant} :')
+        with tenant_context(tenant):
+            try:
+                cli_command.main(list(args), prog_name=f'flask tenants run {command}', standalone_mode=False)
+            except click.ClickException as e:
+                e.show()
+                failed.append(tenant)
+    if failed:
+        raise click.ClickException(f'Échec dans le(s) groupe(s) : {", ".join(failed)}')
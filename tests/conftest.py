@@ -0,0 +1,107 @@
+"""
+Shared fixtures of the test suite.
+
+The application reads its configuration from the environment when app.py
+is imported: the tests point it at SQLite databases in a temporary folder,
+with two scout groups, before importing it. The databases are bootstrapped
+once per session; each test creates the tables it works on.
+
+    python -m pytest -q
+"""
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FOLDER = tempfile.mkdtemp(prefix='scouts-tests-')
+os.environ.update({
+    'DATABASE_URL': f'sqlite:///{FOLDER}/scouts.db',
+    'CACHE_BACKEND': 'none',
+    'IDENTITY_EPOCH_FILE': f'{FOLDER}/identity-epoch',
+    'BACKUP_FOLDER': f'{FOLDER}/backups',
+    'PRINT_ASSETS_FOLDER': f'{FOLDER}/assets',
+    'TENANTS': 'alpha,beta',
+    'TENANT_DATABASE_URL': f'sqlite:///{FOLDER}/tenants/{{tenant}}.db',
+    'REPORT_SCHEDULER_INTERVAL': '0',
+    'GROUP_COMMIT': '0',
+    'SESSION_SECRET': 'tests',
+})
+for name in ('DATABASE_REPLICA_URL', 'ARCHIVE_DATABASE_URL'):
+    os.environ.pop(name, None)
+
+from app import create_app, db  # noqa: E402
+from bootstrap import bootstrap_database  # noqa: E402
+from models import Table, TableField, User, ROLE_ADMIN  # noqa: E402
+
+_names = itertools.count(1)
+
+@pytest.fixture(scope='session')
+def app():
+    application = create_app()
+    application.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with application.app_context():
+        bootstrap_database()
+        db.session.remove()
+    yield application
+    with application.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+        application.extensions['tenants'].dispose()
+    shutil.rmtree(FOLDER, ignore_errors=True)
+
+@pytest.fixture
+def app_ctx(app):
+    """Application context on the default database"""
+    with app.app_context():
+        yield
+        db.session.remove()
+
+@pytest.fixture
+def admin(app_ctx):
+    return User.query.filter_by(role=ROLE_ADMIN).order_by(User.id).first()
+
+@pytest.fixture
+def client(app):
+    """Test client signed in as the default admin"""
+    client = app.test_client()
+    response = client.post('/login', data={'username': 'admin', 'password': 'admin123', 'group': ''})
+    assert response.status_code == 302
+    return client
+
+def make_table(*fields, **columns):
+    """
+    Create a table with a unique name in the current database
+
+    Args:
+        fields: (name, field_type) or (name, field_type, options) tuples,
+            options being a dict of TableField columns
+
+    Returns:
+        Table: The table, with its fields in order
+    """
+    table = Table(name=f'test_{next(_names)}', display_name='Test', **columns)
+    db.session.add(table)
+    db.session.flush()
+    for order, (name, field_type, *options) in enumerate(fields, start=1):
+        db.session.add(TableField(
+            table_id=table.id, name=name, display_name=name.capitalize(), field_type=field_type, order=order,
+            **(options[0] if options else {})
+        ))
+    db.session.commit()
+    return table
+
+def form_data(table, **values):
+    """Submitted values of a table keyed "field_<id>", as create_record expects"""
+    fields = {field.name: field for field in table.fields}
+    return {f'field_{fields[name].id}': value for name, value in values.items()}
+
+def old_date(days):
+    """A date days in the past"""
+    return datetime.utcnow() - timedelta(days=days)
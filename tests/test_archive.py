@@ -0,0 +1,79 @@
+from datetime import datetime
+
+import pytest
+
+from app import db
+from archive import ArchiveError, archive_table_records
+from helpers import create_record
+from models import ArchivedRecord, Record, RecordChange, RecordValue
+from conftest import form_data, make_table, old_date
+
+def add_records(table, admin, count, days=400):
+    ids = []
+    for number in range(count):
+        record_id = create_record(table.id, table.fields, form_data(table, nom=f'Scout {number}'), admin.id)
+        record = db.session.get(Record, record_id)
+        record.created_at = record.modified_at = old_date(days)
+        ids.append(record_id)
+    db.session.commit()
+    return ids
+
+def test_archive_moves_old_records(admin):
+    table = make_table(('nom', 'text'))
+    ids = add_records(table, admin, 3)
+    recent = create_record(table.id, table.fields, form_data(table, nom='Récent'), admin.id)
+    db.session.commit()
+
+    assert archive_table_records(table, old_date(30), batch_size=2) == 3
+
+    assert [record.id for record in Record.query.filter_by(table_id=table.id)] == [recent]
+    assert RecordValue.query.filter(RecordValue.record_id.in_(ids)).count() == 0
+    archived = ArchivedRecord.query.filter(ArchivedRecord.id.in_(ids)).order_by(ArchivedRecord.id).all()
+    assert [copy.get_values() for copy in archived] == [{'nom': f'Scout {number}'} for number in range(3)]
+    deletes = RecordChange.query.filter_by(table_id=table.id, operation='delete').count()
+    assert deletes == 3
+
+def test_archive_finishes_an_interrupted_run(admin):
+    table = make_table(('nom', 'text'))
+    record_id, = add_records(table, admin, 1)
+    record = db.session.get(Record, record_id)
+    # Copied by a run interrupted before the delete
+    db.session.add(ArchivedRecord(
+        id=record_id, table_id=table.id, created_by=admin.id,
+        created_at=record.created_at, modified_at=record.modified_at, values='{"nom": "Scout 0"}', search_text='scout 0'
+    ))
+    db.session.commit()
+
+    assert archive_table_records(table, old_date(30)) == 1
+    assert db.session.get(Record, record_id) is None
+    assert ArchivedRecord.query.filter_by(id=record_id).count() == 1
+
+def test_archive_keeps_a_record_with_a_reused_id(admin):
+    table = make_table(('nom', 'text'))
+    record_id, = add_records(table, admin, 1)
+    # Archived copy of another, older record that had the same id
+    db.session.add(ArchivedRecord(
+        id=record_id, table_id=table.id, created_by=admin.id,
+        created_at=datetime(2001, 1, 1), modified_at=datetime(2001, 1, 1), values='{"nom": "Ancien"}', search_text='ancien'
+    ))
+    db.session.commit()
+
+    with pytest.raises(ArchiveError):
+        archive_table_records(table, old_date(30))
+
+    assert db.session.get(Record, record_id) is not None
+    assert RecordValue.query.filter_by(record_id=record_id).count() == 1
+    assert ArchivedRecord.query.filter_by(id=record_id).one().get_values() == {'nom': 'Ancien'}
+    db.session.delete(ArchivedRecord.query.filter_by(id=record_id).one())
+    db.session.commit()
+
+def test_ids_of_archived_records_are_not_reused(admin):
+    table = make_table(('nom', 'text'))
+    ids = add_records(table, admin, 2)
+    assert ids[-1] == db.session.query(db.func.max(Record.id)).scalar()
+
+    archive_table_records(table, old_date(30))
+    record_id = create_record(table.id, table.fields, form_data(table, nom='Nouveau'), admin.id)
+    db.session.commit()
+
+    assert record_id > ids[-1]
@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+
+import pytest
+
+import bootstrap
+from app import db
+from backup import BackupError, backup_database, restore_backup
+from helpers import create_record
+from models import Record, RecordValue, User
+from routing import current_tenant
+from tenants import tenant_context
+from conftest import form_data, make_table
+
+@pytest.fixture
+def folder(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'BACKUP_FOLDER', str(tmp_path))
+    return str(tmp_path)
+
+def database_backup(paths):
+    """The backup of the application data, not of the archive"""
+    path, = [path for path in paths if '-archive' not in os.path.basename(path)]
+    return path
+
+def test_backup_while_writing_and_restore(app, folder):
+    with tenant_context('beta'):
+        table = make_table(('nom', 'text'))
+        table_id, fields = table.id, table.fields
+        before = [create_record(table_id, fields, form_data(table, nom=f'Avant {number}'), 1) for number in range(5)]
+        db.session.commit()
+
+        stop = threading.Event()
+        written = []
+
+        def writer():
+            with tenant_context('beta'):
+                while not stop.is_set():
+                    written.append(create_record(table_id, fields, form_data(table, nom='Pendant'), 1))
+                    db.session.commit()
+                    time.sleep(0.002)
+                db.session.remove()
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            time.sleep(0.05)
+            paths = backup_database()
+        finally:
+            stop.set()
+            thread.join()
+
+        assert written
+        assert all(os.path.basename(path).startswith(('scouts@beta-', 'scouts-archive@beta-')) for path in paths)
+        after = create_record(table_id, fields, form_data(table, nom='Après'), 1)
+        db.session.commit()
+        db.session.remove()
+
+        restore_backup(database_backup(paths))
+
+        stored = {record_id for record_id, in db.session.query(Record.id).filter_by(table_id=table_id)}
+        assert set(before) <= stored
+        assert after not in stored
+        # The copy is the database at one instant: every record it has is complete
+        assert RecordValue.query.filter(RecordValue.record_id.in_(stored)).count() == len(stored)
+        db.session.remove()
+
+def test_partial_restore_keeps_the_other_tables(app, folder):
+    with tenant_context('beta'):
+        table = make_table(('nom', 'text'))
+        record_id = create_record(table.id, table.fields, form_data(table, nom='Sauvegardé'), 1)
+        db.session.commit()
+        path = database_backup(backup_database())
+
+        RecordValue.query.filter_by(record_id=record_id).one().text_value = 'Modifié'
+        db.session.add(User(username='apres_sauvegarde', email='apres@example.com', password_hash='-'))
+        db.session.commit()
+        db.session.remove()
+
+        restored = restore_backup(path, ['records', 'record_values', 'record_unique_keys'])
+
+        assert sorted(restored) == ['record_unique_keys', 'record_values', 'records']
+        assert RecordValue.query.filter_by(record_id=record_id).one().text_value == 'Sauvegardé'
+        assert User.query.filter_by(username='apres_sauvegarde').count() == 1
+        db.session.remove()
+
+def test_backup_of_another_database_is_refused(app, folder):
+    with tenant_context('alpha'):
+        path = database_backup(backup_database())
+
+    with tenant_context('beta'):
+        with pytest.raises(BackupError, match="n'est pas un fichier de sauvegarde connu"):
+            restore_backup(path)
+    with app.app_context():
+        with pytest.raises(BackupError, match="n'est pas un fichier de sauvegarde connu"):
+            restore_backup(path)
+
+def test_unknown_table_is_refused(app, folder):
+    with tenant_context('beta'):
+        path = database_backup(backup_database())
+        with pytest.raises(BackupError, match='inconnue_ici'):
+            restore_backup(path, ['inconnue_ici'])
+
+@pytest.mark.parametrize('tenant', [None, 'alpha'])
+def test_restore_only_migrates_the_restored_database(app, folder, monkeypatch, tenant):
+    migrated = []
+    bootstrap_current_database = bootstrap.bootstrap_current_database
+
+    def record_bootstrap():
+        migrated.append(current_tenant())
+        bootstrap_current_database()
+
+    monkeypatch.setattr(bootstrap, 'bootstrap_current_database', record_bootstrap)
+    with tenant_context(tenant):
+        restore_backup(database_backup(backup_database()), ['generic_texts'])
+        db.session.remove()
+
+    assert migrated == [tenant]
@@ -0,0 +1,113 @@
+import threading
+
+import pytest
+
+import group_commit
+from app import db
+from group_commit import GroupCommitWriter
+from helpers import RecordValidationError, create_record
+from models import Record, Table
+from tenants import tenant_context
+from conftest import form_data, make_table
+
+@pytest.fixture
+def writer(app):
+    writer = GroupCommitWriter(app, window=0.05, max_batch=50)
+    writer.batches = []
+    commit_batch = writer._commit_batch
+
+    def record_batch(batch):
+        writer.batches.append(len(batch))
+        commit_batch(batch)
+
+    writer._commit_batch = record_batch
+    return writer
+
+def make_names_table(app):
+    with app.app_context():
+        return make_table(('nom', 'text', {'required': True})).id
+
+def submit_all(app, writer, table_id, names):
+    """Submit a record per name from concurrent threads; return the result or the error of each"""
+    outcomes = {}
+    barrier = threading.Barrier(len(names))
+
+    def submit(name):
+        with app.app_context():
+            table = db.session.get(Table, table_id)
+            values = form_data(table, nom=name)
+            fields = table.fields
+            db.session.remove()
+            barrier.wait()
+            try:
+                outcomes[name] = writer.submit(create_record, table_id, fields, values, 1)
+            except Exception as e:
+                outcomes[name] = e
+
+    threads = [threading.Thread(target=submit, args=(name,)) for name in names]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+def stored_names(app, table_id):
+    with app.app_context():
+        return sorted(record.values[0].text_value for record in Record.query.filter_by(table_id=table_id))
+
+def test_concurrent_submissions_share_transactions(app, writer):
+    table_id = make_names_table(app)
+    names = [f'Scout {number}' for number in range(12)]
+
+    outcomes = submit_all(app, writer, table_id, names)
+
+    assert len(set(outcomes.values())) == 12
+    assert stored_names(app, table_id) == sorted(names)
+    assert sum(writer.batches) == 12
+    assert len(writer.batches) < 12
+
+def test_failed_submission_only_fails_itself(app, writer):
+    table_id = make_names_table(app)
+
+    outcomes = submit_all(app, writer, table_id, ['Ali', '', 'Sara'])
+
+    assert isinstance(outcomes[''], RecordValidationError)
+    assert isinstance(outcomes['Ali'], int) and isinstance(outcomes['Sara'], int)
+    assert stored_names(app, table_id) == ['Ali', 'Sara']
+
+def test_failed_commit_fails_the_whole_batch(app, writer, monkeypatch):
+    table_id = make_names_table(app)
+
+    def locked():
+        raise RuntimeError('database is locked')
+
+    monkeypatch.setattr(group_commit, 'begin_write_transaction', locked)
+    outcomes = submit_all(app, writer, table_id, ['Ali', 'Sara'])
+
+    assert all(isinstance(outcome, RuntimeError) for outcome in outcomes.values())
+    assert stored_names(app, table_id) == []
+
+def test_groups_have_their_own_writer(app, writer):
+    with tenant_context('alpha'):
+        table_id = make_table(('nom', 'text')).id
+        table = db.session.get(Table, table_id)
+        values, fields = form_data(table, nom='Alpha'), table.fields
+        db.session.remove()
+
+    alpha = writer.for_tenant('alpha')
+    record_id = alpha.submit(create_record, table_id, fields, values, 1)
+
+    assert alpha is not writer and writer.for_tenant('alpha') is alpha
+    with tenant_context('alpha'):
+        assert db.session.get(Record, record_id).table_id == table_id
+        db.session.remove()
+
+def test_api_creates_through_the_writer(app, client, writer, monkeypatch):
+    table_id = make_names_table(app)
+    monkeypatch.setitem(app.extensions, 'group_commit', writer)
+
+    response = client.post(f'/api/tables/{table_id}/records', json={'values': {'nom': 'Ali'}})
+
+    assert response.status_code == 201
+    assert writer.batches == [1]
+    assert stored_names(app, table_id) == ['Ali']
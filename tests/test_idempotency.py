@@ -0,0 +1,92 @@
+import threading
+
+from models import Record, TableField
+from conftest import make_table
+
+def make_payments_table(app):
+    with app.app_context():
+        table = make_table(('scout', 'text', {'required': True}), ('montant', 'number'), ('date_paiement', 'date'))
+        return table.id
+
+def count_records(app, table_id):
+    with app.app_context():
+        return Record.query.filter_by(table_id=table_id).count()
+
+def test_retry_returns_the_first_result(app, client):
+    table_id = make_payments_table(app)
+    body = {'values': {'scout': 'Ali', 'montant': 20, 'date_paiement': '2024-01-01'}}
+    headers = {'Idempotency-Key': 'retry-1'}
+
+    first = client.post(f'/api/tables/{table_id}/records', json=body, headers=headers)
+    retry = client.post(f'/api/tables/{table_id}/records', json=body, headers=headers)
+
+    assert first.status_code == 201
+    assert retry.status_code == 201
+    assert retry.get_json()['id'] == first.get_json()['id']
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert count_records(app, table_id) == 1
+
+def test_key_reused_for_other_data_is_refused(app, client):
+    table_id = make_payments_table(app)
+    headers = {'Idempotency-Key': 'reused-1'}
+
+    client.post(f'/api/tables/{table_id}/records', json={'values': {'scout': 'Ali'}}, headers=headers)
+    response = client.post(f'/api/tables/{table_id}/records', json={'values': {'scout': 'Sara'}}, headers=headers)
+
+    assert response.status_code == 422
+    assert count_records(app, table_id) == 1
+
+def test_invalid_values_are_rejected_and_not_stored(app, client):
+    table_id = make_payments_table(app)
+    headers = {'Idempotency-Key': 'invalid-1'}
+
+    number = client.post(f'/api/tables/{table_id}/records', json={'values': {'scout': 'Ali', 'montant': 'abc'}}, headers=headers)
+    retry = client.post(f'/api/tables/{table_id}/records', json={'values': {'scout': 'Ali', 'montant': 'abc'}}, headers=headers)
+    date = client.post(f'/api/tables/{table_id}/records/bulk', json={'records': [
+        {'values': {'scout': 'Ali', 'date_paiement': '2024-01-01'}},
+        {'values': {'scout': 'Sara', 'date_paiement': '01/01/2024'}},
+    ]})
+
+    assert number.status_code == 422
+    assert 'Montant' in number.get_json()['message']
+    assert retry.status_code == 422
+    assert date.status_code == 422
+    assert date.get_json()['message'].startswith('Ligne 2')
+    assert count_records(app, table_id) == 0
+
+def test_invalid_form_value_is_flashed(app, client):
+    table_id = make_payments_table(app)
+    with app.app_context():
+        fields = {field.name: field.id for field in TableField.query.filter_by(table_id=table_id)}
+
+    response = client.post(f'/tables/{table_id}/add', data={
+        f'field_{fields["scout"]}': 'Ali', f'field_{fields["montant"]}': 'abc', f'field_{fields["date_paiement"]}': ''
+    }, follow_redirects=True)
+
+    assert response.status_code == 200
+    assert 'doit être un nombre' in response.get_data(as_text=True)
+    assert count_records(app, table_id) == 0
+
+def test_concurrent_retries_create_one_record(app):
+    table_id = make_payments_table(app)
+    clients = [app.test_client() for _ in range(4)]
+    for client in clients:
+        client.post('/login', data={'username': 'admin', 'password': 'admin123', 'group': ''})
+    barrier = threading.Barrier(len(clients))
+    responses = []
+
+    def submit(client):
+        barrier.wait()
+        responses.append(client.post(
+            f'/api/tables/{table_id}/records', json={'values': {'scout': 'Ali'}}, headers={'Idempotency-Key': 'concurrent-1'}
+        ))
+
+    threads = [threading.Thread(target=submit, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [response.status_code for response in responses] == [201] * len(clients)
+    assert len({response.get_json()['id'] for response in responses}) == 1
+    assert count_records(app, table_id) == 1
@@ -0,0 +1,21 @@
+import pytest
+from flask import g
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from instrumentation import RequestMetrics
+
+def test_failed_queries_leave_nothing_on_the_connection(app):
+    with app.test_request_context():
+        g._request_metrics = metrics = RequestMetrics('tests')
+        with db.engine.connect() as connection:
+            for _ in range(3):
+                with pytest.raises(OperationalError):
+                    connection.execute(text('SELECT * FROM missing_table'))
+            connection.execute(text('SELECT 1'))
+            info = dict(connection.connection.info)
+
+        assert metrics.query_count == 1
+        assert metrics.db_time > 0
+        assert not any(key.startswith('_query') for key in info)
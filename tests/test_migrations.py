@@ -0,0 +1,136 @@
+import ast
+import importlib
+import json
+import os
+import threading
+import time
+from datetime import date
+
+import pytest
+from sqlalchemy import text
+
+import migrations
+from app import db
+from helpers import create_record
+from migrations import migration_states, run_migrations
+from models import Record, RecordUniqueKey, SchemaMigration, Table
+from print_assets import minify_css
+from tenants import current_engine, tenant_context
+from conftest import ROOT, form_data, make_table
+
+MIGRATION_FILES = sorted(
+    name for name in os.listdir(os.path.join(ROOT, 'migrations')) if name[:4].isdigit() and name.endswith('.py')
+)
+
+class Interrupted(Exception):
+    pass
+
+def imported_modules(name):
+    with open(os.path.join(ROOT, 'migrations', name)) as source:
+        tree = ast.parse(source.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            yield from (alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            yield node.module.split('.')[0]
+
+@pytest.mark.parametrize('name', MIGRATION_FILES)
+def test_migrations_only_import_the_standard_library_and_sqlalchemy(name):
+    assert set(imported_modules(name)) <= {'hashlib', 'json', 'logging', 're', 'sqlalchemy'}
+
+def test_copied_helpers_match_the_application():
+    added_columns = importlib.import_module('migrations.0003_added_columns')
+    unique_keys = importlib.import_module('migrations.0005_record_unique_keys')
+    css = '/* Titre */\nh1 , h2 > a:hover {\n  color : red ;\n  content: "a  ;  b";\n}\n'
+
+    assert added_columns.minify_css(css) == minify_css(css)
+    for field_type, value in [('text', 'Ali'), ('dropdown', 'Chèque'), ('number', 12.5), ('date', date(2024, 1, 31)), ('text', '')]:
+        columns = {'text': None, 'number': None, 'date': None}
+        columns[{'dropdown': 'text'}.get(field_type, field_type)] = value
+        assert unique_keys.value_key(field_type, *columns.values()) == RecordUniqueKey.make_key(field_type, *columns.values())
+
+def test_interrupted_backfill_resumes_after_its_checkpoint(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'MIGRATION_BATCH_SIZE', 2)
+    monkeypatch.setitem(app.config, 'MIGRATION_BATCH_PAUSE', 0)
+    with tenant_context('beta'):
+        table = make_table(('code', 'text', {'unique': True}))
+        field_id = table.fields[0].id
+        ids = [create_record(table.id, table.fields, form_data(table, code=f'C{number}'), 1) for number in range(7)]
+        # As before 0005: the unique values have no keys
+        RecordUniqueKey.query.filter_by(field_id=field_id).delete()
+        db.session.get(SchemaMigration, '0005').phase = 'expanded'
+        db.session.commit()
+
+        batches = []
+
+        def interrupt(seconds):
+            batches.append(seconds)
+            if len(batches) == 2:
+                raise Interrupted()
+
+        monkeypatch.setattr(migrations.time, 'sleep', interrupt)
+        with pytest.raises(Interrupted):
+            run_migrations()
+
+        state = migration_states()['0005']
+        assert state.phase == 'expanded'
+        assert json.loads(state.checkpoint)[f'field_{field_id}'] == ids[3]
+        assert RecordUniqueKey.query.filter_by(field_id=field_id).count() == 4
+
+        monkeypatch.undo()
+        assert run_migrations() == ['0005']
+        assert RecordUniqueKey.query.filter_by(field_id=field_id).count() == 7
+        db.session.remove()
+
+def test_records_rebuild_keeps_concurrent_writes(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'MIGRATION_BATCH_SIZE', 5)
+    with tenant_context('alpha'):
+        table = make_table(('nom', 'text'))
+        table_id = table.id
+        for number in range(20):
+            create_record(table.id, table.fields, form_data(table, nom=f'Scout {number}'), 1)
+        db.session.commit()
+        db.session.remove()
+        # As before 0006: ids may be reused
+        with current_engine().begin() as connection:
+            connection.exec_driver_sql(
+                'CREATE TABLE records_old (id INTEGER NOT NULL PRIMARY KEY, table_id INTEGER NOT NULL, '
+                'created_by INTEGER NOT NULL, created_at DATETIME, modified_at DATETIME, version INTEGER DEFAULT 1 NOT NULL)'
+            )
+            connection.exec_driver_sql('INSERT INTO records_old SELECT * FROM records')
+            connection.exec_driver_sql('DROP TABLE records')
+            connection.exec_driver_sql('ALTER TABLE records_old RENAME TO records')
+            connection.exec_driver_sql('CREATE INDEX ix_records_table_id ON records (table_id)')
+            connection.exec_driver_sql("UPDATE schema_migrations SET phase = 'pending' WHERE version = '0006'")
+
+    stop = threading.Event()
+    written = []
+
+    def writer():
+        with tenant_context('alpha'):
+            table = db.session.get(Table, table_id)
+            while not stop.is_set():
+                written.append(create_record(table_id, table.fields, form_data(table, nom='Pendant'), 1))
+                db.session.commit()
+                time.sleep(0.005)
+            db.session.remove()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        with tenant_context('alpha'):
+            assert run_migrations() == ['0006']
+            db.session.remove()
+    finally:
+        stop.set()
+        thread.join()
+
+    with tenant_context('alpha'):
+        with current_engine().connect() as connection:
+            sql = connection.execute(text("SELECT sql FROM sqlite_master WHERE name = 'records'")).scalar()
+        assert 'AUTOINCREMENT' in sql
+        assert written
+        stored = {record_id for record_id, in db.session.query(Record.id).filter_by(table_id=table_id)}
+        assert set(written) <= stored
+        assert len(stored) == 20 + len(written)
+        db.session.remove()
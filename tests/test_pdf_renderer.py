@@ -0,0 +1,168 @@
+import itertools
+import os
+import queue
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+from pdf_renderer import PdfRendererBusy, PdfRendererPool, PdfRendererUnavailable, RendererSlot, prewarm_pdf_renderer
+from conftest import make_table
+
+class FakeSlot:
+    """Renderer slot that renders without wkhtmltopdf, or fails as told"""
+
+    def __init__(self, error=None, restart_error=None):
+        self.error = error
+        self.restart_error = restart_error
+        self.jobs = 0
+        self.starts = 0
+
+    def is_healthy(self):
+        return True
+
+    def start(self):
+        if self.restart_error:
+            raise self.restart_error
+        self.starts += 1
+
+    def stop(self):
+        pass
+
+    def render(self, html):
+        self.jobs += 1
+        if self.error:
+            raise self.error
+        return b'%PDF ' + html.encode()
+
+def make_pool(*slots, timeout=1):
+    """Pool using the given slots, as if started in this process"""
+    pool = PdfRendererPool(size=len(slots), timeout=timeout)
+    pool._slots = queue.LifoQueue()
+    for slot in slots:
+        pool._slots.put(slot)
+    pool._all_slots = list(slots)
+    pool._pid = os.getpid()
+    return pool
+
+def test_render_on_a_free_slot():
+    pool = make_pool(FakeSlot())
+
+    assert pool.render('<p>Bonjour</p>') == b'%PDF <p>Bonjour</p>'
+    assert pool.get_stats()['jobs'] == 1
+    assert pool.get_stats()['free'] == 1
+
+def test_failed_render_restarts_the_slot_and_is_unavailable():
+    slot = FakeSlot(error=OSError('wkhtmltopdf exited with code 1'))
+    pool = make_pool(slot)
+
+    with pytest.raises(PdfRendererUnavailable) as raised:
+        pool.render('<p>Bonjour</p>')
+
+    assert isinstance(raised.value.__cause__, OSError)
+    assert slot.starts == 1
+    assert pool.get_stats()['failures'] == 1
+    assert pool.get_stats()['free'] == 1
+
+def test_failed_restart_keeps_the_render_error():
+    slot = FakeSlot(error=OSError('wkhtmltopdf exited with code 1'), restart_error=RuntimeError('Xvfb'))
+    pool = make_pool(slot)
+
+    with pytest.raises(PdfRendererUnavailable) as raised:
+        pool.render('<p>Bonjour</p>')
+
+    assert str(raised.value.__cause__) == 'wkhtmltopdf exited with code 1'
+    assert pool.get_stats()['free'] == 1
+
+def test_busy_when_no_slot_frees_up():
+    pool = make_pool(FakeSlot(), timeout=0.05)
+    slot = pool._slots.get()
+    try:
+        with pytest.raises(PdfRendererBusy):
+            pool.render('<p>Bonjour</p>')
+    finally:
+        pool._slots.put(slot)
+
+def test_concurrent_jobs_share_the_slots():
+    pool = make_pool(FakeSlot(), FakeSlot())
+    results = []
+
+    def render(number):
+        results.append(pool.render(f'<p>{number}</p>'))
+
+    threads = [threading.Thread(target=render, args=(number,)) for number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == sorted(f'%PDF <p>{number}</p>'.encode() for number in range(8))
+    assert pool.get_stats()['free'] == 2
+
+def test_print_page_answers_503_when_rendering_fails(app, client, monkeypatch):
+    with app.app_context():
+        table_id = make_table(('nom', 'text')).id
+    monkeypatch.setitem(app.extensions, 'pdf_renderer', make_pool(FakeSlot(error=OSError('wkhtmltopdf exited with code 1'))))
+
+    response = client.get(f'/tables/{table_id}/records/pdf?format=pdf')
+
+    assert response.status_code == 503
+
+class FakeXvfb:
+    """Display that, like xvfbwrapper, exports and removes DISPLAY for the whole process"""
+
+    displays = itertools.count(100)
+
+    def __init__(self, width, height):
+        self.orig_display = os.environ.get('DISPLAY')
+        self.new_display = None
+        self.proc = None
+
+    def start(self):
+        self.new_display = next(self.displays)
+        os.environ['DISPLAY'] = f':{self.new_display}'
+        # Waiting for the display to accept connections
+        time.sleep(0.001)
+
+    def stop(self):
+        del os.environ['DISPLAY']
+        time.sleep(0.001)
+        if self.orig_display is not None:
+            os.environ['DISPLAY'] = self.orig_display
+
+@pytest.fixture
+def fake_xvfb(monkeypatch):
+    monkeypatch.delenv('DISPLAY', raising=False)
+    monkeypatch.setitem(sys.modules, 'xvfbwrapper', types.SimpleNamespace(Xvfb=FakeXvfb))
+    monkeypatch.setitem(sys.modules, 'pdfkit', types.SimpleNamespace(configuration=lambda wkhtmltopdf, environ: environ))
+
+def test_concurrent_slot_restarts_leave_display_unchanged(fake_xvfb):
+    slots = [RendererSlot('/usr/bin/wkhtmltopdf', use_xvfb=True) for _ in range(4)]
+
+    def restart(slot):
+        for _ in range(20):
+            slot.start()
+            assert slot.configuration['DISPLAY'] == f':{slot.xvfb.new_display}'
+            slot.stop()
+
+    threads = [threading.Thread(target=restart, args=(slot,)) for slot in slots]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert 'DISPLAY' not in os.environ
+
+def test_renderers_are_prewarmed_by_default(app, monkeypatch):
+    started = []
+    monkeypatch.setitem(app.extensions, 'pdf_renderer', types.SimpleNamespace(start=lambda: started.append(True)))
+
+    assert app.config['PDF_RENDERER_PREWARM'] is True
+    prewarm_pdf_renderer(app)
+    assert started == [True]
+
+    monkeypatch.setitem(app.config, 'PDF_RENDERER_PREWARM', False)
+    prewarm_pdf_renderer(app)
+    assert started == [True]
@@ -0,0 +1,70 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import print_assets
+from print_assets import PrintAssetError, fetch_logo
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+
+class LogoServer(BaseHTTPRequestHandler):
+    """Serves a PNG at /logo.png, a large file at /large, and redirects /redirect?to=<url>"""
+
+    def do_GET(self):
+        if self.path.startswith('/redirect?to='):
+            self.send_response(302)
+            self.send_header('Location', self.path.split('=', 1)[1])
+            self.end_headers()
+            return
+        body = PNG if self.path == '/logo.png' else b'\x00' * (3 * 1024 * 1024)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture(scope='module')
+def server():
+    httpd = HTTPServer(('127.0.0.1', 0), LogoServer)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}'
+    httpd.shutdown()
+
+@pytest.fixture
+def loopback_allowed(monkeypatch):
+    """Let the test server stand for a public host"""
+    monkeypatch.setattr(print_assets, '_is_public_address', lambda address: address == '127.0.0.1')
+
+@pytest.mark.parametrize('url', ['file:///etc/passwd', 'ftp://example.com/logo.png', 'http:///logo.png', 'javascript:alert(1)'])
+def test_only_http_urls_are_fetched(app_ctx, url):
+    with pytest.raises(PrintAssetError, match='http'):
+        fetch_logo(url)
+
+def test_internal_addresses_are_refused(app_ctx, server):
+    for url in (f'{server}/logo.png', 'http://localhost/logo.png', 'http://10.0.0.1/logo.png', 'http://[::1]/logo.png',
+                'http://169.254.169.254/latest/meta-data'):
+        with pytest.raises(PrintAssetError, match='adresse publique'):
+            fetch_logo(url)
+
+def test_public_logo_is_stored(app_ctx, server, loopback_allowed):
+    filename = fetch_logo(f'{server}/logo.png')
+
+    assert filename.endswith('.png')
+
+def test_large_download_is_refused(app_ctx, server, loopback_allowed):
+    with pytest.raises(PrintAssetError, match='trop volumineux'):
+        fetch_logo(f'{server}/large')
+
+def test_redirects_are_checked(app_ctx, server, loopback_allowed):
+    with pytest.raises(PrintAssetError, match='not allowed'):
+        fetch_logo(f'{server}/redirect?to=file:///etc/passwd')
+    with pytest.raises(PrintAssetError, match='http'):
+        fetch_logo(f'{server}/redirect?to=ftp://example.com/logo.png')
+    with pytest.raises(PrintAssetError, match='adresse publique'):
+        fetch_logo(f'{server}/redirect?to=http://127.0.0.2/logo.png')
+    assert fetch_logo(f'{server}/redirect?to={server}/logo.png').endswith('.png')
@@ -0,0 +1,34 @@
+from app import db
+from models import GenericText, PrintTemplate
+from print_cache import forget_generic_texts, forget_print_template, get_default_print_template, get_generic_text
+
+def test_saving_a_text_keeps_the_template_cached(app_ctx):
+    db.session.add(GenericText(name='cache_texte', content='Avant'))
+    db.session.commit()
+    header = get_default_print_template().header_html
+    assert get_generic_text('cache_texte').content == 'Avant'
+
+    GenericText.query.filter_by(name='cache_texte').one().content = 'Après'
+    template = PrintTemplate.query.filter_by(is_default=True).one()
+    template.header_html = '<h1>Modifié</h1>'
+    db.session.commit()
+    assert get_generic_text('cache_texte').content == 'Avant'
+
+    forget_generic_texts()
+    assert get_generic_text('cache_texte').content == 'Après'
+    assert get_default_print_template().header_html == header
+
+    forget_print_template()
+    assert get_default_print_template().header_html == '<h1>Modifié</h1>'
+    template.header_html = header
+    db.session.commit()
+    forget_print_template()
+
+def test_saved_text_is_served_at_once(app, client):
+    client.post('/manage_generic_text/cache_route', data={'content': 'Première'})
+    first = client.get('/api/generic_text/cache_route')
+    client.post('/manage_generic_text/cache_route', data={'content': 'Seconde'})
+    second = client.get('/api/generic_text/cache_route')
+
+    assert first.get_json()['content'] == 'Première'
+    assert second.get_json()['content'] == 'Seconde'
@@ -0,0 +1,268 @@
+"""
+Query budgets of the routes, see instrumentation.py
+
+The test app runs in strict mode: a request running more queries than the
+budget of its endpoint raises QueryBudgetExceeded. Every route is requested
+here against a table with several fields, records, a read-only user and a
+scheduled report.
+"""
+import logging
+
+import pytest
+
+from app import db
+from helpers import create_record
+from instrumentation import QueryBudgetExceeded, get_endpoint_stats, reset_endpoint_stats
+from models import PrintTemplate, ReportTemplate, ScheduledReport, TableField, TablePermission, User, ROLE_READONLY
+from conftest import form_data, make_table
+
+RECORDS = 25
+
+@pytest.fixture(scope='module')
+def ids(app):
+    """IDs of the objects the routes are requested with; delete_* routes get their own"""
+    with app.app_context():
+        table = make_table(
+            ('nom', 'text', {'required': True}), ('totem', 'text', {'unique': True}), ('age', 'number'),
+            ('naissance', 'date'), ('unite', 'dropdown', {'options': '["Louveteaux", "Éclaireurs"]'})
+        )
+        fields = [field.id for field in table.fields]
+        records = [
+            create_record(table.id, table.fields, form_data(
+                table, nom=f'Scout {number}', totem=f'Totem {number}', age=str(number), naissance='2010-01-31',
+                unite='Louveteaux'
+            ), 1)
+            for number in range(RECORDS)
+        ]
+        readonly = User(username=f'lecteur_{table.id}', email=f'lecteur_{table.id}@example.com', role=ROLE_READONLY)
+        readonly.set_password('lecteur123')
+        disposable_user = User(username=f'jetable_{table.id}', email=f'jetable_{table.id}@example.com', role=ROLE_READONLY)
+        disposable_user.set_password('jetable123')
+        holder = User(username=f'titulaire_{table.id}', email=f'titulaire_{table.id}@example.com', role=ROLE_READONLY)
+        holder.set_password('titulaire123')
+        db.session.add_all([readonly, disposable_user, holder])
+        db.session.flush()
+        permission = TablePermission(user_id=readonly.id, table_id=table.id, field_id=table.fields[4].id, match_value='Louveteaux')
+        disposable_permission = TablePermission(user_id=holder.id, table_id=table.id, all_access=True)
+        report = ReportTemplate(name=f'Rapport {table.id}', template_html='{% for record in records %}{{ record.nom }}{% endfor %}')
+        report.set_fields([field.id for field in table.fields])
+        report.schedule = ScheduledReport(frequency='weekly')
+        disposable_report = ReportTemplate(name=f'Jetable {table.id}', template_html='')
+        db.session.add_all([permission, disposable_permission, report, disposable_report])
+        db.session.commit()
+
+        disposable_table = make_table(('nom', 'text'))
+        create_record(disposable_table.id, disposable_table.fields, form_data(disposable_table, nom='Jetable'), 1)
+        disposable_field = TableField(table_id=table.id, name='jetable', display_name='Jetable', field_type='text', order=9)
+        db.session.add(disposable_field)
+        db.session.commit()
+
+        return {
+            'table': table.id,
+            'fields': fields,
+            'record': records[0],
+            'disposable_record': records[-1],
+            'readonly': readonly.id,
+            'disposable_user': disposable_user.id,
+            'holder': holder.id,
+            'permission': disposable_permission.id,
+            'report': report.id,
+            'disposable_report': disposable_report.id,
+            'disposable_table': disposable_table.id,
+            'disposable_field': disposable_field.id,
+            'print_template': PrintTemplate.query.first().id,
+        }
+
+def record_form(ids, number):
+    nom, totem, age, naissance, unite = ids['fields']
+    return {
+        f'field_{nom}': f'Nouveau {number}', f'field_{totem}': f'Nouveau totem {number}', f'field_{age}': '12',
+        f'field_{naissance}': '2012-05-01', f'field_{unite}': 'Éclaireurs'
+    }
+
+def api_values(number):
+    return {'nom': f'API {number}', 'totem': f'API totem {number}', 'age': 11, 'naissance': '2013-02-03', 'unite': 'Louveteaux'}
+
+# (endpoint, method, URL, request arguments), built from the ids fixture
+REQUESTS = [
+    ('index', 'GET', lambda ids: '/', None),
+    ('register', 'GET', lambda ids: '/register', None),
+    ('settings', 'GET', lambda ids: '/settings', None),
+    ('change_password', 'POST', lambda ids: '/change_password', lambda ids: {'data': {
+        'current_password': 'faux', 'new_password': 'Scouts!2026x', 'confirm_password': 'Scouts!2026x'
+    }}),
+    ('dashboard', 'GET', lambda ids: '/dashboard', None),
+    ('tables', 'GET', lambda ids: '/tables', None),
+    ('export_table_pdf', 'GET', lambda ids: f'/tables/{ids["table"]}/records/pdf', None),
+    ('table_records', 'GET', lambda ids: f'/tables/{ids["table"]}/records', None),
+    ('table_rows', 'GET', lambda ids: f'/api/tables/{ids["table"]}/rows?q=scout&sort=age', None),
+    ('table_changes', 'GET', lambda ids: f'/api/tables/{ids["table"]}/changes', None),
+    ('aggregate_table_records', 'GET', lambda ids: f'/api/tables/{ids["table"]}/aggregate?group_by=unite&metric=avg:age', None),
+    ('table_analytics_data', 'GET', lambda ids: f'/api/tables/{ids["table"]}/analytics', None),
+    ('print_record', 'GET', lambda ids: f'/tables/{ids["table"]}/records/{ids["record"]}/pdf', None),
+    ('view_record', 'GET', lambda ids: f'/tables/{ids["table"]}/records/{ids["record"]}', None),
+    ('add_record', 'GET', lambda ids: '/add_record', None),
+    ('add_table_record', 'GET', lambda ids: f'/tables/{ids["table"]}/add', None),
+    ('add_table_record', 'POST', lambda ids: f'/tables/{ids["table"]}/add', lambda ids: {'data': record_form(ids, 1)}),
+    ('api_create_record', 'POST', lambda ids: f'/api/tables/{ids["table"]}/records', lambda ids: {
+        'json': {'values': api_values(1)}
+    }),
+    ('edit_record', 'GET', lambda ids: f'/tables/{ids["table"]}/records/{ids["record"]}/edit', None),
+    ('edit_record', 'POST', lambda ids: f'/tables/{ids["table"]}/records/{ids["record"]}/edit', lambda ids: {
+        'data': {**record_form(ids, 2), 'version': '1'}
+    }),
+    ('delete_record', 'POST', lambda ids: f'/tables/{ids["table"]}/records/{ids["disposable_record"]}/delete', None),
+    ('manage_users', 'GET', lambda ids: '/manage_users', None),
+    ('add_user', 'POST', lambda ids: '/manage_users/add', lambda ids: {'data': {
+        'username': f'nouveau_{ids["table"]}', 'email': f'nouveau_{ids["table"]}@example.com', 'role': 'editor',
+        'password': 'Scouts!2026x', 'password2': 'Scouts!2026x'
+    }}),
+    ('edit_user', 'GET', lambda ids: f'/manage_users/{ids["readonly"]}/edit', None),
+    ('edit_user', 'POST', lambda ids: f'/manage_users/{ids["readonly"]}/edit', lambda ids: {'data': {
+        'username': f'lecteur_{ids["table"]}', 'email': f'lecteur_{ids["table"]}@example.com', 'role': 'readonly'
+    }}),
+    ('delete_user', 'POST', lambda ids: f'/manage_users/{ids["disposable_user"]}/delete', None),
+    ('manage_tables', 'GET', lambda ids: '/manage_tables', None),
+    ('add_table', 'POST', lambda ids: '/manage_tables/add', lambda ids: {'data': {
+        'name': f'ajoutee_{ids["table"]}', 'display_name': 'Ajoutée'
+    }}),
+    ('edit_table', 'GET', lambda ids: f'/manage_tables/{ids["table"]}/edit', None),
+    ('edit_table', 'POST', lambda ids: f'/manage_tables/{ids["table"]}/edit', lambda ids: {'data': {
+        'name': f'test_{ids["table"]}', 'display_name': 'Test', 'description': 'Modifiée'
+    }}),
+    ('delete_table', 'POST', lambda ids: f'/manage_tables/{ids["disposable_table"]}/delete', None),
+    ('manage_fields', 'GET', lambda ids: f'/manage_tables/{ids["table"]}/fields', None),
+    ('add_field', 'POST', lambda ids: f'/manage_tables/{ids["table"]}/fields/add', lambda ids: {'data': {
+        'name': 'ajoute', 'display_name': 'Ajouté', 'field_type': 'text'
+    }}),
+    ('edit_field', 'GET', lambda ids: f'/manage_tables/{ids["table"]}/fields/{ids["fields"][1]}/edit', None),
+    ('edit_field', 'POST', lambda ids: f'/manage_tables/{ids["table"]}/fields/{ids["fields"][1]}/edit', lambda ids: {'data': {
+        'name': 'totem', 'display_name': 'Totem', 'field_type': 'text', 'unique': 'y'
+    }}),
+    ('delete_field', 'POST', lambda ids: f'/manage_tables/{ids["table"]}/fields/{ids["disposable_field"]}/delete', None),
+    ('reorder_fields', 'POST', lambda ids: f'/manage_tables/{ids["table"]}/fields/order', lambda ids: {
+        'json': {'fields': {str(field_id): order for order, field_id in enumerate(ids['fields'], start=1)}}
+    }),
+    ('request_metrics', 'GET', lambda ids: '/admin/metrics', None),
+    ('tenants_overview', 'GET', lambda ids: '/admin/tenants', None),
+    ('aggregate_tenant_records', 'GET', lambda ids: '/api/tenants/aggregate?table=inconnue', None),
+    ('manage_print_templates', 'GET', lambda ids: '/manage_print_templates', None),
+    ('print_generic_text', 'GET', lambda ids: '/print/generic_text/autorisation_camp', None),
+    ('get_active_template', 'GET', lambda ids: '/api/print_template/active', None),
+    ('update_print_template', 'POST', lambda ids: f'/manage_print_templates/{ids["print_template"]}', lambda ids: {'data': {
+        'header_html': '<h1>Scouts</h1>', 'footer_html': '', 'css': 'h1 { color: green; }'
+    }}),
+    ('reports', 'GET', lambda ids: '/reports', None),
+    ('view_report', 'GET', lambda ids: f'/reports/{ids["report"]}', None),
+    ('manage_reports', 'GET', lambda ids: f'/manage_reports?edit={ids["report"]}', None),
+    ('manage_reports', 'POST', lambda ids: '/manage_reports', lambda ids: {'data': {
+        'name': f'Nouveau {ids["table"]}', 'template_html': '<p></p>', 'fields': [str(ids['fields'][0])], 'frequency': 'daily'
+    }}),
+    ('update_report_template', 'POST', lambda ids: f'/manage_reports/{ids["report"]}', lambda ids: {'data': {
+        'name': f'Rapport {ids["table"]}', 'template_html': '{{ records|length }}',
+        'fields': [str(field_id) for field_id in ids['fields']], 'frequency': 'weekly'
+    }}),
+    ('delete_report_template', 'POST', lambda ids: f'/manage_reports/{ids["disposable_report"]}/delete', None),
+    ('manage_table_permissions', 'GET', lambda ids: f'/manage_table_permissions/{ids["table"]}', None),
+    ('manage_table_permissions', 'POST', lambda ids: f'/manage_table_permissions/{ids["table"]}', lambda ids: {'data': {
+        'user_id': str(ids['readonly']), 'permission_type': 'specific', 'field_id': str(ids['fields'][4]), 'match_value': 'Éclaireurs'
+    }}),
+    ('delete_table_permission', 'POST', lambda ids: f'/manage_table_permissions/{ids["table"]}/delete/{ids["permission"]}', None),
+    ('bulk_grant_permissions', 'POST', lambda ids: f'/manage_table_permissions/{ids["table"]}/bulk_grant', lambda ids: {'data': {
+        'user_id': str(ids['holder'])
+    }}),
+    ('manage_generic_text', 'GET', lambda ids: '/manage_generic_text/autorisation_camp', None),
+    ('manage_generic_text', 'POST', lambda ids: '/manage_generic_text/autorisation_camp', lambda ids: {'data': {'content': 'Autorisation'}}),
+    ('get_generic_text_content', 'GET', lambda ids: '/api/generic_text/autorisation_camp', None),
+    ('export_table', 'GET', lambda ids: f'/tables/{ids["table"]}/export', None),
+    ('export_table', 'POST', lambda ids: f'/tables/{ids["table"]}/export', lambda ids: {'data': {
+        'fields': [str(field_id) for field_id in ids['fields']], f'filter_{ids["fields"][4]}': 'Louveteaux'
+    }}),
+    ('table_archive', 'GET', lambda ids: f'/tables/{ids["table"]}/archive', None),
+    ('export_table_archive', 'GET', lambda ids: f'/tables/{ids["table"]}/archive/export', None),
+    ('logout', 'GET', lambda ids: '/logout', None),
+]
+
+def request_route(client, method, url, arguments):
+    response = client.open(url, method=method, **(arguments or {}))
+    # Streamed bodies count their queries until they are closed
+    response.get_data()
+    response.close()
+    return response
+
+@pytest.mark.parametrize('endpoint, method, url, arguments', REQUESTS, ids=[f'{method} {endpoint}' for endpoint, method, _, _ in REQUESTS])
+def test_routes_stay_within_their_budget(app, client, ids, endpoint, method, url, arguments):
+    reset_endpoint_stats()
+
+    response = request_route(client, method, url(ids), arguments and arguments(ids))
+
+    assert response.status_code < 500
+    budget = app.config['QUERY_BUDGETS'][endpoint]
+    assert budget is None or get_endpoint_stats()[endpoint]['max_queries'] <= budget
+
+@pytest.mark.parametrize('endpoint, url', [
+    ('table_records', lambda ids: f'/tables/{ids["table"]}/records'),
+    ('table_rows', lambda ids: f'/api/tables/{ids["table"]}/rows'),
+    ('export_table_pdf', lambda ids: f'/tables/{ids["table"]}/records/pdf'),
+    ('dashboard', lambda ids: '/dashboard'),
+    ('view_report', lambda ids: f'/reports/{ids["report"]}'),
+])
+def test_read_only_users_stay_within_the_budget(app, ids, endpoint, url):
+    client = app.test_client()
+    client.post('/login', data={'username': f'lecteur_{ids["table"]}', 'password': 'lecteur123', 'group': ''})
+    reset_endpoint_stats()
+
+    response = request_route(client, 'GET', url(ids), None)
+
+    assert response.status_code == 200
+    assert get_endpoint_stats()[endpoint]['requests'] == 1
+
+def test_every_route_has_a_budget(app):
+    budgets = app.config['QUERY_BUDGETS']
+    endpoints = {rule.endpoint for rule in app.url_map.iter_rules()}
+
+    assert sorted(endpoints - set(budgets)) == []
+    # Logins are checked by the client fixture
+    assert {endpoint for endpoint, _, _, _ in REQUESTS} >= endpoints - {'login', 'static', 'print_asset', 'api_create_records'}
+
+def test_exceeding_a_budget_fails_in_strict_mode(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'QUERY_BUDGETS', {**app.config['QUERY_BUDGETS'], 'tables': 0})
+
+    with pytest.raises(QueryBudgetExceeded, match=r'tables ran \d+ queries \(budget 0\)'):
+        client.get('/tables')
+
+def test_exceeding_a_budget_is_logged_otherwise(app, client, monkeypatch, caplog):
+    monkeypatch.setitem(app.config, 'QUERY_BUDGETS', {**app.config['QUERY_BUDGETS'], 'tables': 0})
+    monkeypatch.setitem(app.config, 'QUERY_BUDGET_STRICT', False)
+
+    with caplog.at_level(logging.WARNING, logger='instrumentation'):
+        assert client.get('/tables').status_code == 200
+
+    assert 'Query budget exceeded: tables ran' in caplog.text
+
+def test_streamed_responses_are_checked(app, client, ids, monkeypatch):
+    monkeypatch.setitem(app.config, 'QUERY_BUDGETS', {**app.config['QUERY_BUDGETS'], 'table_records': 1})
+
+    with pytest.raises(QueryBudgetExceeded, match='table_records'):
+        request_route(client, 'GET', f'/tables/{ids["table"]}/records', None)
+
+def test_server_timing_header(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'SERVER_TIMING_HEADER', True)
+
+    header = client.get('/tables').headers['Server-Timing']
+
+    db_entry, render, total = header.split(', ')
+    assert db_entry.startswith('db;dur=') and db_entry.endswith(' queries"')
+    assert render.startswith('render;dur=') and total.startswith('total;dur=')
+
+def test_endpoint_stats(app, client):
+    reset_endpoint_stats()
+    for _ in range(3):
+        client.get('/tables')
+
+    stats = get_endpoint_stats()['tables']
+
+    assert stats['requests'] == 3
+    assert 0 < stats['max_queries'] <= app.config['QUERY_BUDGETS']['tables']
+    assert stats['avg_queries'] == stats['queries'] / 3
+    assert client.get('/admin/metrics').get_json()['endpoints']['tables']['requests'] == 3
@@ -0,0 +1,31 @@
+import pytest
+
+from app import db
+from helpers import create_record
+from conftest import form_data, make_table
+
+NAMES = ['a_b', 'axb', '100%', '100 pour cent', 'c:\\scouts', 'plain']
+
+@pytest.fixture(scope='module')
+def table_id(app):
+    with app.app_context():
+        table = make_table(('nom', 'text'))
+        for name in NAMES:
+            create_record(table.id, table.fields, form_data(table, nom=name), 1)
+        db.session.commit()
+        return table.id
+
+@pytest.mark.parametrize('text, expected', [
+    ('_', ['a_b']),
+    ('%', ['100%']),
+    ('a', ['a_b', 'axb', 'plain']),
+    ('\\', ['c:\\scouts']),
+    ('100', ['100%', '100 pour cent']),
+])
+def test_filters_match_wildcards_literally(client, table_id, text, expected):
+    by_filter = client.get(f'/api/tables/{table_id}/rows', query_string={'filter_nom': text}).get_json()
+    by_search = client.get(f'/api/tables/{table_id}/rows', query_string={'q': text}).get_json()
+
+    assert sorted(row['nom'] for row in by_filter['rows']) == sorted(expected)
+    assert by_filter['total'] == len(expected)
+    assert sorted(row['nom'] for row in by_search['rows']) == sorted(expected)
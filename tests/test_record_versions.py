@@ -0,0 +1,108 @@
+import threading
+
+from app import db
+from helpers import claim_record_version, create_record
+from models import Record
+from conftest import form_data, make_table
+
+def make_record(app):
+    with app.app_context():
+        table = make_table(('nom', 'text'))
+        field_id = table.fields[0].id
+        record_id = create_record(table.id, table.fields, form_data(table, nom='Avant'), 1)
+        db.session.commit()
+        return table.id, field_id, record_id
+
+def record_state(app, record_id):
+    with app.app_context():
+        record = db.session.get(Record, record_id)
+        return record.version, record.values[0].text_value
+
+def edit(client, table_id, field_id, record_id, value, version=None):
+    data = {f'field_{field_id}': value}
+    if version is not None:
+        data['version'] = version
+    return client.post(f'/tables/{table_id}/records/{record_id}/edit', data=data, follow_redirects=True)
+
+def test_edit_with_the_current_version_is_saved(app, client):
+    table_id, field_id, record_id = make_record(app)
+
+    edit(client, table_id, field_id, record_id, 'Après', version=1)
+
+    assert record_state(app, record_id) == (2, 'Après')
+
+def test_edit_of_a_stale_version_is_rejected(app, client):
+    table_id, field_id, record_id = make_record(app)
+    edit(client, table_id, field_id, record_id, 'Premier', version=1)
+
+    response = edit(client, table_id, field_id, record_id, 'Second', version=1)
+
+    assert 'modifié par un autre utilisateur' in response.get_data(as_text=True)
+    assert record_state(app, record_id) == (2, 'Premier')
+
+def test_edit_without_a_version_is_rejected(app, client):
+    table_id, field_id, record_id = make_record(app)
+
+    response = edit(client, table_id, field_id, record_id, 'Sans version')
+
+    assert 'modifié par un autre utilisateur' in response.get_data(as_text=True)
+    assert record_state(app, record_id) == (1, 'Avant')
+
+def test_edit_with_an_invalid_value_changes_nothing(app, client):
+    with app.app_context():
+        table = make_table(('nom', 'text'), ('age', 'number'))
+        table_id, (nom, age) = table.id, [field.id for field in table.fields]
+        record_id = create_record(table_id, table.fields, form_data(table, nom='Avant', age='10'), 1)
+        db.session.commit()
+
+    response = client.post(f'/tables/{table_id}/records/{record_id}/edit', data={
+        f'field_{nom}': 'Après', f'field_{age}': 'dix', 'version': 1
+    }, follow_redirects=True)
+
+    assert 'Le champ &#34;Age&#34; doit être un nombre.' in response.get_data(as_text=True)
+    assert record_state(app, record_id) == (1, 'Avant')
+
+def test_concurrent_edits_through_the_form_save_one(app):
+    table_id, field_id, record_id = make_record(app)
+    clients = []
+    for _ in range(3):
+        client = app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'admin123', 'group': ''})
+        clients.append(client)
+    barrier = threading.Barrier(len(clients))
+    saved = []
+
+    def submit(number, client):
+        barrier.wait()
+        response = edit(client, table_id, field_id, record_id, f'Édition {number}', version=1)
+        if 'Enregistrement mis à jour avec succès.' in response.get_data(as_text=True):
+            saved.append(f'Édition {number}')
+
+    threads = [threading.Thread(target=submit, args=(number, client)) for number, client in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(saved) == 1
+    assert record_state(app, record_id) == (2, saved[0])
+
+def test_concurrent_edits_of_one_version_let_one_through(app):
+    _, _, record_id = make_record(app)
+    barrier = threading.Barrier(4)
+    claimed = []
+
+    def claim():
+        with app.app_context():
+            barrier.wait()
+            claimed.append(claim_record_version(record_id, 1))
+            db.session.commit()
+
+    threads = [threading.Thread(target=claim) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == [False, False, False, True]
+    assert record_state(app, record_id)[0] == 2
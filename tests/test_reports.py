@@ -0,0 +1,91 @@
+import reports
+from app import db
+from helpers import create_record
+from models import ReportTemplate, TableField, ScheduledReport
+from reports import ReportRecords, generate_report, get_fresh_snapshot, load_report_data, precompute_reports
+from conftest import form_data, make_table
+
+def make_report(table, template_html):
+    report = ReportTemplate(name=table.name, template_html=template_html)
+    report.set_fields([field.id for field in table.fields])
+    db.session.add(report)
+    db.session.commit()
+    return report
+
+def test_report_records_are_read_in_batches(admin, monkeypatch):
+    monkeypatch.setattr(reports, 'REPORT_BATCH_SIZE', 3)
+    table = make_table(('nom', 'text'), ('montant', 'number'))
+    for number in range(10):
+        create_record(table.id, table.fields, form_data(table, nom=f'Scout {number}', montant=str(number)), admin.id)
+    db.session.commit()
+
+    context = load_report_data(make_report(table, ''))
+    records = context['tables'][table.name]['records']
+
+    assert isinstance(records, ReportRecords)
+    assert [(record['nom'], record['montant']) for record in records] == [(f'Scout {number}', number) for number in range(10)]
+    assert len(records) == 10
+    # Each loop reads the records again
+    assert len(list(records)) == 10
+
+def test_report_renders_lengths_and_loops(admin):
+    table = make_table(('nom', 'text'))
+    for name in ('Ali', 'Sara'):
+        create_record(table.id, table.fields, form_data(table, nom=name), admin.id)
+    db.session.commit()
+    report = make_report(
+        table, '{{ records|length }}:{% for record in records %}{{ record.nom }},{% endfor %}'
+               '{% for record in tables.' + table.name + '.records %}{{ record.nom }};{% endfor %}'
+    )
+
+    assert ''.join(generate_report(report)) == '2:Ali,Sara,Ali;Sara;'
+
+def test_saving_a_report_with_invalid_fields_is_refused(app, client):
+    with app.app_context():
+        field_id = make_table(('nom', 'text')).fields[0].id
+        reports_before = ReportTemplate.query.count()
+
+    for fields in (['abc'], [''], [str(field_id), '999999']):
+        response = client.post('/manage_reports', data={
+            'name': 'Rapport', 'template_html': '<p>{{ report.name }}</p>', 'fields': fields
+        }, follow_redirects=True)
+        assert response.status_code == 200
+        assert 'Les champs sélectionnés pour le rapport sont invalides.' in response.get_data(as_text=True)
+
+    response = client.post('/manage_reports', data={
+        'name': 'Rapport', 'template_html': '<p>{{ report.name }}</p>', 'fields': [str(field_id)]
+    })
+    assert response.status_code == 302
+    with app.app_context():
+        assert ReportTemplate.query.count() == reports_before + 1
+
+def test_precomputed_report_is_stale_once_its_records_change(admin):
+    table = make_table(('nom', 'text'))
+    create_record(table.id, table.fields, form_data(table, nom='Ali'), admin.id)
+    db.session.commit()
+    report = make_report(table, '{% for record in records %}{{ record.nom }},{% endfor %}')
+    report.schedule = ScheduledReport(frequency='monthly')
+    db.session.commit()
+
+    precompute_reports()
+    assert get_fresh_snapshot(report).content == 'Ali,'
+
+    create_record(table.id, table.fields, form_data(table, nom='Sara'), admin.id)
+    db.session.commit()
+    assert get_fresh_snapshot(report) is None
+
+    precompute_reports()
+    assert get_fresh_snapshot(report).content == 'Ali,Sara,'
+
+def test_records_without_values_are_reported(admin):
+    table = make_table(('nom', 'text'))
+    for name in ('Ali', 'Sara'):
+        create_record(table.id, table.fields, form_data(table, nom=name), admin.id)
+    # Added after the records: they have no value for it
+    totem = TableField(table_id=table.id, name='totem', display_name='Totem', field_type='text', order=2)
+    db.session.add(totem)
+    db.session.commit()
+    report = make_report(table, '{{ records|length }}:{% for record in records %}{{ record.totem }},{% endfor %}')
+    report.set_fields([totem.id])
+
+    assert ''.join(generate_report(report)) == '2:,,'
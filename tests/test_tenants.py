@@ -0,0 +1,91 @@
+import threading
+
+import pytest
+
+from app import db
+from cache import cache
+from helpers import create_record
+from models import Record, RecordValue
+from routing import current_tenant
+from tenants import map_tenants, tenant_context
+from conftest import form_data, make_table
+
+def login(app, group):
+    client = app.test_client()
+    response = client.post('/login', data={'username': 'admin', 'password': 'admin123', 'group': group})
+    assert response.status_code == 302
+    return client
+
+def test_records_stay_in_their_group(app):
+    with tenant_context('alpha'):
+        table = make_table(('nom', 'text'))
+        table_id = table.id
+        create_record(table_id, table.fields, form_data(table, nom='Seulement alpha'), 1)
+        db.session.commit()
+        db.session.remove()
+
+    for tenant in ('beta', None):
+        with tenant_context(tenant):
+            assert RecordValue.query.filter_by(text_value='Seulement alpha').count() == 0
+            db.session.remove()
+
+    with tenant_context('alpha'):
+        assert Record.query.filter_by(table_id=table_id).count() == 1
+        db.session.remove()
+
+def test_requests_use_the_group_chosen_at_login(app):
+    with tenant_context('alpha'):
+        table = make_table(('nom', 'text'))
+        table_id = table.id
+        create_record(table_id, table.fields, form_data(table, nom='Rangée alpha'), 1)
+        db.session.commit()
+        db.session.remove()
+
+    alpha = login(app, 'alpha').get(f'/api/tables/{table_id}/rows')
+    assert [row['nom'] for row in alpha.get_json()['rows']] == ['Rangée alpha']
+    for group in ('beta', ''):
+        response = login(app, group).get(f'/api/tables/{table_id}/rows')
+        rows = response.get_json()['rows'] if response.is_json else []
+        assert 'Rangée alpha' not in [row.get('nom') for row in rows]
+
+def test_unknown_group_cannot_log_in(app):
+    response = app.test_client().post('/login', data={'username': 'admin', 'password': 'admin123', 'group': 'gamma'})
+    assert response.status_code == 200
+
+def test_cache_entries_are_per_group(app):
+    with tenant_context('alpha'):
+        cache.set('tests', 'key', 'alpha')
+    with tenant_context('beta'):
+        assert cache.get('tests', 'key') is None
+        cache.set('tests', 'key', 'beta')
+        cache.invalidate('tests')
+    with tenant_context('alpha'):
+        assert cache.get('tests', 'key') == 'alpha'
+
+def test_a_failing_or_slow_group_does_not_hide_the_others(app):
+    release = threading.Event()
+
+    def work():
+        tenant = current_tenant()
+        if tenant == 'alpha':
+            raise RuntimeError('base indisponible')
+        if tenant == 'beta':
+            release.wait(5)
+        return tenant
+
+    with app.app_context():
+        try:
+            results, errors = map_tenants(work, timeout=0.2)
+        finally:
+            release.set()
+        assert results == {}
+        assert isinstance(errors['alpha'], RuntimeError)
+        assert isinstance(errors['beta'], TimeoutError)
+
+        results, errors = map_tenants(lambda: Record.query.count(), tenants=['beta'])
+        assert list(results) == ['beta'] and errors == {}
+
+@pytest.mark.parametrize('group, status', [('', 200), ('alpha', 302)])
+def test_group_overview_only_from_the_default_database(app, group, status):
+    response = login(app, group).get('/admin/tenants')
+    assert response.status_code == status
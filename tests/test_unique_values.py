@@ -0,0 +1,94 @@
+import pytest
+
+from app import db
+from helpers import RecordValidationError, create_record
+from models import Record, RecordValue, Table
+from conftest import form_data, make_table
+
+DUPLICATE = 'La valeur "Castor" existe déjà pour le champ "Totem".'
+
+def make_totems_table(app, *totems):
+    """Table with a unique totem field, and a record for each given totem"""
+    with app.app_context():
+        table = make_table(('nom', 'text'), ('totem', 'text', {'unique': True}))
+        field_ids = [field.id for field in table.fields]
+        record_ids = [
+            create_record(table.id, table.fields, form_data(table, nom=f'Scout {number}', totem=totem), 1)
+            for number, totem in enumerate(totems, start=1)
+        ]
+        db.session.commit()
+        return table.id, field_ids, record_ids
+
+def totems(app, table_id):
+    with app.app_context():
+        return sorted(
+            value.text_value for value in RecordValue.query.join(Record).filter(Record.table_id == table_id)
+            if value.field.name == 'totem'
+        )
+
+def test_create_record_rejects_a_duplicate(app):
+    table_id, _, _ = make_totems_table(app, 'Castor')
+
+    with app.app_context():
+        table = db.session.get(Table, table_id)
+        with pytest.raises(RecordValidationError) as raised:
+            create_record(table_id, table.fields, form_data(table, nom='Scout 2', totem='Castor'), 1)
+        db.session.rollback()
+
+    assert str(raised.value) == DUPLICATE
+    assert totems(app, table_id) == ['Castor']
+
+def test_add_form_flashes_the_duplicate(app, client):
+    table_id, (nom, totem), _ = make_totems_table(app, 'Castor')
+
+    response = client.post(f'/tables/{table_id}/add', data={
+        f'field_{nom}': 'Scout 2', f'field_{totem}': 'Castor'
+    }, follow_redirects=True)
+
+    assert DUPLICATE.replace('"', '&#34;') in response.get_data(as_text=True)
+    assert totems(app, table_id) == ['Castor']
+
+def test_api_rejects_a_duplicate(app, client):
+    table_id, _, _ = make_totems_table(app, 'Castor')
+
+    response = client.post(f'/api/tables/{table_id}/records', json={'values': {'nom': 'Scout 2', 'totem': 'Castor'}})
+
+    assert response.status_code == 422
+    assert response.get_json() == {'success': False, 'message': DUPLICATE}
+    assert totems(app, table_id) == ['Castor']
+
+@pytest.mark.parametrize('existing, batch', [
+    (['Castor'], ['Renard', 'Castor']),
+    ([], ['Renard', 'Castor', 'Castor']),
+], ids=['existing', 'within-batch'])
+def test_bulk_create_rejects_a_duplicate_and_creates_nothing(app, client, existing, batch):
+    table_id, _, _ = make_totems_table(app, *existing)
+    records = [{'values': {'nom': f'Scout {number}', 'totem': totem}} for number, totem in enumerate(batch)]
+
+    response = client.post(f'/api/tables/{table_id}/records/bulk', json={'records': records})
+
+    assert response.status_code == 422
+    assert response.get_json() == {'success': False, 'message': f'Ligne {len(batch)} : {DUPLICATE}'}
+    assert totems(app, table_id) == existing
+
+def test_edit_rejects_a_duplicate_and_changes_nothing(app, client):
+    table_id, (nom, totem), (_, record_id) = make_totems_table(app, 'Castor', 'Renard')
+
+    response = client.post(f'/tables/{table_id}/records/{record_id}/edit', data={
+        f'field_{nom}': 'Scout 2', f'field_{totem}': 'Castor', 'version': 1
+    }, follow_redirects=True)
+
+    assert DUPLICATE.replace('"', '&#34;') in response.get_data(as_text=True)
+    assert totems(app, table_id) == ['Castor', 'Renard']
+    with app.app_context():
+        assert db.session.get(Record, record_id).version == 1
+
+def test_edit_keeping_its_own_value_is_saved(app, client):
+    table_id, (nom, totem), (record_id,) = make_totems_table(app, 'Castor')
+
+    client.post(f'/tables/{table_id}/records/{record_id}/edit', data={
+        f'field_{nom}': 'Scout renommé', f'field_{totem}': 'Castor', 'version': 1
+    })
+
+    with app.app_context():
+        assert db.session.get(Record, record_id).version == 2